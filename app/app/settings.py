@@ -77,9 +77,67 @@ ASGI_APPLICATION = 'app.asgi.application'
 
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels.layers.InMemoryChannelLayer'
+        'BACKEND': 'gui.channel_layers.SQLiteChannelLayer',
+        'CONFIG': {
+            'path': BASE_DIR / 'channels.sqlite3',
+        },
     }
 }
+# The SQLite channel layer is shared by all daphne processes on the host, so multiplayer rooms work with several workers.
+# Use 'channels.layers.InMemoryChannelLayer' for a single process.
+
+MULTIPLAYER_PUSH_QUESTIONS = True
+# With True the multiplayer questions are sent over the websocket with their answers and the players' browsers render them,
+# with False the browsers load the page of every question.
+MULTIPLAYER_QUESTION_TIME_LIMIT = 60
+# Seconds the players of a multiplayer game have to answer a question without its own time limit. When the time runs out the game
+# moves to the next question without waiting for the players who have not answered. 0 waits for all players.
+MULTIPLAYER_HEARTBEAT_INTERVAL = 60
+# Seconds between the heartbeats of the multiplayer rooms with players connected to this process.
+MULTIPLAYER_SESSION_STALE_AFTER = 600
+# Seconds without a checkpoint or a heartbeat after which an active multiplayer session is stale(e.g. its worker crashed). Stale sessions
+# are not listed, and the reaper deactivates and archives them.
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    },
+    'shared': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': BASE_DIR / 'shared_cache',
+    },
+}
+# The default cache is per process. The shared one is seen by all worker processes on the host and keeps the values every worker
+# must agree on, e.g. the versions of the cached quiz content.
+
+QUIZ_CONTENT_VERSION_CACHE = 'shared'
+# Cache holding the versions of the quiz content. It must be shared by all workers, so an edit invalidates the content in all of them.
+LEADERBOARD_VERSION_CACHE = 'shared'
+# Cache holding the version of the scores. Every score change updates it and the in-process leaderboard index of every worker is
+# rebuilt when it sees a new version, so changes made by other workers or by management commands are never missed.
+
+QUIZ_CONTENT_CACHE_TIMEOUT = 60 * 60 * 24
+# Seconds the content of a quiz(questions and answers) stays in the cache. Edits invalidate it immediately by bumping the quiz version.
+
+CHART_CACHE_MAX_ENTRIES = 256
+# Maximum number of rendered statistics charts kept in memory by each worker process.
+CHART_CACHE_MAX_BYTES = 32 * 1024 * 1024
+# Maximum total size in bytes of the rendered statistics charts kept in memory by each worker process.
+
+CHART_RENDER_WORKERS = 2
+# Number of processes rendering statistics charts. With 0 the charts are rendered inline in the request thread.
+CHART_RENDER_TIMEOUT = 10
+# Seconds a request waits for its chart to be rendered before it gets a 503 response.
+CHART_RENDER_MAX_PENDING = 16
+# Maximum number of charts waiting to be rendered, further requests get a 503 response right away.
+
+POINTS_MOVING_AVERAGE_DAYS = 7
+# Number of days of the moving average of the points earned per day, shown in the statistics of the player.
+
+SCORE_EVENTS_DEFERRED = False
+# Off by default: finishing a quiz still updates the Player and PointsPerDay rows right away. With True it only appends a ScoreEvent and the score of the player is updated later by `python manage.py rollup_score_events`.
+SCORE_EVENTS_ROLLUP_BATCH_SIZE = 1000
+# Number of score events rolled up into the scores and the points per day in one transaction.
 
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
@@ -151,6 +209,26 @@ EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_PASSWORD')
 LOGIN_REDIRECT_URL = '/'
 LOGOUT_REDIRECT_URL = '/login'
 
+PLAYER_LEVELS = [
+    (0, 'Beginner'),
+    (11, 'Medium'),
+    (21, 'Good'),
+    (31, 'Very good'),
+    (41, 'Impressive'),
+    (51, 'Fighting for the top'),
+    (61, 'Master'),
+]
+# Minimum score for each player level, in ascending order. Run `python manage.py recompute_player_levels` after changing it.
+PLAYER_LOWEST_LEVEL = 'Noob'
+# Level of the players whose score is below the first threshold in PLAYER_LEVELS.
+
+LEADERBOARD_PAGE_SIZE = 50
+# Number of players shown on one page of the leaderboard and returned by one call to the leaderboard API.
+LEADERBOARD_NEIGHBOURS = 2
+# Number of players shown above and below the current player in the "Around you" table of the leaderboard page.
+MULTIPLAYER_LEADERBOARD_MAX_AGE = 60
+# Seconds browsers reuse the multiplayer leaderboard page before loading it again.
+
 SESSION_COOKIE_AGE = 60 * 60 * 24 * 7
 # The value is in seconds. It is the number of seconds that a session will last. In this case, it is 7 days.
 #SESSION_SAVE_EVERY_REQUEST = True
@@ -2,24 +2,67 @@ from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as BaseUserAdmin
 from django.contrib.auth.models import User
 
-from gui.models import Player, Question, Quiz, Answer, Category, QuizAttempt, Forum, Discussion, PointsPerDay, MultiPlayerSession
+from gui.models import Player, Question, Quiz, Answer, Category, QuizAttempt, Forum, Discussion, PointsPerDay, MultiPlayerSession, MultiplayerResult, ScoreEvent
+from gui.quiz_cache import bump_quiz_content_version_for
+from gui.leaderboard import invalidate_leaderboard_index
+
+
+class QuizContentAdmin(admin.ModelAdmin):
+    """Admin of quizzes, questions and answers that invalidates the cached quiz content on every change."""
+
+    def save_model(self, request, obj, form, change):
+        if change:
+            bump_quiz_content_version_for(type(obj).objects.get(pk=obj.pk)) # the element may be moved to another quiz
+        super().save_model(request, obj, form, change)
+        bump_quiz_content_version_for(obj)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        bump_quiz_content_version_for(form.instance)
+
+    def delete_model(self, request, obj):
+        bump_quiz_content_version_for(obj)
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        for obj in queryset:
+            bump_quiz_content_version_for(obj)
+        super().delete_queryset(request, queryset)
+
+
+class PlayerAdmin(admin.ModelAdmin):
+    """Admin of players that invalidates the leaderboard indexes of all processes, as the score may be edited."""
+
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        invalidate_leaderboard_index()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        invalidate_leaderboard_index()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        invalidate_leaderboard_index()
 
 
 class AnswerInLine(admin.TabularInline):
     model = Answer
 
 
-class QuestionAdmin(admin.ModelAdmin):
+class QuestionAdmin(QuizContentAdmin):
     inlines = [AnswerInLine]
 
-admin.site.register(Player)
+admin.site.register(Player, PlayerAdmin)
 admin.site.register(Question, QuestionAdmin)
-admin.site.register(Answer)
-admin.site.register(Quiz)
+admin.site.register(Answer, QuizContentAdmin)
+admin.site.register(Quiz, QuizContentAdmin)
 admin.site.register(Category)
 admin.site.register(QuizAttempt)
 admin.site.register(Forum)
 admin.site.register(Discussion)
 admin.site.register(PointsPerDay)
 admin.site.register(MultiPlayerSession)
+admin.site.register(ScoreEvent)
+admin.site.register(MultiplayerResult)
 # admin.site.register(QuestionResponse)
\ No newline at end of file
@@ -0,0 +1,234 @@
+"""Channel layer shared by all worker processes of the host without an external service. The messages and the group memberships are
+kept in a SQLite database file in WAL mode, so a group_send in one daphne process reaches the consumers of the group in every process.
+
+Every process receives the messages of its consumers with a single poller that reads all of them at once. It checks
+PRAGMA data_version first, which changes only when another process commits, so an idle poll does not read any table."""
+
+import asyncio
+import json
+import sqlite3
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+from channels.exceptions import ChannelFull
+from channels.layers import BaseChannelLayer
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS channel_messages (
+    id INTEGER PRIMARY KEY,
+    channel TEXT NOT NULL,
+    inbox TEXT NOT NULL,
+    message TEXT NOT NULL,
+    expires REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS channel_messages_inbox ON channel_messages (inbox, id);
+CREATE INDEX IF NOT EXISTS channel_messages_channel ON channel_messages (channel, expires);
+CREATE INDEX IF NOT EXISTS channel_messages_expires ON channel_messages (expires);
+CREATE TABLE IF NOT EXISTS channel_groups (
+    "group" TEXT NOT NULL,
+    channel TEXT NOT NULL,
+    inbox TEXT NOT NULL,
+    expires REAL NOT NULL,
+    PRIMARY KEY ("group", channel)
+);
+'''
+
+SEND = '''
+INSERT INTO channel_messages (channel, inbox, message, expires) SELECT ?, ?, ?, ?
+WHERE (SELECT COUNT(*) FROM channel_messages WHERE channel = ? AND expires > ?) < ?
+'''
+
+GROUP_SEND = '''
+INSERT INTO channel_messages (channel, inbox, message, expires) SELECT channel_groups.channel, channel_groups.inbox, ?, ?
+FROM channel_groups WHERE channel_groups."group" = ? AND channel_groups.expires > ?
+AND (SELECT COUNT(*) FROM channel_messages WHERE channel_messages.channel = channel_groups.channel AND channel_messages.expires > ?) < ?
+'''
+
+
+class ReceiveState:
+    """Messages fetched for the receivers of one event loop - a queue per channel, the number of receivers waiting on every inbox
+    and on every channel, and the poller task."""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.queues = defaultdict(asyncio.Queue)
+        self.inboxes = defaultdict(int)
+        self.receivers = defaultdict(int)
+        self.wakeup = asyncio.Event()
+        self.poller = None
+
+
+class SQLiteChannelLayer(BaseChannelLayer):
+    """Channel layer backed by a SQLite database file. All processes using the same path share the channels and the groups.
+    Messages must be JSON serializable. The database is used only from one thread per process, so the event loop never blocks on it."""
+
+    extensions = ['groups', 'flush']
+
+    def __init__(self, path='channels.sqlite3', expiry=60, group_expiry=86400, capacity=100, channel_capacity=None, poll_interval=0.01, **kwargs):
+        super().__init__(expiry=expiry, capacity=capacity, channel_capacity=channel_capacity, **kwargs)
+        self.channel_capacity = self.compile_capacities(self.channel_capacity)
+        self.path = str(path)
+        self.group_expiry = group_expiry
+        self.poll_interval = poll_interval
+        self.client_prefix = uuid.uuid4().hex[:12]
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-channel-layer')
+        self._connection = None
+        self._data_version = None
+        self._local_writes = 0
+        self._fetched_local_writes = 0
+        self._receive_state = None
+
+    # Database access, always in the executor thread
+
+    def _connect(self):
+        if self._connection is None:
+            connection = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            connection.execute('PRAGMA journal_mode=WAL')
+            connection.execute('PRAGMA synchronous=NORMAL')
+            connection.executescript(SCHEMA)
+            self._connection = connection
+        return self._connection
+
+    def _write(self, query, parameters):
+        cursor = self._connect().execute(query, parameters)
+        self._local_writes += 1 # the own commits do not change the data_version of the connection
+        return cursor.rowcount
+
+    def _fetch(self, inboxes, refresh):
+        """Removes and returns the messages of the inboxes, in the order they were sent. inboxes maps every inbox to the number of
+        messages to take - None takes all messages of the inbox of the process, a named channel shared by processes gets one message
+        per waiting receiver. Without refresh it returns nothing if no process has written to the database since the last fetch."""
+        connection = self._connect()
+        version = connection.execute('PRAGMA data_version').fetchone()[0]
+        if not refresh and version == self._data_version and self._local_writes == self._fetched_local_writes:
+            return []
+        self._data_version = version
+        self._fetched_local_writes = self._local_writes
+
+        pending = f'SELECT 1 FROM channel_messages WHERE inbox IN ({",".join("?" * len(inboxes))}) LIMIT 1'
+        if not connection.execute(pending, list(inboxes)).fetchone():
+            return [] # the write lock is taken only when there is something to take
+        now = time.time()
+        rows = []
+        connection.execute('BEGIN IMMEDIATE')
+        try:
+            for inbox, limit in inboxes.items():
+                rows += connection.execute(
+                    'SELECT id, channel, message, expires FROM channel_messages WHERE inbox = ? ORDER BY id LIMIT ?', (inbox, limit or -1)
+                ).fetchall()
+            connection.executemany('DELETE FROM channel_messages WHERE id = ?', [(row[0],) for row in rows])
+            connection.execute('DELETE FROM channel_messages WHERE expires < ?', (now,))
+            connection.execute('COMMIT')
+        except BaseException:
+            connection.execute('ROLLBACK')
+            raise
+        rows.sort()
+        return [(channel, json.loads(message)) for _, channel, message, expires in rows if expires >= now]
+
+    async def _run(self, function, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, function, *args)
+
+    # Channel layer API
+
+    async def send(self, channel, message):
+        """Sends a message onto a channel. Raises ChannelFull if the channel already has its capacity of messages."""
+        assert isinstance(message, dict), 'message is not a dict'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        assert '__asgi_channel__' not in message
+
+        now = time.time()
+        sent = await self._run(self._write, SEND, (
+            channel, self.non_local_name(channel), json.dumps(message), now + self.expiry, channel, now, self.get_capacity(channel)
+        ))
+        if not sent:
+            raise ChannelFull(channel)
+        self._wake_up_receivers()
+
+    async def receive(self, channel):
+        """Receives the first message that arrives on the channel. The messages of all channels of this process are fetched by one poller."""
+        assert self.valid_channel_name(channel)
+        state = self._get_receive_state()
+        inbox = self.non_local_name(channel)
+
+        queue = state.queues[channel]
+        state.inboxes[inbox] += 1
+        state.receivers[channel] += 1
+        state.wakeup.set() # a new inbox is polled right away
+        if state.poller is None or state.poller.done():
+            state.poller = asyncio.ensure_future(self._poll(state))
+        try:
+            return await queue.get()
+        finally:
+            state.inboxes[inbox] -= 1
+            state.receivers[channel] -= 1
+            if not state.inboxes[inbox]:
+                del state.inboxes[inbox]
+            if not state.receivers[channel]:
+                del state.receivers[channel]
+                if queue.empty():
+                    del state.queues[channel]
+
+    async def new_channel(self, prefix='specific'):
+        return f'{prefix}.{self.client_prefix}!{uuid.uuid4().hex}'
+
+    async def flush(self):
+        await self._run(self._write, 'DELETE FROM channel_messages', ())
+        await self._run(self._write, 'DELETE FROM channel_groups', ())
+
+    async def close(self):
+        pass
+
+    # Groups extension
+
+    async def group_add(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await self._run(self._write, 'INSERT OR REPLACE INTO channel_groups ("group", channel, inbox, expires) VALUES (?, ?, ?, ?)', (
+            group, channel, self.non_local_name(channel), time.time() + self.group_expiry
+        ))
+
+    async def group_discard(self, group, channel):
+        assert self.valid_group_name(group), 'Group name not valid'
+        assert self.valid_channel_name(channel), 'Channel name not valid'
+        await self._run(self._write, 'DELETE FROM channel_groups WHERE "group" = ? AND channel = ?', (group, channel))
+
+    async def group_send(self, group, message):
+        """Sends the message to every channel of the group, in every process, with one insert. Full channels do not get it."""
+        assert isinstance(message, dict), 'Message is not a dict'
+        assert self.valid_group_name(group), 'Group name not valid'
+
+        now = time.time()
+        await self._run(self._write, GROUP_SEND, (json.dumps(message), now + self.expiry, group, now, now, self.capacity))
+        self._wake_up_receivers()
+
+    # Receiving
+
+    def _get_receive_state(self):
+        """The receive state of the running event loop. Queues can not be shared between event loops, so a layer used from
+        a new event loop(e.g. by async_to_sync in tests) starts with a new state."""
+        loop = asyncio.get_running_loop()
+        if self._receive_state is None or self._receive_state.loop is not loop:
+            self._receive_state = ReceiveState(loop)
+        return self._receive_state
+
+    def _wake_up_receivers(self):
+        """Messages sent from the event loop of the receivers are fetched at once instead of after the poll interval."""
+        state = self._receive_state
+        if state is not None and state.loop is asyncio.get_running_loop():
+            state.wakeup.set()
+
+    async def _poll(self, state):
+        while state.inboxes:
+            refresh = state.wakeup.is_set()
+            state.wakeup.clear()
+            inboxes = {inbox: None if inbox.endswith('!') else receivers for inbox, receivers in state.inboxes.items()}
+            messages = await self._run(self._fetch, inboxes, refresh)
+            for channel, message in messages:
+                state.queues[channel].put_nowait(message)
+            if not messages:
+                try:
+                    await asyncio.wait_for(state.wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
@@ -0,0 +1,70 @@
+import hashlib
+import json
+import time
+from collections import OrderedDict, namedtuple
+from threading import Lock
+from django.conf import settings
+from gui.chart_renderer import chart_renderer
+
+CachedChart = namedtuple('CachedChart', ['png', 'etag', 'last_modified'])
+
+
+def get_chart_key(name, data):
+    """Hash of the chart name and everything that is plotted(data, title, labels). Equal charts get equal keys."""
+    serialized = json.dumps([name, data], default=str, sort_keys=True)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+class ChartCache:
+    """LRU cache of rendered PNG charts, limited both by number of charts and by their total size in bytes."""
+
+    def __init__(self, max_entries, max_bytes):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._charts = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._charts)
+
+    def get(self, key):
+        with self._lock:
+            chart = self._charts.get(key)
+            if chart is not None:
+                self._charts.move_to_end(key)
+            return chart
+
+    def set(self, key, png):
+        chart = CachedChart(png=png, etag=f'"{key}"', last_modified=time.time())
+        with self._lock:
+            old_chart = self._charts.pop(key, None)
+            if old_chart is not None:
+                self.size -= len(old_chart.png)
+            if len(png) > self.max_bytes:
+                return chart # too big to be cached at all
+
+            self._charts[key] = chart
+            self.size += len(png)
+            while len(self._charts) > self.max_entries or self.size > self.max_bytes:
+                _, evicted = self._charts.popitem(last=False)
+                self.size -= len(evicted.png)
+        return chart
+
+    def clear(self):
+        with self._lock:
+            self._charts.clear()
+            self.size = 0
+
+
+chart_cache = ChartCache(max_entries=settings.CHART_CACHE_MAX_ENTRIES, max_bytes=settings.CHART_CACHE_MAX_BYTES)
+
+
+def get_cached_chart(plot_name, args):
+    """Returns the chart drawn by the plot with the name in gui.charts from the cache, rendering it in the chart rendering pool
+    only on a cache miss. Raises ChartRenderError if the chart could not be rendered in time."""
+    key = get_chart_key(plot_name, args)
+    chart = chart_cache.get(key)
+    if chart is None:
+        chart = chart_cache.set(key, chart_renderer.render(plot_name, args))
+    return chart
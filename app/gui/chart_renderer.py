@@ -0,0 +1,84 @@
+"""Chart rendering service. Charts are rendered in a pool of worker processes, so rendering does not hold the GIL of the
+web worker and statistics traffic can not starve quiz-play requests. Callers wait for the result only up to a timeout."""
+
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from threading import Lock
+from django.conf import settings
+
+
+class ChartRenderError(Exception):
+    """The chart could not be rendered in time - the pool is busy, timed out or crashed."""
+
+
+def render_chart_job(plot_name, args):
+    """Job executed in the worker processes. gui.charts(and matplotlib) is imported only there."""
+    from gui.charts import render_chart
+
+    return render_chart(plot_name, args)
+
+
+class ChartRenderer:
+    """Process pool for chart rendering that limits the number of pending jobs. The pool is started lazily on the first job."""
+
+    def __init__(self, workers, timeout, max_pending):
+        self.workers = workers
+        self.timeout = timeout
+        self.max_pending = max_pending
+        self.pending = 0
+        self._executor = None
+        self._lock = Lock()
+
+    def get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                # spawn instead of fork - the web worker may run threads(daphne, database_sync_to_async) that fork does not copy safely
+                self._executor = ProcessPoolExecutor(max_workers=self.workers, mp_context=multiprocessing.get_context('spawn'))
+            return self._executor
+
+    def job_done(self, future):
+        with self._lock:
+            self.pending -= 1
+
+    def submit(self, plot_name, args):
+        """Submits a rendering job and returns its future. Raises ChartRenderError if too many jobs are already pending."""
+        executor = self.get_executor()
+        with self._lock:
+            if self.pending >= self.max_pending:
+                raise ChartRenderError('Too many charts are being rendered.')
+            self.pending += 1
+        try:
+            future = executor.submit(render_chart_job, plot_name, args)
+        except BrokenProcessPool as error:
+            self.job_done(None)
+            self.reset()
+            raise ChartRenderError('The chart rendering pool crashed.') from error
+        future.add_done_callback(self.job_done)
+        return future
+
+    def render(self, plot_name, args):
+        """Renders the chart and returns its PNG bytes, waiting at most the timeout. Without workers the chart is rendered inline."""
+        if not self.workers:
+            return render_chart_job(plot_name, args)
+
+        future = self.submit(plot_name, args)
+        try:
+            return future.result(timeout=self.timeout)
+        except TimeoutError as error:
+            future.cancel() # frees the slot if the job has not started yet
+            raise ChartRenderError('Rendering of the chart timed out.') from error
+        except BrokenProcessPool as error:
+            self.reset()
+            raise ChartRenderError('The chart rendering pool crashed.') from error
+
+    def reset(self):
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
+
+
+chart_renderer = ChartRenderer(
+    workers=settings.CHART_RENDER_WORKERS, timeout=settings.CHART_RENDER_TIMEOUT, max_pending=settings.CHART_RENDER_MAX_PENDING
+)
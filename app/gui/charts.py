@@ -0,0 +1,55 @@
+"""Rendering of the statistics charts. It imports matplotlib, so it is imported lazily, only by the processes that
+actually render a chart - the rest of the application never pays for loading matplotlib.
+Charts are drawn with the object-oriented Figure API, without the global pyplot state, so rendering is thread-safe."""
+
+from io import BytesIO
+from matplotlib.figure import Figure
+
+def get_graph(figure):
+    """Function that saves the figure as a PNG in memory and returns the bytes of the image."""
+
+    buffer = BytesIO() # creates an in-memory buffer
+    figure.savefig(buffer, format='png') # saves the figure to the buffer in PNG format, Figure uses the non-interactive Agg canvas by default
+    image_png = buffer.getvalue() # reads the content of the buffer
+    buffer.close() # closes the buffer to free up system resources
+    return image_png
+
+def plot_decorator(func):
+    def wrapper(x, y, title, x_label, y_label):
+        figure = Figure(figsize=(10, 5)) # creates a new figure with a width of 10 inches and a height of 5 inches
+        axes = figure.subplots()
+        axes.set_title(title, fontsize=25, fontname="Baskerville Old Face")
+        func(axes, x, y)
+        axes.tick_params(axis='x', labelrotation=45)
+        axes.set_xlabel(x_label, fontsize=15, fontname="Baskerville Old Face")
+        axes.set_ylabel(y_label, fontsize=15, fontname="Baskerville Old Face")
+        figure.tight_layout()
+        return get_graph(figure)
+    return wrapper
+
+@plot_decorator
+def get_plot_for_per_player_since_registration(axes, x, y):
+    daily, moving_average = y
+    axes.bar(x, daily, color='orange', edgecolor='black', label='Points')
+    axes.plot(x, moving_average, color='black', label='Moving average')
+    axes.legend()
+
+@plot_decorator
+def get_plot_for_each_quiz_score(axes, x, y):
+    """Box plot of the score distribution of each quiz, drawn from the aggregated statistics instead of the raw attempts."""
+    if y: # matplotlib can not draw a box plot without boxes
+        axes.bxp([
+            {'label': label, 'whislo': stats['min'], 'q1': stats['p25'], 'med': stats['p50'], 'q3': stats['p75'], 'whishi': stats['max'], 'mean': stats['mean'], 'fliers': []}
+            for label, stats in zip(x, y)
+        ], showmeans=True, patch_artist=True, boxprops={'facecolor': 'orange'})
+    axes.grid(True)
+
+
+PLOTS = {
+    'per_player_since_registration': get_plot_for_per_player_since_registration,
+    'each_quiz_score': get_plot_for_each_quiz_score,
+}
+
+def render_chart(plot_name, args):
+    """Function that draws the plot with the name and returns the PNG bytes of the chart."""
+    return PLOTS[plot_name](*args)
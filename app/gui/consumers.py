@@ -1,13 +1,35 @@
 from channels.db import database_sync_to_async
-from gui.models import QuizAttempt, Player, MultiPlayerSession, Question, Answer, QuestionResponse, Quiz, QuestionType
+from gui.models import Player, MultiPlayerSession, QuestionType
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
 import json
 from django.urls import reverse
+from django.conf import settings
+from gui.instrumentation import protocol_stats
+from gui.scheduler import room_scheduler, room_heartbeat
+from gui.rooms import rooms, discard_room_state, checkpoint_game_started, checkpoint_question_advanced
+from gui.rooms import join_room_step, save_answer_step, leave_room_step, finish_game_step
 
 class QuizConsumer(AsyncJsonWebsocketConsumer):
+    """Multiplayer game. The game is played on the in-memory RoomState of the room(see gui.rooms) - answers are checked against the cached
+    quiz content and recorded in the room state, and the database is written only at the checkpoints of the game.
+    All database access goes through the protocol steps of gui.rooms, one thread hop per step.
+    Questions with a time limit have a deadline in gui.scheduler - when it passes the room moves on without the missing answers."""
+
+    async def dispatch(self, message):
+        self.current_message = message['type']
+        try:
+            await super().dispatch(message)
+        finally:
+            protocol_stats.record_message(self.current_message)
+
+    async def database(self, step, *args):
+        """Runs the sync protocol step in one database_sync_to_async call."""
+        return await database_sync_to_async(protocol_stats.instrument(self.current_message, step))(*args)
+
     async def connect(self):
         self.room_code = self.scope['url_route']['kwargs']['room_code']
         self.room_group_name = f'quiz_{self.room_code}'
+        self.room = None
 
         # Add the player to the group
         await self.channel_layer.group_add(
@@ -19,39 +41,46 @@ class QuizConsumer(AsyncJsonWebsocketConsumer):
         print(f"Connected to room: {self.room_group_name}")
 
         try:
-            self.multiplayer = await self.get_multiplayer_session()
-            self.player = await self.get_player()
-            self.quiz = await database_sync_to_async(lambda: self.multiplayer.quiz)()
-        except MultiPlayerSession.DoesNotExist or Player.DoesNotExist or Quiz.DoesNotExist:
-            print("Session or player or quiz does not exist")
+            self.multiplayer, self.player, self.content, room = await self.database(join_room_step, self.room_code, self.scope['user'])
+        except (MultiPlayerSession.DoesNotExist, Player.DoesNotExist):
+            print("Session or player does not exist")
             await self.close()
             return
-        
-        await self.create_or_update_quiz_attempt()
-        await self.add_player_to_session()
+        self.quiz = self.content.quiz
+        self.question_order = self.content.question_order
 
-        if await self.is_creator() or not self.multiplayer.started:
+        self.room = room
+        room_heartbeat.start()
+        self.pending_answer = None # (question id, answer ids) of the answer to the current question, saved at the next checkpoint
+        await self.update_room('room_player_joined', player_id=self.player.id, username=self.player.user.username, score=self.player.active_attempt.score)
+
+        if self.multiplayer.creator_id == self.player.id or not self.room.started:
             await self.send_start_game_massage()
         else:
-            if self.multiplayer.started:
-                await self.send_question_if_game_already_started()
+            await self.send_question_if_game_already_started()
 
     async def disconnect(self, close_code):
-        await self.remove_player_from_session()
-
-        if await database_sync_to_async(self.multiplayer.players.count)() == 0:
-            await self.stop_session()
+        if self.room is not None:
+            room_scheduler.unwatch(self.room_code, self.question_deadline_passed)
+            pending_answer, self.pending_answer = self.pending_answer, None
+            await self.database(leave_room_step, self.multiplayer, self.player, self.content, pending_answer)
+            await self.update_room('room_player_left', player_id=self.player.id)
+            if not self.room.roster:
+                discard_room_state(self.room_code)
+            if not rooms:
+                room_heartbeat.stop()
 
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
         )
         print(f"Disconnected from room: {self.room_group_name}")
-        
+
 
     async def receive(self, text_data):
         text_data_json = json.loads(text_data)
         message_type = text_data_json['type']
+        self.current_message = f'websocket.receive.{message_type}'
 
         if message_type == 'start_game':
             await self.start_game()
@@ -59,44 +88,111 @@ class QuizConsumer(AsyncJsonWebsocketConsumer):
             await self.submit_answer(text_data_json)
 
     async def start_game(self):
-        try:
-            if not self.multiplayer.started:
-                await self.set_session_started()
-                await self.send_first_question()
-            else:
-                print("second start does not exist in real life bro")
-        except Exception as e:
-            print(f"Error starting game: {e}")
+        first_question_id = self.question_order.first()
+        if not first_question_id:
+            await self.close()
+            return
+
+        if self.room.started or not await self.database(checkpoint_game_started, self.room_code, first_question_id):
+            print("second start does not exist in real life bro")
+            return
+
+        await self.channel_layer.group_send(self.room_group_name, self.get_show_question_message(first_question_id))
 
     async def submit_answer(self, event):
-        answer_ids = event.get('answer_ids', [])
+        answer_ids = {str(answer_id) for answer_id in event.get('answer_ids', [])}
         if not answer_ids:
             print("No answers provided")
             return
 
-        try:
-            answers = await self.get_answers(answer_ids)
-            print("before")
-            await self.create_question_response_and_update_score(answers)
-
-            if await self.check_if_all_players_have_answered():
-                print("after")
-                next_question = await self.get_next_question()
-                if next_question:
-                    await self.send_next_question(next_question)
-                else:
-                    await self.send_results()
-        except Exception as e:
-            print(f"Error submitting answer: {e}")
-            
-    def serialize_question(self, question, quiz):
-        return {
+        question_id = self.room.current_question_id
+        answers = [answer for answer in self.content.get_answers(question_id) if str(answer.id) in answer_ids]
+        if not answers:
+            print("No answers of the current question provided")
+            return
+
+        points = sum(answer.points for answer in answers if answer.is_correct)
+        if not self.room.record_answer(self.player.id, question_id, points):
+            return # the player has already answered the question
+
+        answer = (question_id, [answer.id for answer in answers])
+        if self.question_order.next(question_id) is None:
+            await self.database(save_answer_step, self.player, self.content, answer) # saved before the game can be finished
+        else:
+            self.pending_answer = answer
+        await self.update_room('room_answer', player_id=self.player.id, question_id=question_id, points=points)
+
+    def serialize_question(self, question):
+        """The question for the clients. With MULTIPLAYER_PUSH_QUESTIONS it has its answers(without the correct ones), so the clients
+        render it right away - otherwise they load the page of the question from the url."""
+        serialized = {
         'id': question.id,
         'text': question.question,
-        'url': reverse('view_single_choice_question', kwargs={'quiz_id': quiz.id, 'question_id': question.id}) 
-        if question.question_type == QuestionType.SINGLE_CHOICE.value  
-        else reverse('view_multiple_choice_question', kwargs={'quiz_id': quiz.id, 'question_id': question.id}),
-    }
+        'url': reverse('view_single_choice_question', kwargs={'quiz_id': self.quiz.id, 'question_id': question.id})
+        if question.question_type == QuestionType.SINGLE_CHOICE.value
+        else reverse('view_multiple_choice_question', kwargs={'quiz_id': self.quiz.id, 'question_id': question.id}),
+        'time_limit': question.get_time_limit(),
+        }
+        if settings.MULTIPLAYER_PUSH_QUESTIONS:
+            serialized.update({
+                'question_type': question.question_type,
+                'is_last': self.question_order.next(question.id) is None,
+                'answers': [{'id': answer.id, 'text': answer.answer} for answer in self.content.get_answers(question.id)],
+            })
+        return serialized
+
+    def get_show_question_message(self, question_id):
+        """Group message that moves the room to the question. It carries the text frame sent to the clients, so the question is
+        serialized once for the whole room and the consumers only forward it. The deadline of the question starts now."""
+        question = self.content.get_question(question_id)
+        return {
+            'type': 'show_question',
+            'question_id': question_id,
+            'deadline': room_scheduler.get_deadline(question.get_time_limit()),
+            'text': json.dumps({'type': 'show_question', 'question': self.serialize_question(question)}),
+        }
+
+    async def update_room(self, message_type, **change):
+        """Applies the change to the room state of this process and sends it to the consumers of the room in the other processes."""
+        await getattr(self, message_type)(change)
+        await self.channel_layer.group_send(self.room_group_name, {'type': message_type, **change})
+
+    async def room_player_joined(self, event):
+        self.room.join(event['player_id'], event['username'], event['score'])
+
+    async def room_player_left(self, event):
+        self.room.leave(event['player_id'])
+        await self.advance_if_all_players_have_answered()
+
+    async def room_answer(self, event):
+        self.room.record_answer(event['player_id'], event['question_id'], event['points'])
+        await self.advance_if_all_players_have_answered()
+
+    async def advance_if_all_players_have_answered(self):
+        if self.room.started and self.room.all_answered():
+            await self.advance_room()
+
+    async def question_deadline_passed(self, question_id):
+        """Called by the scheduler when the time to answer the question runs out."""
+        self.current_message = 'question_deadline'
+        protocol_stats.record_message(self.current_message)
+        if self.room.current_question_id == question_id:
+            await self.advance_room()
+
+    async def advance_room(self):
+        """Moves the room to the next question or to the results. The checkpoint lets only one consumer do it, even if the last answers
+        or the deadline reach consumers in different processes at the same time."""
+        if not self.room.claim_advance():
+            return
+
+        question_id = self.room.current_question_id
+        next_question_id = self.room.get_next_question_id()
+        if next_question_id is None:
+            results = await self.database(finish_game_step, self.room_code, self.quiz.id, question_id)
+            if results is not None:
+                await self.send_results(results)
+        elif await self.database(checkpoint_question_advanced, self.room_code, question_id, next_question_id):
+            await self.send_next_question(next_question_id)
 
     async def show_question(self, event):
         try:
@@ -104,175 +200,52 @@ class QuizConsumer(AsyncJsonWebsocketConsumer):
             if not question_id:
                 print("No question ID provided")
                 return
-            question = await database_sync_to_async(Question.objects.get)(id=question_id)
-            await self.set_current_question(question)
-            question_serialized = self.serialize_question(question, self.quiz)
-            await self.send_question_to_group(question_serialized)
+            await self.save_pending_answer()
+            self.room.show_question(question_id)
+            if event.get('deadline'):
+                room_scheduler.watch(self.room_code, question_id, event['deadline'], self.question_deadline_passed)
+            await self.send(text_data=event['text'])
         except Exception as e:
             print(f"Error showing question: {e}")
 
     async def show_results(self, event):
-        players = await self.get_all_players()
-        if not players:
-            print("No players found")
-            return
-        results = await self.get_results_for_all_players(players)
-        await self.send_results_to_group(results)
-
-    async def get_multiplayer_session(self):
-        return await database_sync_to_async(MultiPlayerSession.objects.get)(room_code=self.room_code)
-
-    async def create_or_update_quiz_attempt(self):
-        quiz_attempt, _ = await database_sync_to_async(QuizAttempt.objects.get_or_create)(player=self.player, quiz=self.quiz)
-        self.player.active_attempt = quiz_attempt
-        await database_sync_to_async(self.player.save)()
+        room_scheduler.cancel(self.room_code)
+        await self.send_results_to_group(event['results'])
 
-    async def add_player_to_session(self):
-        # Add player to the session
-        await database_sync_to_async(self.multiplayer.players.add)(self.player)
-        await database_sync_to_async(self.multiplayer.save)()
-
-    async def get_player(self):
-        return await database_sync_to_async(Player.objects.get)(user=self.scope['user'])
-
-    async def is_creator(self):
-        creator = await database_sync_to_async(lambda: self.multiplayer.creator)()
-        return creator == self.player
+    async def save_pending_answer(self):
+        if self.pending_answer is not None:
+            pending_answer, self.pending_answer = self.pending_answer, None
+            await self.database(save_answer_step, self.player, self.content, pending_answer)
 
     async def send_start_game_massage(self):
         await self.send(text_data=json.dumps({
                 'type': 'start_game',
                 'room_code': self.room_code
             }))
-        
+
     async def send_question_if_game_already_started(self):
-        current_question = await database_sync_to_async(lambda: self.multiplayer.current_question)()
+        current_question = self.content.get_question(self.room.current_question_id)
         if current_question:
-            question_serialized = self.serialize_question(current_question, self.quiz)
-                        
+            question_serialized = self.serialize_question(current_question)
+
             await self.send(text_data=json.dumps({
                 'type': 'show_question',
                 'question': question_serialized,
             }))
 
-    async def remove_player_from_session(self):
-        # Remove player from the session
-        await database_sync_to_async(self.multiplayer.players.remove)(self.player)
-        await database_sync_to_async(self.multiplayer.save)()
-
-    async def stop_session(self):
-        await database_sync_to_async(setattr)(self.multiplayer, "active", False)
-        await database_sync_to_async(setattr)(self.multiplayer, "started", False)
-        await database_sync_to_async(self.multiplayer.save)()
-
-    async def set_session_started(self):
-        await database_sync_to_async(setattr)(self.multiplayer, "started", True)
-        await database_sync_to_async(self.multiplayer.save)()
-
-    async def send_first_question(self):
-        first_question = await database_sync_to_async(Question.objects.filter(quiz=self.quiz).first)()
-        if not first_question:
-            self.close()
-            return
-                    
-        await self.channel_layer.group_send(
-            self.room_group_name, {
-                'type': 'show_question',
-                'question_id': first_question.id
-            })
-
-    async def set_current_question(self, question):
-        await database_sync_to_async(setattr)(self.multiplayer, "current_question", question)
-        await database_sync_to_async(self.multiplayer.save)()
-
-    async def send_question_to_group(self, question_serialized):
-        await self.send(text_data=json.dumps({
-                'type': 'show_question',
-                'question': question_serialized
-            }))
-
-    async def get_all_players(self):
-        return await database_sync_to_async(lambda: list(self.multiplayer.players.all()))()
-
-    async def get_results_for_all_players(self, players):
-        results = []
-        for player in players:
-            results.append({
-                'player_username': await database_sync_to_async(lambda: player.user.username)(),
-                'score': await database_sync_to_async(lambda: player.active_attempt.score)()
-            })
-            player.score += player.active_attempt.score
-            # May be unnecessary now, but just in case fot the future
-            # await database_sync_to_async(lambda: player.active_attempt.responses.clear())()
-            # player.active_attempt.score = 0
-            player.active_attempt = None
-            await database_sync_to_async(player.save)()
-
-        results.sort(key=lambda x: x['score'], reverse=True)
-        return results
-
     async def send_results_to_group(self, results):
         await self.send(text_data=json.dumps({
                 'type': 'show_results',
                 'results': results
         }))
 
-    async def get_answers(self, answer_ids):
-        answers = [await database_sync_to_async(Answer.objects.get)(id=ans_id) for ans_id in answer_ids]
-        return answers
-
-    async def create_and_add_question_response(self, answer):
-        question_response = await database_sync_to_async(lambda: QuestionResponse.objects.create(
-                    player=self.player,
-                    quiz=self.quiz,
-                    question=answer.question,
-                    answer=answer
-                ))()
-        await database_sync_to_async(self.player.active_attempt.responses.add)(question_response)
-
-    async def update_score_if_answer_is_correct(self, answer):
-        if answer.is_correct:
-            self.player.active_attempt.score += answer.points
-            print(f"Score: {self.player.active_attempt.score}")
-            await database_sync_to_async(self.player.active_attempt.save)()
-            
-    async def check_if_all_players_have_answered(self):
-        answered_count = 0
-        current_question = await database_sync_to_async(lambda: self.multiplayer.current_question)()
-        players = await database_sync_to_async(lambda: list(self.multiplayer.players.all()))()
-        total_players = len(players)
-
-        for player in players:
-            responses = await database_sync_to_async(lambda: list(player.active_attempt.responses.all()))()
-            for response in responses:
-                if await database_sync_to_async(lambda: response.question)() == current_question:
-                    answered_count += 1
-                    break
-
-        return answered_count == total_players
-
-    async def get_next_question(self):
-        return await database_sync_to_async(lambda: Question.objects.filter(quiz=self.quiz, id__gt=self.multiplayer.current_question.id).first())()
-
-    async def send_next_question(self, next_question):
-        await self.channel_layer.group_send(
-            self.room_group_name, {
-                'type': 'show_question',
-                'question_id': next_question.id
-            })
+    async def send_next_question(self, next_question_id):
+        await self.channel_layer.group_send(self.room_group_name, self.get_show_question_message(next_question_id))
 
-    async def send_results(self):
-        # If the current question is the last one and all players have answered, show the results
+    async def send_results(self, results):
+        # The game is finished once for the whole room, the consumers only forward its results
         await self.channel_layer.group_send(
             self.room_group_name, {
-                'type': 'show_results'
+                'type': 'show_results',
+                'results': results
             })
-
-
-    async def create_question_response_and_update_score(self, answers):
-        print("in")
-        for answer in answers:
-            await self.create_and_add_question_response(answer)
-            await self.update_score_if_answer_is_correct(answer)
-        
-        await database_sync_to_async(self.player.save)()
@@ -10,13 +10,13 @@ class CategoryForm(forms.ModelForm):
 class QuizForm(forms.ModelForm):
     class Meta:
         model = Quiz
-        fields = ['title', 'description', 'difficulty', 'category', 'max_questions', 'pass_mark']
+        fields = ['title', 'description', 'difficulty', 'category', 'max_questions', 'pass_mark', 'shuffle_questions']
 
 
 class QuestionForm(forms.ModelForm):
     class Meta:
         model = Question
-        fields = ['question', 'quiz', 'question_type']
+        fields = ['question', 'quiz', 'question_type', 'position', 'time_limit']
 
 
 class AnswerForm(forms.ModelForm):
@@ -0,0 +1,53 @@
+"""Counters of the thread hops(database_sync_to_async calls) and the database queries of QuizConsumer per protocol message.
+They are off by default and turned on by the benchmarks."""
+
+from collections import Counter
+from threading import Lock
+from django.db import connection
+
+
+class ProtocolStats:
+
+    def __init__(self):
+        self.enabled = False
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.messages = Counter()
+            self.hops = Counter()
+            self.queries = Counter()
+
+    def record_message(self, name):
+        if self.enabled:
+            with self._lock:
+                self.messages[name] += 1
+
+    def instrument(self, name, function):
+        """Wraps the sync function run in a thread hop while handling the message, so the hop and its queries are counted."""
+        if not self.enabled:
+            return function
+
+        def count_query(execute, sql, params, many, context):
+            with self._lock:
+                self.queries[name] += 1
+            return execute(sql, params, many, context)
+
+        def instrumented(*args, **kwargs):
+            with self._lock:
+                self.hops[name] += 1
+            with connection.execute_wrapper(count_query):
+                return function(*args, **kwargs)
+        return instrumented
+
+    def get_rows(self):
+        """(message, count, thread hops per message, queries per message) of every message, sorted by message."""
+        with self._lock:
+            return [
+                (name, count, self.hops[name] / count, self.queries[name] / count)
+                for name, count in sorted(self.messages.items())
+            ]
+
+
+protocol_stats = ProtocolStats()
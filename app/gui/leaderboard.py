@@ -0,0 +1,137 @@
+import time
+from bisect import bisect_left, insort
+from threading import RLock
+from django.conf import settings
+from django.core.cache import caches
+from gui.models import Player
+
+
+class LeaderboardIndex:
+    """In-process sorted leaderboard. Players are kept in a bisect-backed array sorted by descending (score, id), so the best player
+    is first and players with equal score are ordered by descending id, the same way the leaderboard page orders them.
+    A second sorted array of the distinct scores gives dense ranks, the same ranks as get_player_rank_in_leaderboard."""
+
+    def __init__(self):
+        self._lock = RLock()
+        self._entries = []          # sorted (-score, -player_id)
+        self._scores = {}           # player_id -> score
+        self._distinct_scores = []  # sorted distinct -score values
+        self._score_counts = {}     # -score -> number of players with that score
+        self.loaded = False
+        self.version = None         # version of the scores(see get_leaderboard_version) the index was loaded at
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, player_id):
+        return player_id in self._scores
+
+    def rebuild(self, players, version=None):
+        """Replaces the content of the index with the given (player_id, score) pairs."""
+        with self._lock:
+            self.version = version
+            self._scores = dict(players)
+            self._entries = sorted((-score, -player_id) for player_id, score in self._scores.items())
+            self._score_counts = {}
+            for key, _ in self._entries:
+                self._score_counts[key] = self._score_counts.get(key, 0) + 1
+            self._distinct_scores = sorted(self._score_counts)
+            self.loaded = True
+
+    def update(self, player_id, score):
+        """Adds the player to the index or moves him to the position of his new score."""
+        with self._lock:
+            old_score = self._scores.get(player_id)
+            if old_score == score:
+                return
+            if old_score is not None:
+                self._discard(player_id, old_score)
+            self._scores[player_id] = score
+            insort(self._entries, (-score, -player_id))
+            if -score not in self._score_counts:
+                insort(self._distinct_scores, -score)
+            self._score_counts[-score] = self._score_counts.get(-score, 0) + 1
+
+    def remove(self, player_id):
+        with self._lock:
+            score = self._scores.pop(player_id, None)
+            if score is not None:
+                self._discard(player_id, score)
+
+    def _discard(self, player_id, score):
+        del self._entries[bisect_left(self._entries, (-score, -player_id))]
+        self._score_counts[-score] -= 1
+        if not self._score_counts[-score]:
+            del self._score_counts[-score]
+            del self._distinct_scores[bisect_left(self._distinct_scores, -score)]
+
+    def score_of(self, player_id):
+        return self._scores.get(player_id)
+
+    def rank_of(self, player_id):
+        """Dense rank of the player(equal scores share a rank) or None if the player is not in the index."""
+        with self._lock:
+            score = self._scores.get(player_id)
+            if score is None:
+                return None
+            return bisect_left(self._distinct_scores, -score) + 1
+
+    def position_of(self, player_id):
+        """Zero based position of the player in the ordered leaderboard or None if the player is not in the index."""
+        with self._lock:
+            score = self._scores.get(player_id)
+            if score is None:
+                return None
+            return bisect_left(self._entries, (-score, -player_id))
+
+    def top(self, count):
+        """The first count (player_id, score) pairs of the leaderboard."""
+        with self._lock:
+            return [(-player_id, -key) for key, player_id in self._entries[:count]]
+
+    def neighbours(self, player_id, count):
+        """Up to count players before and after the player, together with the player himself."""
+        with self._lock:
+            position = self.position_of(player_id)
+            if position is None:
+                return []
+            start = max(position - count, 0)
+            return [(-other_id, -key) for key, other_id in self._entries[start:position + count + 1]]
+
+
+leaderboard_index = LeaderboardIndex()
+
+LEADERBOARD_VERSION_KEY = 'leaderboard-version'
+
+
+def get_leaderboard_version():
+    """Version of the scores in the shared cache(LEADERBOARD_VERSION_CACHE), changed by every process that changes a score."""
+    return caches[settings.LEADERBOARD_VERSION_CACHE].get_or_set(LEADERBOARD_VERSION_KEY, time.time_ns, timeout=None)
+
+
+def invalidate_leaderboard_index():
+    """Tells the leaderboard indexes of all processes that scores have changed - each of them is rebuilt the next time it is read."""
+    caches[settings.LEADERBOARD_VERSION_CACHE].set(LEADERBOARD_VERSION_KEY, time.time_ns(), timeout=None)
+
+
+def update_leaderboard_index(player_scores):
+    """Moves the players to their new (player_id, score) positions in the index of this process and invalidates the other ones."""
+    for player_id, score in player_scores:
+        leaderboard_index.update(player_id, score)
+    invalidate_leaderboard_index()
+
+
+def load_leaderboard_index():
+    """Rebuilds the process wide leaderboard index from the Player table. The version is read first, so a score committed while
+    the players are read changes the version again and the index is rebuilt once more."""
+    version = get_leaderboard_version()
+    leaderboard_index.rebuild(Player.objects.values_list('id', 'score').iterator(), version=version)
+    return leaderboard_index
+
+
+def get_leaderboard_index():
+    """Returns the process wide leaderboard index, loading it from the database the first time it is needed and after
+    any process has changed a score."""
+    if not leaderboard_index.loaded or leaderboard_index.version != get_leaderboard_version():
+        load_leaderboard_index()
+    return leaderboard_index
@@ -0,0 +1,81 @@
+import asyncio
+import multiprocessing
+import os
+import statistics
+import tempfile
+import time
+from django.core.management.base import BaseCommand
+
+from gui.channel_layers import SQLiteChannelLayer
+
+GROUP = 'benchmark'
+
+
+def receive_group_messages(path, messages, ready, results):
+    """Worker process - joins the benchmark group like a QuizConsumer, receives the messages and reports when it got the last one
+    and the latency of every message."""
+    async def receive():
+        layer = SQLiteChannelLayer(path=path, capacity=messages)
+        channel = await layer.new_channel()
+        await layer.group_add(GROUP, channel)
+        ready.put(channel)
+
+        latencies = []
+        for _ in range(messages):
+            message = await layer.receive(channel)
+            latencies.append(time.time() - message['sent'])
+        await layer.group_discard(GROUP, channel)
+        return time.time(), latencies
+
+    results.put(asyncio.run(receive()))
+
+
+class Command(BaseCommand):
+    help = ('Measures the throughput of the SQLite channel layer across processes - one process sends messages to a group '
+            'that has a consumer channel in each of the receiving processes, like QuizConsumer.send_next_question.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=4, help='Number of receiving worker processes.')
+        parser.add_argument('--messages', type=int, default=1000, help='Number of messages sent to the group.')
+        parser.add_argument('--path', help='Database file of the channel layer. Defaults to a temporary file.')
+
+    def handle(self, *args, **options):
+        processes, messages = options['processes'], options['messages']
+        with tempfile.TemporaryDirectory() as directory:
+            path = options['path'] or os.path.join(directory, 'channels.sqlite3')
+            latencies, send_seconds, total_seconds = self.run(path, processes, messages)
+
+        delivered = processes * messages
+        latencies.sort()
+        self.stdout.write(f'Receiving processes: {processes}, messages sent to the group: {messages}')
+        self.stdout.write(f'group_send: {messages / send_seconds:.0f} messages/s')
+        self.stdout.write(f'Delivered: {delivered} messages in {total_seconds:.2f} s - {delivered / total_seconds:.0f} messages/s')
+        self.stdout.write(f'Latency: mean {statistics.mean(latencies) * 1000:.1f} ms, '
+                          f'p99 {latencies[min(len(latencies) - 1, int(len(latencies) * 0.99))] * 1000:.1f} ms')
+
+    def run(self, path, processes, messages):
+        context = multiprocessing.get_context('spawn')
+        ready, results = context.Queue(), context.Queue()
+        workers = [context.Process(target=receive_group_messages, args=(path, messages, ready, results)) for _ in range(processes)]
+        for worker in workers:
+            worker.start()
+        for _ in workers:
+            ready.get(timeout=60)
+
+        async def send():
+            layer = SQLiteChannelLayer(path=path, capacity=messages)
+            for number in range(messages):
+                await layer.group_send(GROUP, {'type': 'benchmark.message', 'number': number, 'sent': time.time()})
+
+        start = time.time()
+        asyncio.run(send())
+        send_seconds = time.time() - start
+
+        finished, latencies = [], []
+        for _ in workers:
+            finished_at, worker_latencies = results.get(timeout=120)
+            finished.append(finished_at)
+            latencies.extend(worker_latencies)
+        for worker in workers:
+            worker.join()
+        return latencies, send_seconds, max(finished) - start
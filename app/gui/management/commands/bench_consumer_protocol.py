@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from gui.instrumentation import protocol_stats
+from gui.simulation import benchmark_database, create_and_play_game
+
+
+class Command(BaseCommand):
+    help = ('Plays a multiplayer game through QuizConsumer on a test database and shows the thread hops(database_sync_to_async calls) '
+            'and the database queries per protocol message.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--players', type=int, default=4, help='Number of players in the room.')
+        parser.add_argument('--questions', type=int, default=5, help='Number of questions of the quiz.')
+
+    def handle(self, *args, **options):
+        protocol_stats.reset()
+        protocol_stats.enabled = True
+        try:
+            with benchmark_database():
+                create_and_play_game('benchmark', options['players'], options['questions'])
+        finally:
+            protocol_stats.enabled = False
+
+        self.stdout.write(f"{'Message':<40} {'Count':>7} {'Hops/msg':>9} {'Queries/msg':>12}")
+        for name, count, hops, queries in protocol_stats.get_rows():
+            self.stdout.write(f'{name:<40} {count:>7} {hops:>9.2f} {queries:>12.2f}')
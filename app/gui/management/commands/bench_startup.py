@@ -0,0 +1,64 @@
+import os
+import re
+import subprocess
+import sys
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+IMPORT_TIME_LINE = re.compile(r'^import time:\s+(\d+) \|\s+(\d+) \|(\s+)(\S+)$')
+
+STARTUP_SCRIPT = '''
+import importlib, resource, sys, django
+django.setup()
+for module in sys.argv[1:]:
+    importlib.import_module(module)
+print(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+'''
+
+
+class Command(BaseCommand):
+    help = ('Measures the cold start of a worker - the import time of the application modules(python -X importtime) and the peak RSS '
+            'of a fresh interpreter that imports them. Compare a run with --with-charts to see what statistics workers pay for matplotlib.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--module', action='append', dest='modules', help='Module imported by the worker(repeatable). Defaults to the views, consumers and urls.')
+        parser.add_argument('--with-charts', action='store_true', help='Also import gui.charts, like a worker that renders a statistics chart.')
+        parser.add_argument('--top', type=int, default=10, help='Number of slowest top level imports to show.')
+        parser.add_argument('--repeat', type=int, default=3, help='Number of runs, the fastest one is reported.')
+
+    def run_worker(self, modules):
+        """Imports the modules in a fresh interpreter, returns the parsed import times and the peak RSS of the interpreter in KiB."""
+        env = dict(os.environ, DJANGO_SETTINGS_MODULE=os.environ.get('DJANGO_SETTINGS_MODULE', 'app.settings'))
+        completed = subprocess.run(
+            [sys.executable, '-X', 'importtime', '-c', STARTUP_SCRIPT, *modules],
+            cwd=settings.BASE_DIR, env=env, capture_output=True, text=True, check=True
+        )
+        rss = int(completed.stdout.split()[-1])
+
+        imports = []
+        for line in completed.stderr.splitlines():
+            match = IMPORT_TIME_LINE.match(line)
+            if match:
+                self_us, cumulative_us, indent, module = match.groups()
+                imports.append((module, int(self_us), int(cumulative_us), len(indent)))
+        return imports, rss
+
+    def handle(self, *args, **options):
+        modules = options['modules'] or ['gui.views', 'gui.consumers', 'app.urls']
+        if options['with_charts']:
+            modules.append('gui.charts')
+
+        runs = [self.run_worker(modules) for _ in range(options['repeat'])]
+        imports, rss = min(runs, key=lambda run: sum(self_us for _, self_us, _, _ in run[0]))
+
+        total_ms = sum(self_us for _, self_us, _, _ in imports) / 1000
+        loaded = {module for module, _, _, _ in imports}
+        top_level = sorted((entry for entry in imports if entry[3] == 1), key=lambda entry: entry[2], reverse=True)
+
+        self.stdout.write(f"Imported modules: {', '.join(modules)}")
+        self.stdout.write(f'Total import time: {total_ms:.1f} ms ({len(imports)} modules)')
+        self.stdout.write(f'Peak RSS: {rss / 1024:.1f} MiB')
+        self.stdout.write(f"matplotlib loaded: {'yes' if 'matplotlib' in loaded else 'no'}")
+        self.stdout.write("Slowest top level imports:")
+        for module, _, cumulative_us, _ in top_level[:options['top']]:
+            self.stdout.write(f'  {cumulative_us / 1000:8.1f} ms  {module}')
@@ -0,0 +1,47 @@
+import os
+import tempfile
+from django.core.management.base import BaseCommand
+
+from gui.instrumentation import protocol_stats
+from gui.simulation import IN_MEMORY_CHANNEL_LAYER, benchmark_database, run_load_test
+
+
+class Command(BaseCommand):
+    help = ('Load test of the multiplayer protocol - plays many rooms at the same time through QuizConsumer on a test database '
+            'and reports the broadcast latency percentiles, the throughput and the database queries.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rooms', type=int, default=10, help='Number of rooms played at the same time.')
+        parser.add_argument('--players', type=int, default=4, help='Number of players in every room.')
+        parser.add_argument('--questions', type=int, default=5, help='Number of questions of every quiz.')
+        parser.add_argument('--answer-delay', type=float, default=0, help='Players answer after a random delay of up to ANSWER_DELAY seconds.')
+        parser.add_argument('--sqlite-channel-layer', action='store_true', help='Use the SQLite channel layer instead of the in-memory one.')
+
+    def handle(self, *args, **options):
+        protocol_stats.reset()
+        protocol_stats.enabled = True
+        try:
+            with tempfile.TemporaryDirectory() as directory:
+                channel_layer = IN_MEMORY_CHANNEL_LAYER
+                if options['sqlite_channel_layer']:
+                    channel_layer = {'BACKEND': 'gui.channel_layers.SQLiteChannelLayer', 'CONFIG': {'path': os.path.join(directory, 'channels.sqlite3')}}
+                with benchmark_database(channel_layer):
+                    stats, seconds = run_load_test(options['rooms'], options['players'], options['questions'], options['answer_delay'])
+        finally:
+            protocol_stats.enabled = False
+
+        rows = protocol_stats.get_rows()
+        queries = sum(count * queries for _, count, _, queries in rows)
+        answers = options['rooms'] * options['players'] * options['questions']
+
+        self.stdout.write(f"Rooms: {options['rooms']}, players per room: {options['players']}, questions: {options['questions']}, "
+                          f"answer delay: up to {options['answer_delay']} s")
+        self.stdout.write(f'Duration: {seconds:.2f} s')
+        self.stdout.write(f'Messages: {stats.sent} sent, {stats.received} received - {(stats.sent + stats.received) / seconds:.0f} messages/s, '
+                          f'{answers / seconds:.0f} answers/s')
+        self.stdout.write(f'Broadcast latency: p50 {stats.get_percentile(50) * 1000:.1f} ms, p95 {stats.get_percentile(95) * 1000:.1f} ms, '
+                          f'p99 {stats.get_percentile(99) * 1000:.1f} ms')
+        self.stdout.write(f'Database queries: {queries:.0f} - {queries / answers:.2f} per answer')
+        self.stdout.write(f"{'Message':<40} {'Count':>7} {'Hops/msg':>9} {'Queries/msg':>12}")
+        for name, count, hops, queries_per_message in rows:
+            self.stdout.write(f'{name:<40} {count:>7} {hops:>9.2f} {queries_per_message:>12.2f}')
@@ -0,0 +1,22 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from gui.rooms import reap_stale_sessions
+
+
+class Command(BaseCommand):
+    help = ('Deactivates and archives the multiplayer sessions without a checkpoint or a heartbeat for --stale-after seconds, '
+            'e.g. of rooms whose worker crashed. The workers reap them too while they have rooms, run it periodically(e.g. from cron) for the rest.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--stale-after', type=int, default=settings.MULTIPLAYER_SESSION_STALE_AFTER, help='Seconds without activity after which a session is stale.')
+        parser.add_argument('--interval', type=float, help='Keep running and reap the stale sessions every INTERVAL seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            reaped = reap_stale_sessions(options['stale_after'])
+            self.stdout.write(self.style.SUCCESS(f'Reaped {reaped} stale sessions.'))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
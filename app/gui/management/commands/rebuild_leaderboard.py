@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from gui.leaderboard import load_leaderboard_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuilds the in-process leaderboard index from the Player table. Run it on startup to warm the index.'
+
+    def handle(self, *args, **options):
+        index = load_leaderboard_index()
+        self.stdout.write(self.style.SUCCESS(f'Leaderboard index rebuilt with {len(index)} players.'))
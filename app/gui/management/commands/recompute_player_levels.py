@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand
+
+from gui.models import Player
+from gui.services import get_level_for_score
+
+
+class Command(BaseCommand):
+    help = 'Recomputes Player.level for all players from the PLAYER_LEVELS table, saving only the changed ones in batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of players read and updated per batch.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        changed = []
+        updated = 0
+
+        for player in Player.objects.only('id', 'score', 'level').iterator(chunk_size=batch_size):
+            level = get_level_for_score(player.score)
+            if player.level != level:
+                player.level = level
+                changed.append(player)
+            if len(changed) == batch_size:
+                Player.objects.bulk_update(changed, ['level'])
+                updated += len(changed)
+                changed = []
+
+        if changed:
+            Player.objects.bulk_update(changed, ['level'])
+            updated += len(changed)
+
+        self.stdout.write(self.style.SUCCESS(f'Updated the level of {updated} players.'))
@@ -0,0 +1,22 @@
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+from gui.score_ledger import roll_up_all_score_events
+
+
+class Command(BaseCommand):
+    help = ('Rolls up the pending score events into Player.score and PointsPerDay in batches. Run it periodically(e.g. from cron) '
+            'or keep it running with --interval when SCORE_EVENTS_DEFERRED is set.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.SCORE_EVENTS_ROLLUP_BATCH_SIZE, help='Number of events rolled up in one transaction.')
+        parser.add_argument('--interval', type=float, help='Keep running and roll up the pending events every INTERVAL seconds.')
+
+    def handle(self, *args, **options):
+        while True:
+            rolled_up = roll_up_all_score_events(options['batch_size'])
+            self.stdout.write(self.style.SUCCESS(f'Rolled up {rolled_up} score events.'))
+            if options['interval'] is None:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.9 on 2026-10-18 16:03
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0040_alter_quiz_difficulty'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='player',
+            name='score',
+            field=models.IntegerField(db_index=True, default=0, verbose_name='Score'),
+        ),
+    ]
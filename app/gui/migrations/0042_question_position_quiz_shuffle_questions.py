@@ -0,0 +1,32 @@
+# Generated by Django 4.2.9 on 2026-10-18 16:07
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0041_alter_player_score'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='question',
+            options={'ordering': ['position', 'id']},
+        ),
+        migrations.AddField(
+            model_name='question',
+            name='position',
+            field=models.PositiveIntegerField(default=0, help_text='Questions are played in ascending position, questions with equal position in the order they were created', verbose_name='Position'),
+        ),
+        migrations.AddField(
+            model_name='quiz',
+            name='shuffle_questions',
+            field=models.BooleanField(default=False, help_text='Play the questions in a different random order on each attempt', verbose_name='Shuffle Questions'),
+        ),
+        migrations.AddField(
+            model_name='quizattempt',
+            name='question_order',
+            field=models.JSONField(blank=True, default=list, verbose_name='Question Order'),
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.9 on 2026-10-18 16:18
+
+import datetime
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0042_question_position_quiz_shuffle_questions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ScoreEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('points', models.IntegerField(verbose_name='Points')),
+                ('date', models.DateField(default=datetime.date.today, verbose_name='Date')),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('multiplayer', models.BooleanField(default=False, verbose_name='Multiplayer')),
+                ('rolled_up', models.BooleanField(db_index=True, default=False, verbose_name='Rolled Up')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='gui.player', verbose_name='Player')),
+                ('quiz_attempt', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to='gui.quizattempt', verbose_name='Quiz Attempt')),
+            ],
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.9 on 2026-10-18 16:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0043_scoreevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='question',
+            name='time_limit',
+            field=models.PositiveIntegerField(blank=True, help_text='Seconds to answer the question in a multiplayer game. Leave empty for the default time limit', null=True, verbose_name='Time Limit'),
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.9 on 2026-10-18 16:31
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0044_question_time_limit'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='multiplayersession',
+            name='archived',
+            field=models.BooleanField(default=False, help_text='The session was closed by the reaper after its room went stale', verbose_name='Archived'),
+        ),
+        migrations.AddField(
+            model_name='multiplayersession',
+            name='last_activity',
+            field=models.DateTimeField(db_index=True, default=django.utils.timezone.now, help_text='Last checkpoint or heartbeat of the room', verbose_name='Last Activity'),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.9 on 2026-10-18 16:34
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+from django.db.models import Sum
+
+
+def backfill_multiplayer_scores(apps, schema_editor):
+    """Sums the logged points of the multiplayer games of every player."""
+    Player = apps.get_model('gui', 'Player')
+    ScoreEvent = apps.get_model('gui', 'ScoreEvent')
+    totals = ScoreEvent.objects.filter(multiplayer=True).values('player_id').annotate(points=Sum('points'))
+    Player.objects.bulk_update([Player(id=total['player_id'], multiplayer_score=total['points']) for total in totals], ['multiplayer_score'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0045_multiplayersession_last_activity'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='player',
+            name='multiplayer_score',
+            field=models.IntegerField(db_index=True, default=0, help_text='Points earned in multiplayer games', verbose_name='Multiplayer Score'),
+        ),
+        migrations.CreateModel(
+            name='MultiplayerResult',
+            fields=[
+                ('room_code', models.CharField(max_length=100, primary_key=True, serialize=False, verbose_name='Room Code')),
+                ('finished', models.DateTimeField(default=django.utils.timezone.now, verbose_name='Finished')),
+                ('standings', models.JSONField(default=list, help_text='[username, score] pairs, best score first', verbose_name='Standings')),
+                ('quiz', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to='gui.quiz', verbose_name='Quiz')),
+            ],
+        ),
+        migrations.RunPython(backfill_multiplayer_scores, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.2.9 on 2026-10-18 16:36
+
+from django.db import migrations, models
+from django.db.models import Count, Min, Sum
+
+
+def merge_duplicate_points_per_day(apps, schema_editor):
+    """Merges the PointsPerDay rows of the same player and date into the first of them, so they can be unique."""
+    PointsPerDay = apps.get_model('gui', 'PointsPerDay')
+    duplicates = PointsPerDay.objects.values('player_id', 'date').annotate(rows=Count('id'), first_id=Min('id'), points=Sum('points')).filter(rows__gt=1)
+    for duplicate in duplicates:
+        PointsPerDay.objects.filter(pk=duplicate['first_id']).update(points=duplicate['points'])
+        PointsPerDay.objects.filter(player_id=duplicate['player_id'], date=duplicate['date']).exclude(pk=duplicate['first_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('gui', '0046_multiplayer_results'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='category',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['id'], name='category_not_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='forum',
+            index=models.Index(condition=models.Q(('is_deleted', False)), fields=['id'], name='forum_not_deleted_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='multiplayersession',
+            index=models.Index(condition=models.Q(('active', True)), fields=['quiz', 'last_activity'], name='session_quiz_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['quiz', 'position', 'id'], name='question_quiz_order_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='questionresponse',
+            index=models.Index(fields=['player', 'quiz', 'question'], name='response_player_quiz_idx'),
+        ),
+        migrations.RunPython(merge_duplicate_points_per_day, migrations.RunPython.noop),
+        migrations.AddConstraint(
+            model_name='pointsperday',
+            constraint=models.UniqueConstraint(fields=('player', 'date'), name='unique_points_per_day'),
+        ),
+    ]
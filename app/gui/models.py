@@ -1,9 +1,12 @@
 from django.db import models
+from django.conf import settings
+from django.utils import timezone
 from django.contrib.auth.models import User
 from django.utils.translation import gettext as _
 from django.core.validators import MaxValueValidator
 import re
-from datetime import date
+import random
+from datetime import date, timedelta
 from enum import Enum
 
 # Create your models here.
@@ -17,9 +20,39 @@ class QuestionType(Enum):
     SINGLE_CHOICE = 'single choice'
     MULTIPLE_CHOICE = 'multiple choice'
 
+class QuestionOrder:
+    """Ordered ids of the questions played in a quiz with O(1) lookups of the first, next and previous question."""
+
+    def __init__(self, question_ids):
+        self.question_ids = list(question_ids)
+        self._positions = {question_id: position for position, question_id in enumerate(self.question_ids)}
+
+    def __len__(self):
+        return len(self.question_ids)
+
+    def __contains__(self, question_id):
+        return question_id in self._positions
+
+    def first(self):
+        return self.question_ids[0] if self.question_ids else None
+
+    def next(self, question_id):
+        position = self._positions.get(question_id)
+        if position is None or position + 1 == len(self.question_ids):
+            return None
+        return self.question_ids[position + 1]
+
+    def previous(self, question_id):
+        position = self._positions.get(question_id)
+        if not position:
+            return None
+        return self.question_ids[position - 1]
+
+
 class Player(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, verbose_name=_("User"))
-    score = models.IntegerField(default=0, verbose_name=_("Score"))
+    score = models.IntegerField(default=0, db_index=True, verbose_name=_("Score"))
+    multiplayer_score = models.IntegerField(default=0, db_index=True, help_text=_("Points earned in multiplayer games"), verbose_name=_("Multiplayer Score"))
     rank = models.IntegerField(default=0, verbose_name=_("Rank"))
     level = models.CharField(max_length=200, default='Beginner', verbose_name=_("Level"))
     active_attempt = models.ForeignKey('QuizAttempt', on_delete=models.CASCADE, null=True, blank=True, verbose_name=_("Active Attempt"))
@@ -38,6 +71,7 @@ class Category(models.Model):
     class Meta:
         verbose_name = _("Category")
         verbose_name_plural = _("Categories")
+        indexes = [models.Index(fields=['id'], condition=models.Q(is_deleted=False), name='category_not_deleted_idx')]
     
     @staticmethod
     def get_not_deleted_instances():
@@ -68,6 +102,7 @@ class Quiz(models.Model):
         validators=[MaxValueValidator(100)], 
         verbose_name=_("Pass Mark")
     )
+    shuffle_questions = models.BooleanField(default=False, help_text=_("Play the questions in a different random order on each attempt"), verbose_name=_("Shuffle Questions"))
 
 
     class Meta:
@@ -80,6 +115,14 @@ class Quiz(models.Model):
     def get_questions(self):
         return self.question_set.all()[:self.max_questions] # we use the max_questions to limit the number of questions to be displayed
     
+    def get_question_order(self, shuffle=False):
+        """The questions played in an attempt - ordered by position and limited to max_questions. 
+        With shuffle the limited questions are played in random order."""
+        question_ids = list(self.question_set.values_list('id', flat=True)[:self.max_questions])
+        if shuffle:
+            random.shuffle(question_ids)
+        return QuestionOrder(question_ids)
+
     @staticmethod
     def quizzes_for_player(player_instance):
         return list(Quiz.objects.filter(player=player_instance, category__is_deleted=False))
@@ -95,9 +138,20 @@ class Question(models.Model):
         default=QuestionType.SINGLE_CHOICE.value, 
         verbose_name=_("Question Type")
     )
+    position = models.PositiveIntegerField(default=0, help_text=_("Questions are played in ascending position, questions with equal position in the order they were created"), verbose_name=_("Position"))
+    time_limit = models.PositiveIntegerField(null=True, blank=True, help_text=_("Seconds to answer the question in a multiplayer game. Leave empty for the default time limit"), verbose_name=_("Time Limit"))
+
+    class Meta:
+        ordering = ['position', 'id']
+        indexes = [models.Index(fields=['quiz', 'position', 'id'], name='question_quiz_order_idx')] # the questions of a quiz in play order
 
     def __str__(self):
         return self.question
+
+    def get_time_limit(self):
+        """Seconds to answer the question in a multiplayer game, None if it has no time limit."""
+        time_limit = self.time_limit if self.time_limit is not None else settings.MULTIPLAYER_QUESTION_TIME_LIMIT
+        return time_limit or None
     
     @staticmethod
     def questions_for_player_in_quiz(player_instance):
@@ -124,6 +178,9 @@ class QuestionResponse(models.Model):
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, verbose_name=_("Quiz"))
     question = models.ForeignKey(Question, on_delete=models.CASCADE, verbose_name=_("Question"))
     answer = models.ForeignKey(Answer, on_delete=models.CASCADE, verbose_name=_("Answer"))
+
+    class Meta:
+        indexes = [models.Index(fields=['player', 'quiz', 'question'], name='response_player_quiz_idx')]
     
     def is_correct(self):
         return self.answer.is_correct
@@ -137,6 +194,10 @@ class QuizAttempt(models.Model):
     date = models.DateTimeField(auto_now_add=True)
     score = models.IntegerField(default=0, verbose_name=_("Score"))
     responses = models.ManyToManyField(QuestionResponse, verbose_name=_("Responses"))
+    question_order = models.JSONField(default=list, blank=True, verbose_name=_("Question Order"))
+
+    def get_question_order(self):
+        return QuestionOrder(self.question_order)
 
     def __str__(self):
         return f" - {self.quiz.title}"
@@ -147,10 +208,29 @@ class PointsPerDay(models.Model):
     date = models.DateField(default=date.today, verbose_name=_("Date"))
     points = models.IntegerField(default=0, verbose_name=_("Points"))
 
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['player', 'date'], name='unique_points_per_day')]
+
     def __str__(self):
         return f"{self.player.user.username} - {self.date}"
 
 
+class ScoreEvent(models.Model):
+    """Append-only log of the points earned by the players. Every finished quiz attempt inserts one event, which is later
+    rolled up into Player.score and PointsPerDay(immediately, or by the rollup_score_events job when SCORE_EVENTS_DEFERRED is set)."""
+
+    player = models.ForeignKey(Player, on_delete=models.CASCADE, verbose_name=_("Player"))
+    quiz_attempt = models.ForeignKey(QuizAttempt, on_delete=models.SET_NULL, null=True, blank=True, verbose_name=_("Quiz Attempt"))
+    points = models.IntegerField(verbose_name=_("Points"))
+    date = models.DateField(default=date.today, verbose_name=_("Date"))
+    created = models.DateTimeField(auto_now_add=True)
+    multiplayer = models.BooleanField(default=False, verbose_name=_("Multiplayer"))
+    rolled_up = models.BooleanField(default=False, db_index=True, verbose_name=_("Rolled Up"))
+
+    def __str__(self):
+        return f"{self.player} - {self.points} - {self.date}"
+
+
 class Forum(models.Model):
     player = models.ForeignKey(Player, on_delete=models.CASCADE, null=True, verbose_name=_("Player"))
     topic = models.CharField(max_length=300, verbose_name=_("Topic"))
@@ -158,6 +238,9 @@ class Forum(models.Model):
     created = models.DateTimeField(auto_now_add=True)
     is_deleted = models.BooleanField(default=False, verbose_name=_("Is Deleted"))
 
+    class Meta:
+        indexes = [models.Index(fields=['id'], condition=models.Q(is_deleted=False), name='forum_not_deleted_idx')]
+
     @staticmethod
     def get_not_deleted_forums():
         return list(Forum.objects.filter(is_deleted=False))
@@ -184,3 +267,29 @@ class MultiPlayerSession(models.Model):
     active = models.BooleanField(default=True, verbose_name=_("Active"))
     started = models.BooleanField(default=False, verbose_name=_("Started"))
     current_question = models.ForeignKey(Question, on_delete=models.CASCADE, null=True, blank=True, verbose_name=_("Current Question"))
+    last_activity = models.DateTimeField(default=timezone.now, db_index=True, help_text=_("Last checkpoint or heartbeat of the room"), verbose_name=_("Last Activity"))
+    archived = models.BooleanField(default=False, help_text=_("The session was closed by the reaper after its room went stale"), verbose_name=_("Archived"))
+
+    class Meta:
+        indexes = [models.Index(fields=['quiz', 'last_activity'], condition=models.Q(active=True), name='session_quiz_active_idx')] # the live rooms of a quiz
+
+    @staticmethod
+    def get_live_sessions():
+        """Active sessions with a checkpoint or a heartbeat in the last MULTIPLAYER_SESSION_STALE_AFTER seconds."""
+        stale_before = timezone.now() - timedelta(seconds=settings.MULTIPLAYER_SESSION_STALE_AFTER)
+        return MultiPlayerSession.objects.filter(active=True, last_activity__gte=stale_before)
+
+
+class MultiplayerResult(models.Model):
+    """Final standings of the last game played in a room, stored when the game is finished."""
+
+    room_code = models.CharField(max_length=100, primary_key=True, verbose_name=_("Room Code"))
+    quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, verbose_name=_("Quiz"))
+    finished = models.DateTimeField(default=timezone.now, verbose_name=_("Finished"))
+    standings = models.JSONField(default=list, help_text=_("[username, score] pairs, best score first"), verbose_name=_("Standings"))
+
+    def get_results(self):
+        return [{'player_username': username, 'score': score} for username, score in self.standings]
+
+    def __str__(self):
+        return f"{self.room_code} - {self.quiz}"
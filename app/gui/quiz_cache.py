@@ -0,0 +1,80 @@
+import time
+from django.conf import settings
+from django.core.cache import cache, caches
+
+from gui.models import Quiz, Question, Answer, QuestionOrder
+
+
+class QuizContent:
+    """The content of a quiz as it is played - the quiz, its questions in play order and the answers of every question."""
+
+    def __init__(self, quiz, questions):
+        self.quiz = quiz
+        self.questions = {question.id: question for question in questions}
+        self.answers = {question.id: list(question.answer_set.all()) for question in questions}
+        self.question_order = QuestionOrder([question.id for question in questions][:quiz.max_questions])
+
+    def get_question(self, question_id):
+        try:
+            return self.questions.get(int(question_id))
+        except (TypeError, ValueError):
+            return None
+
+    def get_answers(self, question_id):
+        return self.answers.get(question_id, [])
+
+
+def get_quiz_content_version_key(quiz_id):
+    return f'quiz-content-version:{quiz_id}'
+
+
+def get_version_cache():
+    """The cache of the versions(QUIZ_CONTENT_VERSION_CACHE), shared by all workers. The content itself is cached per worker."""
+    return caches[settings.QUIZ_CONTENT_VERSION_CACHE]
+
+
+def get_quiz_content_version(quiz_id):
+    """Current version of the cached content of the quiz. A missing version(never set or evicted) is replaced by a new unique one,
+    so content cached under an old version can never be served again."""
+    return get_version_cache().get_or_set(get_quiz_content_version_key(quiz_id), time.time_ns, timeout=None)
+
+
+def bump_quiz_content_version(quiz_id):
+    """Invalidates the cached content of the quiz. It must be called after every change of the quiz, its questions or answers."""
+    if quiz_id is not None:
+        get_version_cache().set(get_quiz_content_version_key(quiz_id), time.time_ns(), timeout=None)
+
+
+def bump_quiz_content_version_for(instance):
+    """Invalidates the cached content of the quiz the instance(quiz, question or answer) belongs to. Other instances are ignored."""
+    if isinstance(instance, Quiz):
+        bump_quiz_content_version(instance.id)
+    elif isinstance(instance, Question):
+        bump_quiz_content_version(instance.quiz_id)
+    elif isinstance(instance, Answer):
+        bump_quiz_content_version(Question.objects.filter(id=instance.question_id).values_list('quiz_id', flat=True).first())
+
+
+def load_quiz_content(quiz_id):
+    quiz = Quiz.objects.filter(id=quiz_id).first()
+    if quiz is None:
+        return None
+    questions = list(Question.objects.filter(quiz=quiz).prefetch_related('answer_set'))
+    return QuizContent(quiz, questions)
+
+
+def get_quiz_content(quiz_id):
+    """Read-through cache of the quiz content. On a warm cache it does not query the database at all.
+    Returns None if the quiz does not exist."""
+    try:
+        quiz_id = int(quiz_id)
+    except (TypeError, ValueError):
+        return None
+
+    key = f'quiz-content:{quiz_id}:{get_quiz_content_version(quiz_id)}'
+    content = cache.get(key)
+    if content is None:
+        content = load_quiz_content(quiz_id)
+        if content is not None:
+            cache.set(key, content, timeout=settings.QUIZ_CONTENT_CACHE_TIMEOUT)
+    return content
@@ -0,0 +1,211 @@
+"""In-memory state of the multiplayer rooms. The RoomState of a room is the authority for the game while it is played - the roster,
+the current question, who has answered it and the scores - so answering a question is O(1) and does not touch the database.
+
+The state is kept per worker process. Every change is also sent to the room group and applied by the other processes, and applying
+a change twice does nothing, so every process that has consumers in the room has the same state. The database is written only at
+checkpoints - when a player joins or leaves, when the game starts and when the room moves to the next question or to the results.
+Every checkpoint and the periodic heartbeat of the rooms with consumers in a process update the last activity of the session, and the
+reaper closes the sessions without activity, e.g. of rooms whose worker crashed."""
+
+from collections import namedtuple
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from gui.models import MultiPlayerSession, MultiplayerResult, QuizAttempt, Player
+from gui.quiz_cache import get_quiz_content
+from gui.services import create_question_responses_and_update_score
+from gui.score_ledger import finish_multiplayer_game
+
+
+class RoomState:
+    """State of a multiplayer game in one room."""
+
+    def __init__(self, room_code, question_order, current_question_id=None, started=False):
+        self.room_code = room_code
+        self.question_order = question_order
+        self.current_question_id = current_question_id
+        self.started = started
+        self.roster = {} # player id -> username
+        self.scores = {} # player id -> points in this game
+        self.answered = set() # ids of the players in the roster that have answered the current question
+        self.advanced_from = None
+
+    def join(self, player_id, username, score=0):
+        self.roster[player_id] = username
+        self.scores.setdefault(player_id, score)
+
+    def leave(self, player_id):
+        self.roster.pop(player_id, None)
+        self.scores.pop(player_id, None)
+        self.answered.discard(player_id)
+
+    def show_question(self, question_id):
+        """Moves the room to the question. Returns False if the room is already on it."""
+        self.started = True
+        if question_id == self.current_question_id:
+            return False
+        self.current_question_id = question_id
+        self.answered.clear()
+        return True
+
+    def record_answer(self, player_id, question_id, points):
+        """Adds the points of the answer of the player to the current question. Returns False and ignores the answer if the question
+        is not the current one, or if the player is not in the room or has already answered."""
+        if question_id != self.current_question_id or player_id not in self.roster or player_id in self.answered:
+            return False
+        self.answered.add(player_id)
+        self.scores[player_id] += points
+        return True
+
+    def all_answered(self):
+        return bool(self.roster) and len(self.answered) == len(self.roster)
+
+    def claim_advance(self):
+        """Returns True only the first time it is called for the current question, so the consumers of the room in this process
+        try to move the room to the next question only once."""
+        if self.advanced_from == self.current_question_id:
+            return False
+        self.advanced_from = self.current_question_id
+        return True
+
+    def get_next_question_id(self):
+        return self.question_order.next(self.current_question_id)
+
+    def get_results(self):
+        results = [{'player_username': username, 'score': self.scores[player_id]} for player_id, username in self.roster.items()]
+        results.sort(key=lambda result: result['score'], reverse=True)
+        return results
+
+
+rooms = {} # room code -> RoomState of the rooms with consumers in this process
+
+
+def load_room_state(multiplayer):
+    """Builds the state of the room of the session from its last checkpoint in the database."""
+    content = get_quiz_content(multiplayer.quiz_id)
+    room = RoomState(multiplayer.room_code, content.question_order, current_question_id=multiplayer.current_question_id, started=multiplayer.started)
+    for player in multiplayer.players.select_related('user', 'active_attempt'):
+        attempt = player.active_attempt
+        room.join(player.id, player.user.username, attempt.score if attempt and attempt.quiz_id == multiplayer.quiz_id else 0)
+    return room
+
+
+def get_room_state(multiplayer):
+    """The state of the room of the session in this process, loaded from the database the first time a consumer of the room connects to it."""
+    room = rooms.get(multiplayer.room_code)
+    if room is None:
+        room = rooms.setdefault(multiplayer.room_code, load_room_state(multiplayer))
+    return room
+
+
+def discard_room_state(room_code):
+    rooms.pop(room_code, None)
+
+
+# Checkpoints
+
+def checkpoint_player_joined(multiplayer, player):
+    """Adds the player to the session and starts his attempt of the quiz. The active attempt is kept only on a reconnect, when the player
+    is still in the session - any other attempt of the quiz(a single player one or one of an earlier game) must not carry into the room."""
+    attempt = player.active_attempt
+    reconnect = multiplayer.players.filter(pk=player.pk).exists()
+    if not reconnect or attempt is None or attempt.quiz_id != multiplayer.quiz_id:
+        player.active_attempt = QuizAttempt.objects.create(quiz_id=multiplayer.quiz_id)
+        player.save(update_fields=['active_attempt'])
+    multiplayer.players.add(player)
+    MultiPlayerSession.objects.filter(room_code=multiplayer.room_code).update(last_activity=timezone.now())
+
+
+def checkpoint_player_left(multiplayer, player):
+    """Removes the player from the session and stops the session when the last player has left."""
+    multiplayer.players.remove(player)
+    if not multiplayer.players.exists():
+        MultiPlayerSession.objects.filter(room_code=multiplayer.room_code).update(active=False, started=False, last_activity=timezone.now())
+
+
+def checkpoint_game_started(room_code, first_question_id):
+    """Starts the game on the first question. Returns True only for the first of concurrent calls."""
+    return bool(MultiPlayerSession.objects.filter(room_code=room_code, started=False).update(
+        started=True, current_question_id=first_question_id, last_activity=timezone.now()))
+
+
+def checkpoint_question_advanced(room_code, question_id, next_question_id):
+    """Moves the session from the question to the next one, or to the results if next_question_id is None.
+    Returns True only for the first of concurrent calls, e.g. from consumers of the room in different processes."""
+    return bool(MultiPlayerSession.objects.filter(room_code=room_code, current_question_id=question_id).update(
+        current_question_id=next_question_id, last_activity=timezone.now()))
+
+
+def heartbeat(room_codes):
+    """Updates the last activity of the sessions of the rooms with one query."""
+    MultiPlayerSession.objects.filter(room_code__in=room_codes).update(last_activity=timezone.now())
+
+
+def reap_stale_sessions(stale_after=None):
+    """Deactivates and archives the active sessions without activity for stale_after seconds(MULTIPLAYER_SESSION_STALE_AFTER by default)
+    and removes their players, ending their attempts of the quiz of the dead game, in bulk. Returns the number of reaped sessions."""
+    stale_after = settings.MULTIPLAYER_SESSION_STALE_AFTER if stale_after is None else stale_after
+    stale_sessions = MultiPlayerSession.objects.filter(active=True, last_activity__lt=timezone.now() - timedelta(seconds=stale_after))
+    with transaction.atomic():
+        room_codes = list(stale_sessions.select_for_update().values_list('room_code', flat=True))
+        if not room_codes:
+            return 0
+        Player.objects.filter(game_players__room_code__in=room_codes, active_attempt__quiz_id=F('game_players__quiz_id')).update(active_attempt=None)
+        MultiPlayerSession.players.through.objects.filter(multiplayersession_id__in=room_codes).delete()
+        MultiPlayerSession.objects.filter(room_code__in=room_codes).update(active=False, started=False, current_question=None, archived=True)
+    return len(room_codes)
+
+
+# Protocol steps - QuizConsumer runs each of them in a single database_sync_to_async call, so every step of the protocol
+# costs one thread hop, however many queries it needs.
+
+JoinedRoom = namedtuple('JoinedRoom', ['multiplayer', 'player', 'content', 'room'])
+
+
+def join_room_step(room_code, user):
+    """connect - loads the session with its quiz and the player with his user and attempt, checkpoints the join and returns them
+    with the cached quiz content and the room state. Raises DoesNotExist if the session or the player does not exist."""
+    multiplayer = MultiPlayerSession.objects.select_related('quiz').get(room_code=room_code)
+    player = Player.objects.select_related('user', 'active_attempt').get(user=user)
+    checkpoint_player_joined(multiplayer, player)
+    return JoinedRoom(multiplayer, player, get_quiz_content(multiplayer.quiz_id), get_room_state(multiplayer))
+
+
+def save_answer_step(player, content, pending_answer):
+    """Checkpoint of the answer of the player when the room leaves the question - saves his responses and adds their points
+    to his attempt. pending_answer is (question id, answer ids) or None."""
+    if pending_answer is None:
+        return
+    question_id, answer_ids = pending_answer
+    create_question_responses_and_update_score(content.get_question(question_id), answer_ids, player, content.quiz)
+
+
+def leave_room_step(multiplayer, player, content, pending_answer):
+    """disconnect - saves the last answer of the player and checkpoints the leave."""
+    save_answer_step(player, content, pending_answer)
+    checkpoint_player_left(multiplayer, player)
+
+
+def finish_game_step(room_code, quiz_id, question_id):
+    """The last question is answered - checkpoints the end of the game, finishes it for all players of the room and stores its results
+    for the multiplayer leaderboard of the room, once per room. The answers to the last question are saved when they are submitted,
+    so they are all in the attempts by now. Returns the results of the game, or None if another consumer has already finished it."""
+    with transaction.atomic():
+        if not checkpoint_question_advanced(room_code, question_id, None):
+            return None
+        results = finish_multiplayer_game(room_code, quiz_id)
+        MultiplayerResult.objects.update_or_create(room_code=room_code, defaults={
+            'quiz_id': quiz_id,
+            'finished': timezone.now(),
+            'standings': [[result['player_username'], result['score']] for result in results],
+        })
+    return results
+
+
+def heartbeat_step(room_codes):
+    """Periodic heartbeat of the rooms with consumers in this process, which also reaps the stale sessions."""
+    heartbeat(room_codes)
+    reap_stale_sessions()
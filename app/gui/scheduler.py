@@ -0,0 +1,108 @@
+"""Deadlines of the questions of the multiplayer rooms. Every room with consumers in this process has at most one timer - the deadline
+of its current question. The consumers of the room watch it, and when it passes one of them moves the room on. The timer is cancelled
+when the room moves to another question or when the last consumer of the room in this process stops watching it(e.g. on disconnect).
+
+The deadlines are wall clock times, so all processes with consumers in a room agree on them. The checkpoint of the room lets only one
+of them move the room on.
+
+RoomHeartbeat is the periodic task of the process that keeps the sessions of its rooms alive and reaps the stale ones."""
+
+import asyncio
+import time
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from gui.rooms import rooms, heartbeat_step
+
+
+class Clock:
+    """Clock of the scheduler. Tests replace it with a fake clock."""
+
+    def time(self):
+        return time.time()
+
+    async def sleep(self, seconds):
+        await asyncio.sleep(seconds)
+
+
+class RoomTimer:
+
+    def __init__(self, question_id, deadline):
+        self.question_id = question_id
+        self.deadline = deadline
+        self.watchers = []
+        self.task = None
+
+
+class RoomScheduler:
+
+    def __init__(self, clock=None):
+        self.clock = clock or Clock()
+        self.timers = {} # room code -> RoomTimer
+
+    def get_deadline(self, time_limit):
+        """Deadline of a question with the time limit in seconds started now, None if there is no time limit."""
+        return self.clock.time() + time_limit if time_limit else None
+
+    def watch(self, room_code, question_id, deadline, callback):
+        """When the deadline of the question of the room passes, awaits callback(question_id) of the first watcher that is still
+        watching it. A timer of another question of the room is cancelled."""
+        timer = self.timers.get(room_code)
+        if timer is None or timer.question_id != question_id:
+            self.cancel(room_code)
+            timer = self.timers[room_code] = RoomTimer(question_id, deadline)
+            timer.task = asyncio.ensure_future(self._wait(room_code, timer))
+        if callback not in timer.watchers:
+            timer.watchers.append(callback)
+
+    def unwatch(self, room_code, callback):
+        timer = self.timers.get(room_code)
+        if timer is not None and callback in timer.watchers:
+            timer.watchers.remove(callback)
+            if not timer.watchers:
+                self.cancel(room_code)
+
+    def cancel(self, room_code):
+        timer = self.timers.pop(room_code, None)
+        if timer is not None:
+            timer.task.cancel()
+
+    async def _wait(self, room_code, timer):
+        await self.clock.sleep(timer.deadline - self.clock.time())
+        if self.timers.get(room_code) is not timer:
+            return
+        del self.timers[room_code]
+        try:
+            await timer.watchers[0](timer.question_id)
+        except Exception as e:
+            print(f"Error moving room {room_code} on after the deadline: {e}")
+
+
+class RoomHeartbeat:
+    """Every MULTIPLAYER_HEARTBEAT_INTERVAL seconds updates the last activity of the sessions of the rooms with consumers in this
+    process and reaps the stale sessions. It runs while the process has rooms."""
+
+    def __init__(self, clock=None):
+        self.clock = clock or Clock()
+        self.task = None
+
+    def start(self):
+        if self.task is None or self.task.done() or self.task.get_loop() is not asyncio.get_running_loop():
+            self.task = asyncio.ensure_future(self._run())
+
+    def stop(self):
+        if self.task is not None:
+            self.task.cancel()
+            self.task = None
+
+    async def _run(self):
+        while rooms:
+            await self.clock.sleep(settings.MULTIPLAYER_HEARTBEAT_INTERVAL)
+            try:
+                await database_sync_to_async(heartbeat_step)(list(rooms))
+            except Exception as e:
+                print(f"Error in the heartbeat of the rooms: {e}")
+
+
+room_scheduler = RoomScheduler()
+room_heartbeat = RoomHeartbeat()
@@ -0,0 +1,181 @@
+"""Score ledger - the only place where scores change. Every change is applied by the database as an F() expression update of
+only the changed columns, so concurrent requests never overwrite each other's points.
+Every finished attempt is also appended to the ScoreEvent log. With SCORE_EVENTS_DEFERRED finishing an attempt is only that insert,
+and the events are folded into Player.score and PointsPerDay in batches by roll_up_score_events."""
+
+from collections import defaultdict
+from datetime import date
+from django.conf import settings
+from django.db import connection, transaction, IntegrityError
+from django.db.models import F, Case, When, Value
+
+from gui.models import Player, QuizAttempt, PointsPerDay, ScoreEvent
+from gui.leaderboard import update_leaderboard_index
+
+
+def add_points_to_attempt(quiz_attempt, points):
+    """Adds the points to the score of the attempt with one atomic update and mirrors them on the instance."""
+    if not points:
+        return
+    QuizAttempt.objects.filter(pk=quiz_attempt.pk).update(score=F('score') + points)
+    quiz_attempt.score += points
+
+
+def add_points_per_day(points_by_day):
+    """Adds the points to the PointsPerDay of the players. points_by_day maps (player id, date) pairs to points.
+    Existing days are updated with F() expressions, the missing ones are created with one bulk insert. If a concurrent request
+    created one of them first, the insert is rolled back to its savepoint and the points are added to the rows that now exist."""
+    points_per_days = PointsPerDay.objects.filter(
+        player_id__in={player_id for player_id, _ in points_by_day}, date__in={day for _, day in points_by_day}
+    ).values_list('id', 'player_id', 'date')
+    existing = {(player_id, day): points_per_day_id for points_per_day_id, player_id, day in points_per_days}
+
+    missing = []
+    for (player_id, day), points in points_by_day.items():
+        if (player_id, day) not in existing:
+            missing.append(PointsPerDay(player_id=player_id, date=day, points=points))
+        elif points:
+            PointsPerDay.objects.filter(pk=existing[(player_id, day)]).update(points=F('points') + points)
+    if not missing:
+        return
+    try:
+        with transaction.atomic():
+            PointsPerDay.objects.bulk_create(missing)
+    except IntegrityError:
+        add_points_per_day({(points_per_day.player_id, points_per_day.date): points_per_day.points for points_per_day in missing})
+
+
+def finish_quiz_attempt(player, multiplayer=False):
+    """Ends the active attempt of the player and appends its score to the ScoreEvent log. Unless SCORE_EVENTS_DEFERRED is set,
+    the points are also added to the score of the player and to his points of the day right away.
+    The attempt is ended only if it is still the active one, so it is counted exactly once even if it is finished by concurrent requests.
+    Returns the points of the attempt or None if the attempt was already finished. The instance gets the new score of the player."""
+    quiz_attempt_id = player.active_attempt_id
+    if quiz_attempt_id is None:
+        return None
+    deferred = settings.SCORE_EVENTS_DEFERRED
+
+    with transaction.atomic():
+        points = QuizAttempt.objects.filter(pk=quiz_attempt_id).values_list('score', flat=True).first() or 0
+        changes = {'active_attempt': None} if deferred else {'active_attempt': None, 'score': F('score') + points}
+        finished = Player.objects.filter(pk=player.pk, active_attempt_id=quiz_attempt_id).update(**changes)
+        if not finished:
+            return None
+
+        event = ScoreEvent.objects.create(
+            player_id=player.pk, quiz_attempt_id=quiz_attempt_id, points=points, multiplayer=multiplayer, rolled_up=not deferred
+        )
+        if not deferred:
+            add_points_per_day({(player.pk, event.date): points})
+            player.score = Player.objects.filter(pk=player.pk).values_list('score', flat=True).get()
+
+    player.active_attempt = None
+    return points
+
+
+def finish_multiplayer_game(room_code, quiz_id):
+    """Ends the attempts of the quiz of all players in the room at once - their points are read with one annotated query, added to
+    Player.score with one bulk update and appended to the ScoreEvent log with one bulk insert. Player.multiplayer_score is updated
+    in the same update, also with SCORE_EVENTS_DEFERRED. Only the attempts that are still active are ended, and the caller runs it
+    once per game(see gui.rooms.finish_game_step). Returns the results of the game, best score first."""
+    deferred = settings.SCORE_EVENTS_DEFERRED
+    with transaction.atomic():
+        players = list(
+            Player.objects.filter(game_players__room_code=room_code, active_attempt__quiz_id=quiz_id)
+            .annotate(username=F('user__username'), points=F('active_attempt__score'))
+            .values('id', 'username', 'active_attempt_id', 'points')
+        )
+        if players:
+            points = Case(*[When(id=player['id'], then=Value(player['points'])) for player in players], default=0)
+            changes = {'active_attempt': None, 'multiplayer_score': F('multiplayer_score') + points}
+            if not deferred:
+                changes['score'] = F('score') + points
+            Player.objects.filter(active_attempt_id__in=[player['active_attempt_id'] for player in players]).update(**changes)
+
+            today = date.today()
+            ScoreEvent.objects.bulk_create([
+                ScoreEvent(player_id=player['id'], quiz_attempt_id=player['active_attempt_id'], points=player['points'], date=today,
+                           multiplayer=True, rolled_up=not deferred)
+                for player in players
+            ])
+            if not deferred:
+                add_points_per_day({(player['id'], today): player['points'] for player in players})
+                refresh_levels([player['id'] for player in players])
+
+    results = [{'player_username': player['username'], 'score': player['points']} for player in players]
+    results.sort(key=lambda result: result['score'], reverse=True)
+    return results
+
+
+def update_leaderboard_index_on_commit(player_scores):
+    """Updates the leaderboard indexes with the (player_id, score) pairs once the scores are committed(right away outside of a transaction)."""
+    transaction.on_commit(lambda: update_leaderboard_index(player_scores))
+
+
+def refresh_levels(player_ids):
+    """Recomputes the level and the leaderboard position of the players after their score was changed. The in-process leaderboard
+    index is updated only when the transaction commits, so it never holds scores that were rolled back."""
+    from gui.services import get_level_for_score # gui.services imports this module
+
+    changed = []
+    player_scores = []
+    for player in Player.objects.filter(id__in=player_ids).only('id', 'score', 'level'):
+        player_scores.append((player.id, player.score))
+        level = get_level_for_score(player.score)
+        if player.level != level:
+            player.level = level
+            changed.append(player)
+    Player.objects.bulk_update(changed, ['level'])
+    update_leaderboard_index_on_commit(player_scores)
+
+
+def claim_score_events(batch_size):
+    """Marks the next batch of pending events as rolled up with a single UPDATE ... RETURNING statement and returns their ids.
+    Concurrent rollups never claim the same event, also on SQLite, which has no SELECT FOR UPDATE."""
+    table = connection.ops.quote_name(ScoreEvent._meta.db_table)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            f'UPDATE {table} SET rolled_up = %s WHERE rolled_up = %s AND id IN '
+            f'(SELECT id FROM {table} WHERE rolled_up = %s ORDER BY id LIMIT %s) RETURNING id',
+            [True, False, False, batch_size]
+        )
+        return [event_id for event_id, in cursor.fetchall()]
+
+
+def roll_up_score_events(batch_size=None):
+    """Folds one batch of the events that are not rolled up yet, in the order they were appended, into Player.score and PointsPerDay.
+    The batch is claimed first and only the claimed events are folded, all in one transaction, so every event is counted exactly once
+    even if several rollups run at the same time. Returns the number of rolled up events, a number smaller than the batch size
+    means that no events are pending."""
+    batch_size = batch_size or settings.SCORE_EVENTS_ROLLUP_BATCH_SIZE
+
+    with transaction.atomic():
+        event_ids = claim_score_events(batch_size)
+        if not event_ids:
+            return 0
+        events = list(ScoreEvent.objects.filter(id__in=event_ids).values_list('id', 'player_id', 'date', 'points'))
+
+        points_by_player = defaultdict(int)
+        points_by_day = defaultdict(int)
+        for _, player_id, day, points in events:
+            points_by_player[player_id] += points
+            points_by_day[(player_id, day)] += points
+
+        for player_id, points in points_by_player.items():
+            if points:
+                Player.objects.filter(pk=player_id).update(score=F('score') + points)
+        add_points_per_day(points_by_day)
+
+    refresh_levels(points_by_player.keys())
+    return len(events)
+
+
+def roll_up_all_score_events(batch_size=None):
+    """Rolls up batches until no events are pending. Returns the number of rolled up events."""
+    batch_size = batch_size or settings.SCORE_EVENTS_ROLLUP_BATCH_SIZE
+    total = 0
+    while True:
+        rolled_up = roll_up_score_events(batch_size)
+        total += rolled_up
+        if rolled_up < batch_size:
+            return total
@@ -1,86 +1,165 @@
 
 from gui.models import Player, QuizAttempt, Question, MultiPlayerSession, Answer, QuestionResponse, PointsPerDay, QuestionType
 from gui.forms import QuizForm, QuestionForm, AnswerForm
+from gui.leaderboard import get_leaderboard_index
+from gui.quiz_cache import get_quiz_content, bump_quiz_content_version, bump_quiz_content_version_for
+from gui.score_ledger import add_points_to_attempt, finish_quiz_attempt, update_leaderboard_index_on_commit
 from django.contrib import messages
 from django.shortcuts import redirect, render
-import matplotlib.pyplot as plt
-import base64
-from io import BytesIO
 from datetime import date
 from django.http import Http404
+from django.db import transaction
+from django.db.models import Q, F, Count, Avg, Min, Max
+from math import ceil
+from django.conf import settings
+from bisect import bisect_right
+from functools import lru_cache
+from collections import defaultdict
+
+def get_dense_rank_for_score(score):
+    """Dense rank of a score in the leaderboard - one plus the number of distinct higher scores.
+    It is a single count query over the index on Player.score, so it does not depend on the number of players."""
+    return Player.objects.filter(score__gt=score).values('score').distinct().count() + 1
 
 def get_player_rank_in_leaderboard(player):
-    leaderboard = Player.objects.all().order_by('-score')
-
-    rank = 1
-    for p in leaderboard:
-        if p == player:
-            player.rank = rank
-            break
-        rank += 1
+    """Function that sets the dense rank of the player(players with equal score share a rank) and stores it in Player.rank."""
+    rank = get_dense_rank_for_score(player.score)
+    if player.pk is not None and player.rank != rank:
+        Player.objects.filter(pk=player.pk).update(rank=rank)
+    player.rank = rank
+
+def parse_leaderboard_cursor(cursor):
+    """Function that parses a 'score:id' leaderboard cursor. Returns None for a missing or malformed cursor."""
+    try:
+        score, player_id = cursor.split(':')
+        return int(score), int(player_id)
+    except (AttributeError, ValueError):
+        return None
+
+def get_leaderboard_page(cursor=None, page_size=20):
+    """Function that returns one page of the leaderboard as (rank, player) pairs and the cursor of the next page.
+    Players are ordered by descending (score, id) and the page starts right after the (score, id) cursor, so every page
+    is a single index range scan no matter how deep it is. Only the rank of the first row is counted, the rest are derived from it."""
+    players = Player.objects.select_related('user').order_by('-score', '-id')
+    if cursor is not None:
+        score, player_id = cursor
+        players = players.filter(Q(score__lt=score) | Q(score=score, id__lt=player_id))
+
+    page = list(players[:page_size + 1])
+    next_cursor = None
+    if len(page) > page_size:
+        page = page[:page_size]
+        next_cursor = f'{page[-1].score}:{page[-1].id}'
+
+    entries = []
+    for player in page:
+        if not entries:
+            rank = get_dense_rank_for_score(player.score)
+        elif player.score != entries[-1][1].score:
+            rank += 1
+        entries.append((rank, player))
+    return entries, next_cursor
+
+def get_multiplayer_leaderboard(size):
+    """Function that returns the best players of all multiplayer games as results(like the results of a game) - a single range scan
+    of the multiplayer_score index."""
+    players = Player.objects.filter(multiplayer_score__gt=0).order_by('-multiplayer_score', '-id').values_list('user__username', 'multiplayer_score')
+    return [{'player_username': username, 'score': score} for username, score in players[:size]]
+
+def get_leaderboard_entries(player_scores):
+    """Function that turns (player_id, score) pairs from the leaderboard index into (rank, player) pairs, 
+    fetching all the players with their users in one query."""
+    index = get_leaderboard_index()
+    players = Player.objects.select_related('user').in_bulk([player_id for player_id, _ in player_scores])
+    return [(index.rank_of(player_id), players[player_id]) for player_id, _ in player_scores if player_id in players]
+
+@lru_cache(maxsize=8)
+def get_level_thresholds(levels):
+    """Function that splits the level table into a sorted list of thresholds and the list of level names."""
+    return [threshold for threshold, _ in levels], [level for _, level in levels]
+
+def get_level_for_score(score):
+    """Function that finds the level for the score in the PLAYER_LEVELS table with binary search."""
+    thresholds, levels = get_level_thresholds(tuple(settings.PLAYER_LEVELS))
+    position = bisect_right(thresholds, score)
+    if position == 0:
+        return settings.PLAYER_LOWEST_LEVEL
+    return levels[position - 1]
 
 def change_player_level_by_score(player):
-    if player.score < 0:
-        player.level = 'Noob'
-    elif 0 <= player.score <= 10:
-        player.level = 'Beginner'
-    elif 10 < player.score <= 20:
-        player.level = 'Medium'
-    elif 20 < player.score <= 30:
-        player.level = 'Good'
-    elif 30 < player.score <= 40:
-        player.level = 'Very good'
-    elif 40 < player.score <= 50:
-        player.level = 'Impressive'
-    elif 50 < player.score <= 60:
-        player.level = 'Fighting for the top'
-    else:
-        player.level = 'Master'
-
-def get_graph():
-    """Function that generates a graph using matplotlip, save it as a PNG in memory, encode it into 
-    base64 format, and then return the base64 encoded string representation of the image."""
-
-    buffer = BytesIO() # creates an in-memory buffer
-    plt.savefig(buffer, format='png') # saves the current matplotlib figure to the buffer in PNG format
-    buffer.seek(0) # moves the pointer of the buffer back to the beginning, to read it from the start.
-    image_png = buffer.getvalue() # reads the content of the buffer
-    graph = base64.b64encode(image_png) # encodes the content of the buffer into base64 format
-    graph = graph.decode('utf-8') # converts the base64 encoded bytes to a UTF-8 string representation
-    buffer.close() # closes the buffer to free up system resources
-    return graph
-
-def plot_decorator(func):
-    def wrapper(x, y, title, x_label, y_label):
-        plt.switch_backend('AGG') # switches the backend of matplotlib to 'AGG', which is a non-interactive backend that is often used when generating plots without displaying them directly
-        plt.figure(figsize=(10, 5)) # creates a new figure with a width of 10 inches and a height of 5 inches
-        plt.title(title, fontsize=25, fontname="Baskerville Old Face")
-        func(x, y)
-        plt.xticks(rotation=45)
-        plt.xlabel(x_label, fontsize=15, fontname="Baskerville Old Face")
-        plt.ylabel(y_label, fontsize=15, fontname="Baskerville Old Face")
-        plt.tight_layout()
-        graph = get_graph()
-        plt.close()
-        return graph
-    return wrapper
-
-@plot_decorator
-def get_plot_for_per_player_since_registration(x, y):
-    plt.bar(x, y, color='orange', edgecolor='black')
-
-@plot_decorator
-def get_plot_for_each_quiz_score(x, y):
-    plt.scatter(x, y, c='orange')
-    plt.grid(True)
+    """Function that sets the level of the player by his score. It is called only when the score changes."""
+    player.level = get_level_for_score(player.score)
+
+def get_percentile_from_histogram(histogram, count, percentile):
+    """Function that returns the nearest-rank percentile of count scores given as an ascending list of (score, number of attempts) pairs."""
+    rank = max(ceil(percentile / 100 * count), 1)
+    seen = 0
+    for score, attempts in histogram:
+        seen += attempts
+        if seen >= rank:
+            return score
+
+def get_quiz_score_statistics():
+    """Function that returns the score statistics of every quiz - number of attempts, mean, min, max and percentiles.
+    Everything is aggregated by the database with two grouped queries - the summary of each quiz and the number of attempts with each
+    score of each quiz, from which the percentiles are computed. The attempts themselves are never loaded."""
+    summaries = QuizAttempt.objects.values('quiz_id', 'quiz__title').annotate(
+        count=Count('id'), mean=Avg('score'), min=Min('score'), max=Max('score')
+    ).order_by('quiz__title', 'quiz_id')
+
+    histograms = defaultdict(list)
+    for row in QuizAttempt.objects.values('quiz_id', 'score').annotate(attempts=Count('id')).order_by('quiz_id', 'score'):
+        histograms[row['quiz_id']].append((row['score'], row['attempts']))
+
+    statistics = []
+    for summary in summaries:
+        histogram = histograms[summary['quiz_id']]
+        quiz_statistics = {
+            'quiz': summary['quiz__title'],
+            'count': summary['count'],
+            'mean': round(summary['mean'], 2),
+            'min': summary['min'],
+            'max': summary['max'],
+        }
+        for percentile in [25, 50, 75, 90]:
+            quiz_statistics[f'p{percentile}'] = get_percentile_from_histogram(histogram, summary['count'], percentile)
+        statistics.append(quiz_statistics)
+    return statistics
+
+def get_points_series(player):
+    """Function that returns the daily points of the player since his registration(days without points included), with the weekly and
+    monthly rollups, the cumulative points and their moving average."""
+    from gui.timeseries import build_points_series # imported lazily, numpy is loaded only for the statistics
+
+    points_per_days = PointsPerDay.objects.filter(player=player).values_list('date', 'points')
+    return build_points_series(player.registration_date, list(points_per_days), moving_average_window=settings.POINTS_MOVING_AVERAGE_DAYS)
+
+def get_statistics_chart(chart_name, player, statistics=None):
+    """Function that returns the name of the plot in gui.charts that draws the statistics chart and its arguments(the data, title and labels).
+    The quiz score statistics already computed by the caller may be passed as statistics."""
+    if chart_name == 'per_player':
+        if player is None:
+            raise Http404("Player does not exist")
+        series = get_points_series(player)
+        days = [date.fromisoformat(day) for day in series['days']]
+        return 'per_player_since_registration', (days, (series['daily'], series['moving_average']), 
+                                                 'Points Earned per Day Since Registration', 'Days Since Registration', 'Points Earned')
+    if chart_name == 'each_quiz_score':
+        if statistics is None:
+            statistics = get_quiz_score_statistics()
+        quizzes = [f"{quiz_statistics['quiz']} ({quiz_statistics['count']})" for quiz_statistics in statistics]
+        return 'each_quiz_score', (quizzes, statistics, 
+                                   'Points earned from each quiz', 'Quizzes', 'Points Earned')
+    raise Http404("Chart does not exist")
 
 def start_quiz(request, quiz, player):
-    question = Question.objects.filter(quiz=quiz).first()
-    if question is None:
+    question_order = quiz.get_question_order(shuffle=quiz.shuffle_questions)
+    if not question_order:
         messages.warning(request, 'No questions available for this quiz!')
         return redirect('not_found')
 
-    quiz_attempt = QuizAttempt(quiz=quiz)
+    question = Question.objects.get(id=question_order.first())
+    quiz_attempt = QuizAttempt(quiz=quiz, question_order=question_order.question_ids)
     quiz_attempt.save()
     player.active_attempt = quiz_attempt
     player.save()
@@ -96,12 +175,16 @@ def create_room(request, quiz, player):
         messages.error(request, 'You have to enter a room code to join!')
         return redirect('view_quiz', quiz_id=quiz.id)
 
-    if MultiPlayerSession.objects.filter(room_code=room_code, active=True).exists():
+    if MultiPlayerSession.get_live_sessions().filter(room_code=room_code).exists():
         messages.error(request, 'Room code already exists! Please enter a different one.')
         return redirect('view_quiz', quiz_id=quiz.id)
 
+    from gui.rooms import reap_stale_sessions # gui.rooms imports this module
+
+    reap_stale_sessions() # the room code may be reused from a stale session that was not reaped yet - its players leave their attempts
     multiplayer = MultiPlayerSession(room_code=room_code, quiz=quiz, creator=player, active=True)
     multiplayer.save()
+    multiplayer.players.clear()
     return redirect('multiplayer', room_code=multiplayer.room_code)
 
 def join_room(request, quiz, player):
@@ -129,20 +212,23 @@ def join_room(request, quiz, player):
         
     return redirect('multiplayer', room_code=multiplayer.room_code)
 
-def create_question_response_and_update_score(question, answer_response_id, player, quiz):
-    answer = Answer.objects.filter(question=question, id=answer_response_id).first()
-    question_response = QuestionResponse(
-        player=player,
-        quiz=quiz,
-        question=question,
-        answer=answer,
-    )
-    question_response.save()
-    player.active_attempt.responses.add(question_response)
-        
-    if answer.is_correct:
-        player.active_attempt.score += answer.points
-        player.active_attempt.save()
+def create_question_responses_and_update_score(question, answer_response_ids, player, quiz):
+    """Function that saves all the answers given for a question in one transaction - the answers are read with one query, the responses
+    are inserted with one bulk insert, attached to the attempt with one bulk insert in the m2m table and the points of the correct ones
+    are added to the attempt score with one atomic update."""
+    quiz_attempt = player.active_attempt
+    with transaction.atomic():
+        answers = list(Answer.objects.filter(question=question, id__in=answer_response_ids))
+        question_responses = QuestionResponse.objects.bulk_create([
+            QuestionResponse(player=player, quiz=quiz, question=question, answer=answer) for answer in answers
+        ])
+
+        AttemptResponse = QuizAttempt.responses.through
+        AttemptResponse.objects.bulk_create([
+            AttemptResponse(quizattempt_id=quiz_attempt.id, questionresponse_id=question_response.id) for question_response in question_responses
+        ])
+
+        add_points_to_attempt(quiz_attempt, sum(answer.points for answer in answers if answer.is_correct))
 
 def single_choice_answer(request, quiz, question, next_question):
     answer_response_id = request.POST.get('answer_response_id')
@@ -151,15 +237,14 @@ def single_choice_answer(request, quiz, question, next_question):
         messages.warning(request, 'You have to answer the question to proceed!')
         return redirect(request.path)
     
-    player = Player.objects.get(user=request.user)
+    player = Player.objects.select_related('active_attempt').get(user=request.user)
     
     """If the player has already answered the quiz, he can not return to the previous question. So we redirect him to the quiz page."""
     if player.active_attempt is None:
         messages.error(request, 'You can not return when you have already answer the quiz. Please, start new quiz.')
         return redirect('view_quiz', quiz_id=quiz.id)
     
-    create_question_response_and_update_score(question=question, answer_response_id=answer_response_id, player=player, quiz=quiz)
-    player.save()
+    create_question_responses_and_update_score(question=question, answer_response_ids=[answer_response_id], player=player, quiz=quiz)
 
     return get_next_question(quiz, next_question)
 
@@ -170,19 +255,27 @@ def multiple_choice_answer(request, quiz, question, next_question):
         messages.warning(request, 'You have to answer the question to proceed!')
         return redirect(request.path)
     
-    player = Player.objects.get(user=request.user)
+    player = Player.objects.select_related('active_attempt').get(user=request.user)
     
     """If the player has already answered the quiz, he can not return to the previous question. So we redirect him to the quiz page."""
     if player.active_attempt is None:
         messages.error(request, 'You can not return when you have already answer the quiz. Please, start new quiz.')
         return redirect('view_quiz', quiz_id=quiz.id)
 
-    for answer_response_id in answer_responses_id:
-        create_question_response_and_update_score(question=question, answer_response_id=answer_response_id, player=player, quiz=quiz)
-    player.save()
+    create_question_responses_and_update_score(question=question, answer_response_ids=answer_responses_id, player=player, quiz=quiz)
 
     return get_next_question(quiz, next_question)
     
+def get_question_order_for_player(quiz, player, quiz_order=None):
+    """Function that returns the question order of the active attempt of the player. Players without an attempt on this quiz,
+    like the ones in a multiplayer game, get the order of the quiz - quiz_order if it is already known."""
+    quiz_attempt = player.active_attempt
+    if quiz_attempt is not None and quiz_attempt.quiz_id == quiz.id and quiz_attempt.question_order:
+        return quiz_attempt.get_question_order()
+    if quiz_order is not None:
+        return quiz_order
+    return quiz.get_question_order()
+
 def get_next_question(quiz, next_question):
     if next_question is None:
         return redirect('results', quiz_id=quiz.id)
@@ -192,31 +285,47 @@ def get_next_question(quiz, next_question):
     elif next_question.question_type == QuestionType.MULTIPLE_CHOICE.value:
         return redirect('view_multiple_choice_question', quiz_id=quiz.id, question_id=next_question.id)
     
-def get_question_data_results(question, player, quiz):
-    """Function that returns the question data for the results page."""
-    return {
-        'question': question,
-        'answers': list(Answer.objects.filter(question=question)),
-        'user_answers': player.active_attempt.responses.filter(
-            quiz=quiz,
-            player=player,
-            question=question                
-        ).all(),
-        'right_answers': Answer.objects.filter(question=question, is_correct=True).all()
-    }
-
-def calculate_points_after_quiz(player):
-    """Function that calculates the points after a quiz. The points are added to the player score and to the PointsPerDay model."""
+def get_questions_data_results(quiz, player):
+    """Function that returns the data of every question for the results page. The questions come with their answers prefetched and
+    the responses of the attempt are read with a single query and grouped by question in memory, so the number of queries does not
+    depend on the number of questions."""
+    questions = Question.objects.filter(quiz=quiz).prefetch_related('answer_set')
+    question_order = player.active_attempt.get_question_order()
+    if question_order:
+        questions_by_id = questions.in_bulk(question_order.question_ids)
+        questions = [questions_by_id[question_id] for question_id in question_order.question_ids if question_id in questions_by_id]
+
+    user_answers = defaultdict(list)
+    responses = player.active_attempt.responses.filter(quiz=quiz, player=player).select_related('answer')
+    for response in responses:
+        user_answers[response.question_id].append(response)
+
+    questions_data = []
+    for question in questions:
+        answers = list(question.answer_set.all())
+        questions_data.append({
+            'question': question,
+            'answers': answers,
+            'user_answers': user_answers[question.id],
+            'right_answers': [answer for answer in answers if answer.is_correct]
+        })
+    return questions_data
+
+def calculate_points_after_quiz(player, multiplayer=False):
+    """Function that calculates the points after a quiz. The points are added to the player score and to the PointsPerDay model
+    by the score ledger, then the level of the player and the leaderboard index are updated.
+    With SCORE_EVENTS_DEFERRED the points are only logged and the rollup job updates the score, the level and the index later."""
     if player.active_attempt is None:
         return redirect('not_found')
     
-    player.score += player.active_attempt.score
-    points_today = PointsPerDay.objects.get_or_create(player=player, date=date.today())[0]
-    points_today.points += player.active_attempt.score
-    points_today.save()
+    if finish_quiz_attempt(player, multiplayer=multiplayer) is None:
+        return # the attempt was already finished by a concurrent request
+    if settings.SCORE_EVENTS_DEFERRED:
+        return
 
-    player.active_attempt = None
-    player.save()
+    change_player_level_by_score(player)
+    player.save(update_fields=['level'])
+    update_leaderboard_index_on_commit([(player.id, player.score)])
 
 def edit_quiz_form(request, quiz):
     """Function that renders the edit quiz form. It is used in the edit_quiz view."""
@@ -254,6 +363,7 @@ def edit_question_submission(request, question):
         messages.error(request, 'You can not edit a question from a deleted category!')
         return redirect('not_found')
     
+    bump_quiz_content_version(question.quiz_id) # the question may be moved to another quiz
     form = QuestionForm(request.POST, instance=question)
     return check_if_form_is_valid(request, form, 'Question updated successfully!', 'show_all_questions_for_player')
     
@@ -269,12 +379,14 @@ def edit_answer_submission(request, answer):
         messages.error(request, 'You can not edit an answer from a deleted category!')
         return redirect('not_found')
     
+    bump_quiz_content_version(answer.question.quiz_id) # the answer may be moved to a question from another quiz
     form = AnswerForm(request.POST, instance=answer)
     return check_if_form_is_valid(request, form, 'Answer updated successfully!', 'show_all_answers_for_player')
     
 def check_if_form_is_valid(request, form, message, redirect_success_url):
     if form.is_valid():
-        form.save()
+        element = form.save()
+        bump_quiz_content_version_for(element)
         messages.success(request, message)
         return redirect(redirect_success_url)
     else:
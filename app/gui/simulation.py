@@ -0,0 +1,153 @@
+"""Simulated multiplayer games played in-process through the websocket routes of QuizConsumer with channels' WebsocketCommunicator.
+Used by the protocol benchmark and the load test. The games are created in the test database - use benchmark_database() outside of tests."""
+
+import asyncio
+import random
+import time
+from contextlib import contextmanager
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import override_settings
+
+from gui.models import Player, Quiz, Question, Answer, MultiPlayerSession
+from gui.routing import websocket_urlpatterns
+
+application = URLRouter(websocket_urlpatterns)
+
+
+IN_MEMORY_CHANNEL_LAYER = {'BACKEND': 'channels.layers.InMemoryChannelLayer', 'CONFIG': {'capacity': 1000}}
+
+
+@contextmanager
+def benchmark_database(channel_layer=IN_MEMORY_CHANNEL_LAYER):
+    """Runs the block on a new test database, like the test runner does, with the channel layer(the in-memory one by default)."""
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    try:
+        with override_settings(CHANNEL_LAYERS={'default': channel_layer}):
+            yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def create_game(room_code, player_count, question_count):
+    """Creates a quiz with question_count questions, each with a correct and a wrong answer, player_count players and a session
+    of the quiz created by the first player. Returns the users of the players and the answer ids of every question."""
+    quiz = Quiz.objects.create(title=f'Quiz {room_code}')
+    answer_ids = {}
+    for number in range(question_count):
+        question = Question.objects.create(quiz=quiz, question=f'Question {number}')
+        answer_ids[question.id] = [
+            Answer.objects.create(question=question, answer='Right', points=2, is_correct=True).id,
+            Answer.objects.create(question=question, answer='Wrong', points=0, is_correct=False).id,
+        ]
+
+    users = [User.objects.create(username=f'{room_code}-player{number}') for number in range(player_count)]
+    players = [Player.objects.create(user=user) for user in users]
+    MultiPlayerSession.objects.create(room_code=room_code, quiz=quiz, creator=players[0])
+    return users, answer_ids
+
+
+class SimulatedPlayer:
+    """Websocket client of one player in a room."""
+
+    def __init__(self, room_code, user, timeout=10):
+        self.communicator = WebsocketCommunicator(application, f'/ws/multiplayer/{room_code}/')
+        self.communicator.scope['user'] = user
+        self.timeout = timeout
+
+    async def connect(self):
+        connected, _ = await self.communicator.connect(timeout=self.timeout)
+        if not connected:
+            raise ConnectionError('the consumer rejected the connection')
+        return await self.receive()
+
+    async def receive(self):
+        return await self.communicator.receive_json_from(timeout=self.timeout)
+
+    async def send(self, message):
+        await self.communicator.send_json_to(message)
+
+    async def disconnect(self):
+        await self.communicator.disconnect(timeout=self.timeout)
+
+
+class LoadStats:
+    """Messages of the simulated games. The latency of a broadcast(show_question or show_results) is the time from the message
+    of the room that triggered it - start_game or the last answer to the question - until a player receives it.
+    The broadcasts of a room are numbered in the order they are sent: 0 is the first question."""
+
+    def __init__(self):
+        self.sent = 0
+        self.received = 0
+        self.latencies = []
+        self._triggers = {}
+
+    def message_sent(self, room_code, triggers=None):
+        """Counts a message. triggers is the number of the broadcast the message triggers, if any."""
+        self.sent += 1
+        if triggers is not None:
+            self._triggers[room_code, triggers] = time.perf_counter()
+
+    def message_received(self, room_code, message, broadcast=None):
+        """Counts a message. broadcast is its number, if it is a broadcast."""
+        self.received += 1
+        if message['type'] in ('show_question', 'show_results'):
+            self.latencies.append(time.perf_counter() - self._triggers[room_code, broadcast])
+
+    def get_percentile(self, percent):
+        """Nearest-rank percentile of the latencies in seconds."""
+        latencies = sorted(self.latencies)
+        return latencies[max(0, -(-len(latencies) * percent // 100) - 1)]
+
+
+async def play_game(room_code, users, answer_ids, answer_delay=0, stats=None):
+    """Plays a game - the first player starts it and on every question each player picks a random answer after answer_delay seconds.
+    The messages are counted in stats(LoadStats). Returns the results of the game."""
+    stats = stats or LoadStats()
+    players = [SimulatedPlayer(room_code, user) for user in users]
+    for player in players:
+        await player.connect()
+
+    answer_counts = [0] * len(answer_ids)
+
+    async def play(player):
+        for broadcast in range(len(answer_ids) + 1):
+            message = await player.receive()
+            stats.message_received(room_code, message, broadcast)
+            if message['type'] == 'show_results':
+                return message['results']
+            if answer_delay:
+                await asyncio.sleep(random.uniform(0, answer_delay))
+            answer_counts[broadcast] += 1
+            last_answer = answer_counts[broadcast] == len(players)
+            stats.message_sent(room_code, triggers=broadcast + 1 if last_answer else None)
+            await player.send({'type': 'submit_answer', 'answer_ids': [random.choice(answer_ids[message['question']['id']])]})
+
+    stats.message_sent(room_code, triggers=0)
+    await players[0].send({'type': 'start_game'})
+    results = await asyncio.gather(*(play(player) for player in players))
+    for player in players:
+        await player.disconnect()
+    return results[0]
+
+
+def create_and_play_game(room_code, player_count, question_count, answer_delay=0):
+    """Sync entry point of the benchmarks - creates a game and plays it to the results."""
+    users, answer_ids = create_game(room_code, player_count, question_count)
+    return asyncio.run(play_game(room_code, users, answer_ids, answer_delay))
+
+
+def run_load_test(room_count, player_count, question_count, answer_delay=0):
+    """Creates room_count games and plays all of them at the same time. Returns the LoadStats and the duration in seconds."""
+    games = [(f'load{number}', *create_game(f'load{number}', player_count, question_count)) for number in range(room_count)]
+    stats = LoadStats()
+
+    async def play_games():
+        await asyncio.gather(*(play_game(room_code, users, answer_ids, answer_delay, stats) for room_code, users, answer_ids in games))
+
+    start = time.perf_counter()
+    asyncio.run(play_games())
+    return stats, time.perf_counter() - start
@@ -42,86 +42,19 @@ quizSocket.onmessage = function (event) {
         });
     }
     else if (data.type === 'show_question') {
-        // We want to display the question in the question-container div
-        // We can use the fetch API to get the question data from the server
-        // We hide all the elements in the body and append the questionContainer to the body
-        // We use querySelectorAll to select all elements in the body and hide them
-        // We use the createElement method to create a new div element for the questionContainer
-        // and then we use the innerHTML property to set the content of the questionContainer div
-        // We use the appendChild method to add the questionContainer to the body
+        // With MULTIPLAYER_PUSH_QUESTIONS the question comes with its answers and we render it right away,
+        // otherwise we use the fetch API to get the page of the question from the server
 
         console.log("in show_question");
-        const questionUrl = data.question.url;
-        if (questionUrl) {
-            fetch(questionUrl)
+        if (data.question.answers) {
+            showQuestion(renderQuestion(data.question));
+        } else if (data.question.url) {
+            fetch(data.question.url)
                 .then(response => response.text())
                 .then(html => {
-                    // Using querySelectorAll to select all elements, expect the game-container, in the body and remove them
-                    document.querySelectorAll('body > *:not(#game-container)').forEach(element => {
-                        //element.style.display = 'none';
-                        element.remove();
-                    });
-                    // We create a new div element to display the question(the element question-container will be put here)
-                    const questionContainer = document.getElementById('question-container');
-                    if (questionContainer) {
-                        questionContainer.innerHTML = html;
-                    } else {
-                        const newContainer = document.createElement('div');
-                        newContainer.id = 'question-container';
-                        newContainer.innerHTML = html;
-                        // We append the questionContainer to the body
-                        document.body.appendChild(newContainer);
-                    }
-
-                    const nextQuestionButton = document.getElementById('next-question-button');
-
-                    if (nextQuestionButton) {
-                        nextQuestionButton.addEventListener('click', function (event) {
-                            event.preventDefault()
-                            console.log("in next_question");
-
-                            const selectedAnswers = document.querySelectorAll('input[type="checkbox"]:checked, input[type="radio"]:checked');
-                            const answersIds = Array.from(selectedAnswers).map(answer => answer.value);
-                            console.log("answersIds:", answersIds);
-
-                            if (answersIds.length === 0) {
-                                alert("Please select at least one answer before submitting.");
-                                return;
-                            }
-
-                            quizSocket.send(JSON.stringify({
-                                type: 'submit_answer',
-                                room_code: room_code,
-                                username: username,
-                                answer_ids: answersIds
-                            }));
-                        });
-                    }
-
-                    const finishButton = document.getElementById('finish-button');
-
-                    if (finishButton) {
-                        finishButton.addEventListener('click', function (event) {
-                            event.preventDefault()
-                            console.log("in finish_question");
-
-                            const selectedAnswers = document.querySelectorAll('input[type="checkbox"]:checked, input[type="radio"]:checked');
-                            const answersIds = Array.from(selectedAnswers).map(answer => answer.value);
-                            console.log("answersIds:", answersIds);
-
-                            if (answersIds.length === 0) {
-                                alert("Please select at least one answer before submitting.");
-                                return;
-                            }
-
-                            quizSocket.send(JSON.stringify({
-                                type: 'submit_answer',
-                                room_code: room_code,
-                                username: username,
-                                answer_ids: answersIds
-                            }));
-                        });
-                    }
+                    const page = document.createElement('div');
+                    page.innerHTML = html;
+                    showQuestion(page);
                 })
                 .catch(error => console.error('Error fetching question data: ', error));
         }
@@ -135,8 +68,8 @@ quizSocket.onmessage = function (event) {
             element.remove();
         });
 
-        console.log("data.results:", data.results);
-        fetch(`/multiplayer_leaderboard/?results=${encodeURIComponent(JSON.stringify(data.results))}`)
+        // The results are stored on the server when the game is finished
+        fetch(`/multiplayer_leaderboard/${encodeURIComponent(room_code)}/`)
             .then(response => response.text())
             .then(leaderboardMultiplayerHtml => {
                 const leaderboard_container = document.createElement('div');
@@ -147,3 +80,84 @@ quizSocket.onmessage = function (event) {
             .catch(error => console.error('Error fetching header data: ', error));
     }
 };
+
+// Builds the same form as the question pages(single_choice_question.html and multiple_choice_question.html) from the pushed question.
+// The texts are set with textContent, so they are never interpreted as HTML.
+function renderQuestion(question) {
+    const page = document.createElement('div');
+    const title = document.createElement('h1');
+    title.style.marginTop = '5em';
+    title.style.marginBottom = '1em';
+    title.textContent = question.text;
+    page.appendChild(title);
+
+    const answers = document.createElement('div');
+    answers.className = 'answers';
+    const form = document.createElement('form');
+    question.answers.forEach(answer => {
+        const answerElement = document.createElement('div');
+        answerElement.className = 'answer';
+        const input = document.createElement('input');
+        input.type = question.question_type === 'single choice' ? 'radio' : 'checkbox';
+        input.className = question.question_type === 'single choice' ? 'answer-radio-button' : 'answer-checkbox';
+        input.name = 'answer_response_id';
+        input.value = answer.id;
+        const label = document.createElement('label');
+        label.style.fontSize = '2rem';
+        label.textContent = answer.text;
+        answerElement.appendChild(input);
+        answerElement.appendChild(label);
+        form.appendChild(answerElement);
+    });
+
+    const button = document.createElement('button');
+    button.type = 'submit';
+    button.id = question.is_last ? 'finish-button' : 'next-question-button';
+    button.textContent = question.is_last ? 'Finish' : 'Next Question';
+    form.appendChild(button);
+    answers.appendChild(form);
+    page.appendChild(answers);
+    return page;
+}
+
+// We remove all the elements in the body, expect the game-container, and put the question in the question-container div
+function showQuestion(page) {
+    document.querySelectorAll('body > *:not(#game-container):not(#question-container)').forEach(element => {
+        element.remove();
+    });
+    let questionContainer = document.getElementById('question-container');
+    if (!questionContainer) {
+        questionContainer = document.createElement('div');
+        questionContainer.id = 'question-container';
+        document.body.appendChild(questionContainer);
+    }
+    questionContainer.replaceChildren(page);
+
+    ['next-question-button', 'finish-button'].forEach(buttonId => {
+        const button = document.getElementById(buttonId);
+        if (button) {
+            button.addEventListener('click', submitAnswers);
+        }
+    });
+}
+
+function submitAnswers(event) {
+    event.preventDefault()
+    console.log("in submit_answer");
+
+    const selectedAnswers = document.querySelectorAll('input[type="checkbox"]:checked, input[type="radio"]:checked');
+    const answersIds = Array.from(selectedAnswers).map(answer => answer.value);
+    console.log("answersIds:", answersIds);
+
+    if (answersIds.length === 0) {
+        alert("Please select at least one answer before submitting.");
+        return;
+    }
+
+    quizSocket.send(JSON.stringify({
+        type: 'submit_answer',
+        room_code: room_code,
+        username: username,
+        answer_ids: answersIds
+    }));
+}
@@ -1,10 +1,70 @@
 from django.test import TestCase
-from .models import Player, PointsPerDay
-from .services import get_player_rank_in_leaderboard, change_player_level_by_score
+from .models import Player, PointsPerDay, ScoreEvent, MultiPlayerSession, MultiplayerResult, Quiz, QuizAttempt, Question, Answer, QuestionResponse, QuestionOrder, Category, Forum
+from .quiz_cache import get_quiz_content, bump_quiz_content_version
+from .chart_cache import ChartCache, chart_cache
+from .timeseries import build_points_series
+from .score_ledger import add_points_to_attempt, add_points_per_day, finish_quiz_attempt, finish_multiplayer_game, roll_up_score_events, roll_up_all_score_events
+from threading import Thread, Barrier
+from .channel_layers import SQLiteChannelLayer
+from .rooms import RoomState, rooms, heartbeat, reap_stale_sessions, join_room_step
+from .scheduler import RoomScheduler, RoomHeartbeat, room_scheduler
+from .instrumentation import protocol_stats
+from .simulation import create_and_play_game, run_load_test, LoadStats
+from .consumers import QuizConsumer
+from channels.testing import WebsocketCommunicator
+from channels.db import database_sync_to_async
+from channels.exceptions import ChannelFull
+import asyncio
+import tempfile
+from datetime import date, timedelta
+from .chart_renderer import ChartRenderer, ChartRenderError, chart_renderer
+from unittest import mock
+from .services import get_player_rank_in_leaderboard, change_player_level_by_score, calculate_points_after_quiz, get_leaderboard_page, parse_leaderboard_cursor
+from .services import get_questions_data_results, create_question_responses_and_update_score, get_quiz_score_statistics
+from .leaderboard import LeaderboardIndex, leaderboard_index, load_leaderboard_index, get_leaderboard_index, invalidate_leaderboard_index
 from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.test import override_settings, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.db import connection, transaction, OperationalError, IntegrityError
+from django.core.cache import cache, caches
+from django.utils import timezone
+from io import StringIO
+import os
+import subprocess
+import sys
+import time
+from django.conf import settings
 # Create your tests here.
 
 
+# The tests use their own shared cache(see CACHES in the settings), so the versions they store never reach the real one
+shared_cache_directory = tempfile.TemporaryDirectory()
+test_caches = override_settings(CACHES={
+    **settings.CACHES,
+    'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': shared_cache_directory.name},
+})
+
+
+def setUpModule():
+    test_caches.enable()
+
+
+def tearDownModule():
+    test_caches.disable()
+    shared_cache_directory.cleanup()
+
+
+def create_quiz_with_questions(question_count, title='Quiz'):
+    """Creates a quiz with question_count questions, each with one correct(2 points) and one wrong answer."""
+    quiz = Quiz.objects.create(title=title)
+    for number in range(question_count):
+        question = Question.objects.create(quiz=quiz, question=f'Question {number}')
+        Answer.objects.create(question=question, answer='Right', points=2, is_correct=True)
+        Answer.objects.create(question=question, answer='Wrong', points=0, is_correct=False)
+    return quiz
+
+
 class PlayerLevelTestCase(TestCase):
 
     def test_begginer_level(self):
@@ -88,4 +148,1301 @@ class PlayerRankTestCase(TestCase):
         new_user = User.objects.create(username='new_user')
         player = Player.objects.create(user=new_user, score=70)
         get_player_rank_in_leaderboard(player)
-        self.assertEqual(player.rank, 3)
\ No newline at end of file
+        self.assertEqual(player.rank, 3)
+
+class PlayerDenseRankTestCase(TestCase):
+
+    def setUp(self):
+        for username, score in [('first', 50), ('tied1', 30), ('tied2', 30), ('last', 10)]:
+            Player.objects.create(user=User.objects.create(username=username), score=score)
+
+    def test_tied_players_share_rank(self):
+        for username in ['tied1', 'tied2']:
+            player = Player.objects.get(user__username=username)
+            get_player_rank_in_leaderboard(player)
+            self.assertEqual(player.rank, 2)
+
+    def test_rank_after_tie_is_dense(self):
+        player = Player.objects.get(user__username='last')
+        get_player_rank_in_leaderboard(player)
+        self.assertEqual(player.rank, 3)
+
+    def test_rank_is_stored(self):
+        player = Player.objects.get(user__username='last')
+        get_player_rank_in_leaderboard(player)
+        self.assertEqual(Player.objects.get(pk=player.pk).rank, 3)
+
+    def test_rank_uses_single_query(self):
+        player = Player.objects.get(user__username='first')
+        player.rank = 1
+        with self.assertNumQueries(1):
+            get_player_rank_in_leaderboard(player)
+
+
+
+class LeaderboardIndexTestCase(TestCase):
+
+    def setUp(self):
+        self.index = LeaderboardIndex()
+        self.index.rebuild([(1, 100), (2, 80), (3, 80), (4, 40), (5, -2)])
+
+    def test_top(self):
+        self.assertEqual(self.index.top(3), [(1, 100), (3, 80), (2, 80)])
+
+    def test_rank_of_is_dense(self):
+        self.assertEqual(self.index.rank_of(3), 2)
+        self.assertEqual(self.index.rank_of(4), 3)
+        self.assertIsNone(self.index.rank_of(42))
+
+    def test_update_moves_player(self):
+        self.index.update(5, 90)
+        self.assertEqual(self.index.top(2), [(1, 100), (5, 90)])
+        self.assertEqual(self.index.rank_of(2), 3)
+        self.assertEqual(len(self.index), 5)
+
+    def test_update_removes_empty_score(self):
+        self.index.update(1, 10)
+        self.assertEqual(self.index.rank_of(2), 1)
+
+    def test_neighbours(self):
+        self.assertEqual(self.index.neighbours(2, 1), [(3, 80), (2, 80), (4, 40)])
+        self.assertEqual(self.index.neighbours(1, 1), [(1, 100), (3, 80)])
+
+
+class LeaderboardIndexHookTestCase(TestCase):
+
+    def setUp(self):
+        caches['shared'].clear() # a new version, so the index of this process is reloaded
+
+    def test_calculate_points_after_quiz_updates_index(self):
+        Player.objects.create(user=User.objects.create(username='leader'), score=20)
+        player = Player.objects.create(user=User.objects.create(username='climber'), score=5)
+        load_leaderboard_index()
+
+        player.active_attempt = QuizAttempt.objects.create(quiz=Quiz.objects.create(title='Quiz'), score=30)
+        player.save()
+        with self.captureOnCommitCallbacks(execute=True): # the index is updated when the score is committed
+            calculate_points_after_quiz(player)
+
+        self.assertEqual(leaderboard_index.score_of(player.id), 35)
+        self.assertEqual(leaderboard_index.rank_of(player.id), 1)
+
+    def test_score_changed_by_another_process(self):
+        player = Player.objects.create(user=User.objects.create(username='player'), score=5)
+        self.assertEqual(get_leaderboard_index().score_of(player.id), 5)
+
+        # e.g. the rollup_score_events command - it changes the score and the shared version, but not the index of this process
+        Player.objects.filter(pk=player.pk).update(score=12)
+        with mock.patch('gui.leaderboard.caches', {'shared': caches.create_connection('shared')}):
+            invalidate_leaderboard_index()
+
+        self.assertEqual(get_leaderboard_index().score_of(player.id), 12)
+
+    def test_admin_edit_invalidates_index(self):
+        admin = User.objects.create_superuser(username='admin', password='secret')
+        player = Player.objects.create(user=admin, score=5)
+        get_leaderboard_index()
+        self.client.force_login(admin)
+
+        self.client.post(f'/admin/gui/player/{player.id}/change/', {
+            'user': admin.id, 'score': 40, 'multiplayer_score': 0, 'rank': 0, 'level': 'Beginner', 'registration_date': '2024-01-01',
+        })
+
+        self.assertEqual(Player.objects.get(pk=player.pk).score, 40)
+        self.assertEqual(get_leaderboard_index().score_of(player.id), 40)
+
+    def test_leaderboard_page_uses_index(self):
+        user = User.objects.create_user(username='viewer', password='secret')
+        Player.objects.create(user=user, score=7)
+        load_leaderboard_index()
+        self.client.force_login(user)
+
+        response = self.client.get('/leaderboard/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([player.user.username for _, player in response.context['profiles']], ['viewer'])
+
+
+
+class LeaderboardPaginationTestCase(TestCase):
+
+    def setUp(self):
+        for username, score in [('a', 50), ('b', 40), ('c', 40), ('d', 30), ('e', 10)]:
+            Player.objects.create(user=User.objects.create(username=username), score=score)
+
+    def test_pages_cover_leaderboard_in_order(self):
+        usernames, ranks, cursor = [], [], None
+        while True:
+            page, next_cursor = get_leaderboard_page(cursor=cursor, page_size=2)
+            usernames += [player.user.username for _, player in page]
+            ranks += [rank for rank, _ in page]
+            if next_cursor is None:
+                break
+            cursor = parse_leaderboard_cursor(next_cursor)
+        self.assertEqual(usernames, ['a', 'c', 'b', 'd', 'e'])
+        self.assertEqual(ranks, [1, 2, 2, 3, 4])
+
+    def test_deep_page_costs_the_same_as_first(self):
+        cursor = (40, Player.objects.get(user__username='b').id)
+        with self.assertNumQueries(2):
+            page, _ = get_leaderboard_page(cursor=cursor, page_size=2)
+            [player.user.username for _, player in page]
+        self.assertEqual([rank for rank, _ in page], [3, 4])
+
+    def test_malformed_cursor(self):
+        self.assertIsNone(parse_leaderboard_cursor('abc'))
+        self.assertIsNone(parse_leaderboard_cursor(None))
+
+    def test_api(self):
+        user = User.objects.get(username='a')
+        self.client.force_login(user)
+
+        response = self.client.get('/leaderboard/api/')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['results'][0], {'rank': 1, 'username': 'a', 'score': 50})
+
+
+
+class PlayerLevelTableTestCase(TestCase):
+
+    def test_threshold_is_inclusive(self):
+        player = Player(score=11)
+        change_player_level_by_score(player)
+        self.assertEqual(player.level, 'Medium')
+
+    @override_settings(PLAYER_LEVELS=[(0, 'Rookie'), (100, 'Legend')], PLAYER_LOWEST_LEVEL='Lost')
+    def test_configurable_table(self):
+        for score, level in [(-1, 'Lost'), (99, 'Rookie'), (100, 'Legend')]:
+            player = Player(score=score)
+            change_player_level_by_score(player)
+            self.assertEqual(player.level, level)
+
+    def test_calculate_points_after_quiz_saves_level(self):
+        player = Player.objects.create(user=User.objects.create(username='player'), score=5)
+        player.active_attempt = QuizAttempt.objects.create(quiz=Quiz.objects.create(title='Quiz'), score=10)
+        player.save()
+        calculate_points_after_quiz(player)
+        self.assertEqual(Player.objects.get(pk=player.pk).level, 'Medium')
+
+    def test_recompute_player_levels_command(self):
+        for username, score in [('noob', -3), ('master', 70), ('beginner', 0)]:
+            Player.objects.create(user=User.objects.create(username=username), score=score)
+
+        call_command('recompute_player_levels', batch_size=1, stdout=StringIO())
+
+        self.assertEqual(dict(Player.objects.values_list('user__username', 'level')), {'noob': 'Noob', 'master': 'Master', 'beginner': 'Beginner'})
+
+
+
+class QuizResultsTestCase(TestCase):
+
+    def create_attempt(self, quiz):
+        player = Player.objects.create(user=User.objects.create(username=f'player{quiz.id}'))
+        player.active_attempt = QuizAttempt.objects.create(quiz=quiz)
+        player.save()
+        for question in quiz.question_set.all():
+            for answer in question.answer_set.all():
+                response = QuestionResponse.objects.create(player=player, quiz=quiz, question=question, answer=answer)
+                player.active_attempt.responses.add(response)
+        return player
+
+    def test_results_are_grouped_by_question(self):
+        quiz = create_quiz_with_questions(2)
+        player = self.create_attempt(quiz)
+
+        results = get_questions_data_results(quiz=quiz, player=player)
+
+        self.assertEqual(len(results), 2)
+        for question_data in results:
+            self.assertEqual([answer.answer for answer in question_data['right_answers']], ['Right'])
+            self.assertEqual({response.question for response in question_data['user_answers']}, {question_data['question']})
+            self.assertEqual(len(question_data['user_answers']), 2)
+
+    def test_number_of_queries_does_not_depend_on_quiz_length(self):
+        for question_count in [1, 20]:
+            quiz = create_quiz_with_questions(question_count, title=f'Quiz {question_count}')
+            player = self.create_attempt(quiz)
+            with self.assertNumQueries(3):
+                results = get_questions_data_results(quiz=quiz, player=player)
+                [str(response.answer) for question_data in results for response in question_data['user_answers']]
+
+
+
+class BulkAnswerSubmissionTestCase(TestCase):
+
+    def setUp(self):
+        self.quiz = Quiz.objects.create(title='Quiz')
+        self.question = Question.objects.create(quiz=self.quiz, question='Pick the primes', question_type='multiple choice')
+        self.answers = [
+            Answer.objects.create(question=self.question, answer=answer, points=points, is_correct=is_correct)
+            for answer, points, is_correct in [('2', 1, True), ('3', 2, True), ('4', 5, False)]
+        ]
+        self.player = Player.objects.create(user=User.objects.create(username='player'))
+        self.player.active_attempt = QuizAttempt.objects.create(quiz=self.quiz)
+        self.player.save()
+
+    def submit(self, answers):
+        create_question_responses_and_update_score(question=self.question, answer_response_ids=[answer.id for answer in answers], player=self.player, quiz=self.quiz)
+
+    def test_responses_and_score(self):
+        self.submit(self.answers)
+
+        attempt = QuizAttempt.objects.get(pk=self.player.active_attempt.pk)
+        self.assertEqual(attempt.score, 3)
+        self.assertEqual(sorted(response.answer.answer for response in attempt.responses.all()), ['2', '3', '4'])
+
+    def test_answers_of_other_questions_are_ignored(self):
+        other_question = Question.objects.create(quiz=self.quiz, question='Other')
+        other_answer = Answer.objects.create(question=other_question, answer='x', points=10, is_correct=True)
+
+        self.submit([self.answers[0], other_answer])
+
+        self.assertEqual(QuizAttempt.objects.get(pk=self.player.active_attempt.pk).score, 1)
+        self.assertEqual(QuestionResponse.objects.count(), 1)
+
+    def test_number_of_queries_does_not_depend_on_number_of_answers(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.submit(self.answers)
+        statements = [query['sql'] for query in queries.captured_queries if 'SAVEPOINT' not in query['sql']]
+        self.assertEqual(len(statements), 4)
+
+
+
+class QuestionOrderTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['shared'].clear()
+        self.quiz = create_quiz_with_questions(4)
+        self.questions = list(Question.objects.filter(quiz=self.quiz).order_by('id'))
+        self.user = User.objects.create_user(username='player', password='secret')
+        self.player = Player.objects.create(user=self.user)
+        self.client.force_login(self.user)
+
+    def test_next_and_previous(self):
+        order = QuestionOrder([5, 3, 8])
+        self.assertEqual(order.first(), 5)
+        self.assertEqual(order.next(3), 8)
+        self.assertIsNone(order.next(8))
+        self.assertEqual(order.previous(3), 5)
+        self.assertIsNone(order.previous(5))
+        self.assertIsNone(order.next(42))
+
+    def test_position_orders_questions(self):
+        self.questions[0].position = 10
+        self.questions[0].save()
+        expected = [question.id for question in self.questions[1:] + self.questions[:1]]
+        self.assertEqual(self.quiz.get_question_order().question_ids, expected)
+
+    def test_start_quiz_honours_max_questions(self):
+        self.quiz.max_questions = 2
+        self.quiz.save()
+
+        response = self.client.post(f'/quiz/{self.quiz.id}/', {'start-quiz': 'Start Quiz'})
+
+        attempt = Player.objects.get(pk=self.player.pk).active_attempt
+        self.assertEqual(attempt.question_order, [question.id for question in self.questions[:2]])
+        self.assertRedirects(response, f'/quiz/{self.quiz.id}/single_choice_question/{self.questions[0].id}/', fetch_redirect_response=False)
+
+        response = self.client.get(f'/quiz/{self.quiz.id}/single_choice_question/{self.questions[1].id}/')
+        self.assertTrue(response.context['no_next_question'])
+
+        response = self.client.get(f'/quiz/{self.quiz.id}/single_choice_question/{self.questions[2].id}/')
+        self.assertRedirects(response, '/not_found', fetch_redirect_response=False)
+
+    def test_shuffled_attempt_follows_its_own_order(self):
+        self.quiz.shuffle_questions = True
+        self.quiz.save()
+        self.client.post(f'/quiz/{self.quiz.id}/', {'start-quiz': 'Start Quiz'})
+        order = Player.objects.get(pk=self.player.pk).active_attempt.question_order
+        self.assertCountEqual(order, [question.id for question in self.questions])
+
+        answer = Answer.objects.get(question_id=order[0], is_correct=True)
+        response = self.client.post(f'/quiz/{self.quiz.id}/single_choice_question/{order[0]}/', {'answer_response_id': answer.id})
+
+        self.assertRedirects(response, f'/quiz/{self.quiz.id}/single_choice_question/{order[1]}/', fetch_redirect_response=False)
+
+
+
+class QuizContentCacheTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['shared'].clear()
+        self.user = User.objects.create_user(username='author', password='secret')
+        self.player = Player.objects.create(user=self.user)
+        self.quiz = create_quiz_with_questions(2)
+        self.quiz.player = self.player
+        self.quiz.save()
+        self.question = Question.objects.filter(quiz=self.quiz).first()
+        self.url = f'/quiz/{self.quiz.id}/single_choice_question/{self.question.id}/'
+        self.client.force_login(self.user)
+
+    def test_warm_cache_serves_question_without_content_queries(self):
+        self.client.get(self.url)
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([answer.answer for answer in response.context['answers']], ['Right', 'Wrong'])
+        content_tables = ['"gui_quiz"', '"gui_question"', '"gui_answer"']
+        self.assertFalse([query['sql'] for query in queries.captured_queries if any(table in query['sql'] for table in content_tables)])
+
+    def test_edit_answer_invalidates_cache(self):
+        self.client.get(self.url)
+        answer = Answer.objects.get(question=self.question, answer='Wrong')
+        category = Category.objects.create(category='Science')
+        self.quiz.category = category
+        self.quiz.save()
+
+        self.client.post(f'/edit_answer/{answer.id}/', {'question': self.question.id, 'answer': 'Edited', 'points': 0})
+
+        response = self.client.get(self.url)
+        self.assertEqual([answer.answer for answer in response.context['answers']], ['Right', 'Edited'])
+
+    def test_new_question_invalidates_cache(self):
+        self.client.get(self.url)
+
+        self.client.post('/create_question/', {'question': 'New', 'quiz': self.quiz.id, 'question_type': 'single choice', 'position': 0})
+
+        self.assertEqual(len(get_quiz_content(self.quiz.id).question_order), 3)
+
+    def test_edit_in_another_worker_invalidates_cache(self):
+        with tempfile.TemporaryDirectory() as location, override_settings(CACHES={
+            'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'},
+            'shared': {'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': location},
+        }):
+            get_quiz_content(self.quiz.id)
+            with self.assertNumQueries(0):
+                get_quiz_content(self.quiz.id)
+
+            other_worker_cache = caches.create_connection('shared')
+            with mock.patch('gui.quiz_cache.get_version_cache', return_value=other_worker_cache):
+                bump_quiz_content_version(self.quiz.id)
+
+            with CaptureQueriesContext(connection) as queries:
+                get_quiz_content(self.quiz.id)
+            self.assertTrue(queries.captured_queries)
+
+
+
+class ChartCacheTestCase(TestCase):
+
+    def test_least_recently_used_chart_is_evicted(self):
+        charts = ChartCache(max_entries=2, max_bytes=100)
+        charts.set('a', b'a')
+        charts.set('b', b'b')
+        charts.get('a')
+        charts.set('c', b'c')
+        self.assertIsNone(charts.get('b'))
+        self.assertIsNotNone(charts.get('a'))
+
+    def test_size_limit(self):
+        charts = ChartCache(max_entries=10, max_bytes=10)
+        charts.set('a', b'x' * 6)
+        charts.set('b', b'x' * 6)
+        charts.set('big', b'x' * 11)
+        self.assertEqual([key for key in ['a', 'b', 'big'] if charts.get(key)], ['b'])
+        self.assertEqual(charts.size, 6)
+
+
+class StatisticsChartViewTestCase(TestCase):
+
+    def setUp(self):
+        chart_cache.clear()
+        self.user = User.objects.create_user(username='player', password='secret')
+        self.player = Player.objects.create(user=self.user)
+        PointsPerDay.objects.create(player=self.player, points=5)
+        self.client.force_login(self.user)
+
+    def test_page_links_chart_image(self):
+        response = self.client.get('/statistics_for_per_player/')
+        self.assertContains(response, '/statistics/charts/per_player.png?v=')
+
+    def test_chart_is_rendered_once_and_revalidated(self):
+        chart_url = self.client.get('/statistics_for_per_player/').context['chart_url']
+
+        response = self.client.get(chart_url)
+        self.assertEqual(response['Content-Type'], 'image/png')
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertEqual(len(chart_cache), 1)
+
+        response = self.client.get(chart_url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+
+    def test_etag_changes_with_data(self):
+        etag = self.client.get('/statistics/charts/per_player.png')['ETag']
+        PointsPerDay.objects.update(points=7)
+        response = self.client.get('/statistics/charts/per_player.png', HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+
+    def test_unknown_chart(self):
+        self.assertEqual(self.client.get('/statistics/charts/unknown.png').status_code, 404)
+
+
+
+class QuizScoreStatisticsTestCase(TestCase):
+
+    def setUp(self):
+        chart_cache.clear()
+        self.history = Quiz.objects.create(title='History')
+        self.math = Quiz.objects.create(title='Math')
+        for score in [1, 2, 2, 3, 10]:
+            QuizAttempt.objects.create(quiz=self.history, score=score)
+        QuizAttempt.objects.create(quiz=self.math, score=4)
+
+    def test_aggregates(self):
+        history, math = get_quiz_score_statistics()
+        self.assertEqual(history, {'quiz': 'History', 'count': 5, 'mean': 3.6, 'min': 1, 'max': 10, 'p25': 2, 'p50': 2, 'p75': 3, 'p90': 10})
+        self.assertEqual((math['count'], math['p50'], math['p90']), (1, 4, 4))
+
+    def test_number_of_queries_does_not_depend_on_attempts(self):
+        for _ in range(20):
+            QuizAttempt.objects.create(quiz=self.math, score=5)
+        with self.assertNumQueries(2):
+            get_quiz_score_statistics()
+
+    def test_chart_is_drawn_from_aggregates(self):
+        user = User.objects.create_user(username='player', password='secret')
+        self.client.force_login(user)
+
+        response = self.client.get('/statistics_for_each_quiz_score/')
+        self.assertEqual([quiz_statistics['quiz'] for quiz_statistics in response.context['statistics']], ['History', 'Math'])
+
+        response = self.client.get(response.context['chart_url'])
+        self.assertEqual(response['Content-Type'], 'image/png')
+
+    def test_page_aggregates_once(self):
+        user = User.objects.create_user(username='player', password='secret')
+        self.client.force_login(user)
+
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get('/statistics_for_each_quiz_score/')
+        self.assertEqual(len([query for query in queries if 'gui_quizattempt' in query['sql']]), 2) # the table and the chart url share them
+
+    def test_chart_without_attempts(self):
+        QuizAttempt.objects.all().delete()
+        user = User.objects.create_user(username='player', password='secret')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get('/statistics/charts/each_quiz_score.png').status_code, 200)
+
+
+
+class LazyChartsImportTestCase(TestCase):
+
+    def test_application_does_not_import_matplotlib(self):
+        script = 'import sys, django; django.setup(); import gui.views, gui.consumers, app.urls; print("matplotlib" in sys.modules)'
+        completed = subprocess.run([sys.executable, '-c', script], cwd=settings.BASE_DIR, capture_output=True, text=True, check=True,
+                                   env={**os.environ, 'DJANGO_SETTINGS_MODULE': 'app.settings'})
+        self.assertEqual(completed.stdout.strip(), 'False')
+
+
+
+class ChartRendererTestCase(TestCase):
+
+    def test_renders_in_worker_process(self):
+        renderer = ChartRenderer(workers=1, timeout=60, max_pending=1)
+        try:
+            png = renderer.render('per_player_since_registration', ([date(2024, 1, 1)], ([3], [3.0]), 'Title', 'Days', 'Points'))
+        finally:
+            renderer.reset()
+        self.assertTrue(png.startswith(b'\x89PNG'))
+        self.assertEqual(renderer.pending, 0)
+
+    def test_rejects_jobs_over_the_limit(self):
+        renderer = ChartRenderer(workers=1, timeout=60, max_pending=0)
+        with self.assertRaises(ChartRenderError):
+            renderer.render('per_player_since_registration', ([], [], 'Title', 'Days', 'Points'))
+        renderer.reset()
+
+    def test_chart_view_is_unavailable_when_rendering_fails(self):
+        user = User.objects.create_user(username='player', password='secret')
+        Player.objects.create(user=user)
+        self.client.force_login(user)
+        chart_cache.clear()
+
+        with mock.patch.object(chart_renderer, 'render', side_effect=ChartRenderError):
+            response = self.client.get('/statistics/charts/each_quiz_score.png')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(chart_cache), 0)
+
+
+
+class PointsSeriesTestCase(TestCase):
+
+    def test_gaps_are_filled_and_rolled_up(self):
+        series = build_points_series(date(2024, 1, 29), [(date(2024, 1, 30), 5), (date(2024, 2, 5), 4)], today=date(2024, 2, 6), moving_average_window=3)
+
+        self.assertEqual(series['days'][0], '2024-01-29')
+        self.assertEqual(series['daily'], [0, 5, 0, 0, 0, 0, 0, 4, 0])
+        self.assertEqual(series['cumulative'][-1], 9)
+        self.assertEqual(series['moving_average'][:3], [0.0, 2.5, 1.67])
+        self.assertEqual(series['weekly'], {'weeks': ['2024-01-29', '2024-02-05'], 'points': [5, 4]})
+        self.assertEqual(series['monthly'], {'months': ['2024-01', '2024-02'], 'points': [5, 4]})
+
+    def test_no_points(self):
+        series = build_points_series(date(2024, 1, 1), [], today=date(2024, 1, 1))
+        self.assertEqual((series['days'], series['daily'], series['moving_average']), (['2024-01-01'], [0], [0.0]))
+
+    def test_points_after_today(self):
+        series = build_points_series(date(2024, 1, 1), [(date(2024, 1, 3), 2)], today=date(2024, 1, 2))
+
+        self.assertEqual(series['days'], ['2024-01-01', '2024-01-02', '2024-01-03'])
+        self.assertEqual(series['daily'], [0, 0, 2])
+
+    def test_moving_average_window_must_be_positive(self):
+        with self.assertRaises(ValueError):
+            build_points_series(date(2024, 1, 1), [], today=date(2024, 1, 1), moving_average_window=0)
+
+    def test_json_endpoint(self):
+        user = User.objects.create_user(username='player', password='secret')
+        player = Player.objects.create(user=user, registration_date=date.today() - timedelta(days=3))
+        PointsPerDay.objects.create(player=player, date=date.today() - timedelta(days=1), points=6)
+        self.client.force_login(user)
+
+        series = self.client.get('/statistics_for_per_player/series/').json()
+
+        self.assertEqual(series['daily'], [0, 0, 6, 0])
+        self.assertEqual(series['cumulative'], [0, 0, 6, 6])
+
+
+
+class ScoreEventTestCase(TestCase):
+
+    def setUp(self):
+        self.quiz = Quiz.objects.create(title='Quiz')
+        self.player = Player.objects.create(user=User.objects.create(username='player'), score=5)
+
+    def finish_attempt(self, player, points, multiplayer=False):
+        player.active_attempt = QuizAttempt.objects.create(quiz=self.quiz, score=points)
+        player.save()
+        calculate_points_after_quiz(player, multiplayer=multiplayer)
+
+    def test_finished_attempt_is_logged_and_applied(self):
+        self.finish_attempt(self.player, 8, multiplayer=True)
+
+        event = ScoreEvent.objects.get()
+        self.assertEqual((event.player, event.points, event.multiplayer, event.rolled_up), (self.player, 8, True, True))
+        self.assertEqual(Player.objects.get(pk=self.player.pk).score, 13)
+        self.assertEqual(roll_up_score_events(), 0)
+
+    @override_settings(SCORE_EVENTS_DEFERRED=True)
+    def test_deferred_events_are_rolled_up_in_batches(self):
+        other_player = Player.objects.create(user=User.objects.create(username='other'))
+        yesterday = date.today() - timedelta(days=1)
+        PointsPerDay.objects.create(player=self.player, date=yesterday, points=1)
+        for player, points in [(self.player, 4), (other_player, 3), (self.player, 2)]:
+            player.active_attempt = QuizAttempt.objects.create(quiz=self.quiz, score=points)
+            player.save()
+            with self.assertNumQueries(5): # the score of the attempt, the end of the attempt and the event, in a savepoint
+                calculate_points_after_quiz(player)
+        ScoreEvent.objects.filter(points=2).update(date=yesterday)
+
+        self.assertEqual(Player.objects.get(pk=self.player.pk).score, 5)
+        self.assertFalse(PointsPerDay.objects.filter(date=date.today()).exists())
+
+        self.assertEqual(roll_up_score_events(batch_size=2), 2)
+        self.assertEqual(roll_up_score_events(batch_size=2), 1)
+        self.assertEqual(roll_up_score_events(batch_size=2), 0)
+
+        self.assertEqual(dict(Player.objects.values_list('user__username', 'score')), {'player': 11, 'other': 3})
+        self.assertEqual(Player.objects.get(pk=self.player.pk).level, 'Medium')
+        self.assertEqual(sorted(PointsPerDay.objects.values_list('player__user__username', 'date', 'points')),
+                         [('other', date.today(), 3), ('player', yesterday, 3), ('player', date.today(), 4)])
+        self.assertFalse(ScoreEvent.objects.filter(rolled_up=False).exists())
+
+    @override_settings(SCORE_EVENTS_DEFERRED=True)
+    def test_rollup_command(self):
+        self.finish_attempt(self.player, 6)
+        output = StringIO()
+
+        call_command('rollup_score_events', batch_size=10, stdout=output)
+
+        self.assertIn('Rolled up 1 score events.', output.getvalue())
+        self.assertEqual(Player.objects.get(pk=self.player.pk).score, 11)
+
+    def test_day_created_by_concurrent_request(self):
+        other_player = Player.objects.create(user=User.objects.create(username='other'))
+        PointsPerDay.objects.create(player=self.player, date=date.today(), points=3)
+        select = PointsPerDay.objects.filter
+        selects = []
+
+        def select_before_other_request(*args, **kwargs):
+            selects.append(args)
+            return select(*args, **kwargs) if len(selects) > 1 else PointsPerDay.objects.none() # the other request inserted the day after it
+
+        with mock.patch.object(PointsPerDay.objects, 'filter', side_effect=select_before_other_request):
+            add_points_per_day({(self.player.id, date.today()): 4, (other_player.id, date.today()): 2})
+
+        self.assertEqual(sorted(PointsPerDay.objects.values_list('player__user__username', 'points')), [('other', 2), ('player', 7)])
+
+    @override_settings(SCORE_EVENTS_DEFERRED=True)
+    def test_rollup_in_another_process_reaches_index(self):
+        caches['shared'].clear()
+        self.finish_attempt(self.player, 6)
+        self.assertEqual(get_leaderboard_index().score_of(self.player.id), 5)
+
+        # the rollup command runs in its own process, with its own index
+        with mock.patch('gui.leaderboard.leaderboard_index', LeaderboardIndex()), self.captureOnCommitCallbacks(execute=True):
+            roll_up_score_events()
+
+        self.assertEqual(get_leaderboard_index().score_of(self.player.id), 11)
+
+
+class MultiplayerGameFinishTestCase(TestCase):
+
+    def setUp(self):
+        self.quiz = Quiz.objects.create(title='Quiz')
+        other_quiz = Quiz.objects.create(title='Other')
+        self.multiplayer = MultiPlayerSession.objects.create(room_code='room', quiz=self.quiz)
+        for username, score, points, quiz in [('first', 10, 4, self.quiz), ('second', 0, 6, self.quiz), ('elsewhere', 0, 5, other_quiz)]:
+            player = Player.objects.create(user=User.objects.create(username=username), score=score)
+            player.active_attempt = QuizAttempt.objects.create(quiz=quiz, score=points)
+            player.save()
+            self.multiplayer.players.add(player)
+
+    def test_game_is_finished_for_all_players_at_once(self):
+        with self.assertNumQueries(11): # players, score update, events, points per day and levels(select and write each), in savepoints
+            results = finish_multiplayer_game('room', self.quiz.id)
+
+        self.assertEqual(results, [{'player_username': 'second', 'score': 6}, {'player_username': 'first', 'score': 4}])
+        self.assertEqual(dict(Player.objects.values_list('user__username', 'score')), {'first': 14, 'second': 6, 'elsewhere': 0})
+        self.assertEqual(dict(Player.objects.values_list('user__username', 'multiplayer_score')), {'first': 4, 'second': 6, 'elsewhere': 0})
+        self.assertEqual(Player.objects.get(user__username='first').level, 'Medium')
+        self.assertEqual(sorted(ScoreEvent.objects.values_list('player__user__username', 'points', 'multiplayer')), [('first', 4, True), ('second', 6, True)])
+        self.assertEqual(PointsPerDay.objects.count(), 2)
+        self.assertIsNotNone(Player.objects.get(user__username='elsewhere').active_attempt)
+
+        self.assertEqual(finish_multiplayer_game('room', self.quiz.id), []) # the attempts are finished only once
+        self.assertEqual(Player.objects.get(user__username='first').score, 14)
+
+    def test_leaderboard_index_is_updated_on_commit(self):
+        leaderboard_index.rebuild(Player.objects.values_list('id', 'score'))
+        elsewhere = Player.objects.get(user__username='elsewhere') # tied with second(0 points) until the game is committed
+
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            finish_multiplayer_game('room', self.quiz.id)
+            raise RuntimeError('the game is rolled back')
+        self.assertEqual(leaderboard_index.rank_of(elsewhere.id), 2)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            finish_multiplayer_game('room', self.quiz.id)
+        self.assertEqual(leaderboard_index.rank_of(elsewhere.id), 3)
+
+    @override_settings(SCORE_EVENTS_DEFERRED=True)
+    def test_deferred(self):
+        finish_multiplayer_game('room', self.quiz.id)
+
+        self.assertEqual(Player.objects.get(user__username='second').score, 0)
+        self.assertEqual(Player.objects.get(user__username='second').multiplayer_score, 6)
+        self.assertEqual(roll_up_score_events(), 2)
+        self.assertEqual(Player.objects.get(user__username='second').score, 6)
+
+
+class MultiplayerLeaderboardTestCase(TestCase):
+
+    def setUp(self):
+        self.quiz = Quiz.objects.create(title='Quiz')
+        self.player = Player.objects.create(user=User.objects.create(username='player'), multiplayer_score=5)
+        Player.objects.create(user=User.objects.create(username='best'), multiplayer_score=9)
+        Player.objects.create(user=User.objects.create(username='single'), score=20)
+        self.client.force_login(self.player.user)
+
+    def test_room_results(self):
+        MultiplayerResult.objects.create(room_code='room', quiz=self.quiz, standings=[['best', 3], ['player', 1]])
+
+        response = self.client.get('/multiplayer_leaderboard/room/?results=[{"player_username": "player", "score": 100}]')
+        self.assertEqual(response.context['results'], [{'player_username': 'best', 'score': 3}, {'player_username': 'player', 'score': 1}])
+        self.assertIn('no-cache', response['Cache-Control'])
+
+        self.assertEqual(self.client.get('/multiplayer_leaderboard/room/', HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.client.get('/multiplayer_leaderboard/room/', HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        self.assertRedirects(self.client.get('/multiplayer_leaderboard/other/'), '/not_found', fetch_redirect_response=False)
+
+    def test_global_leaderboard(self):
+        response = self.client.get('/multiplayer_leaderboard/')
+        self.assertEqual(response.context['results'], [{'player_username': 'best', 'score': 9}, {'player_username': 'player', 'score': 5}])
+        self.assertIn('max-age=60', response['Cache-Control'])
+
+
+class ScoreLedgerConcurrencyTestCase(TransactionTestCase):
+    """Stress tests of the score ledger - many threads, each with its own database connection, write the same rows at once."""
+
+    writers = 8
+
+    def run_in_parallel(self, work):
+        """Runs work(number) in every writer thread, all of them starting at once."""
+        barrier = Barrier(self.writers)
+        errors = []
+
+        def writer(number):
+            try:
+                barrier.wait()
+                while True:
+                    try:
+                        work(number)
+                        break
+                    except OperationalError as error:
+                        # the in-memory test database fails at once on a locked table instead of waiting like the file database,
+                        # so the writer retries - the failed transaction was rolled back as a whole
+                        if 'locked' not in str(error):
+                            raise
+                        time.sleep(0.001)
+            except Exception as error:
+                errors.append(error)
+            finally:
+                connection.close()
+
+        threads = [Thread(target=writer, args=(number,)) for number in range(self.writers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(errors, [])
+
+    def test_no_points_are_lost(self):
+        quiz_attempt = QuizAttempt.objects.create(quiz=Quiz.objects.create(title='Quiz'))
+
+        def work(number):
+            stale_attempt = QuizAttempt.objects.get(pk=quiz_attempt.pk)
+            for _ in range(25):
+                add_points_to_attempt(stale_attempt, 2)
+
+        self.run_in_parallel(work)
+
+        self.assertEqual(QuizAttempt.objects.get(pk=quiz_attempt.pk).score, self.writers * 25 * 2)
+
+    def test_attempt_is_counted_exactly_once(self):
+        player = Player.objects.create(user=User.objects.create(username='player'), score=10)
+        player.active_attempt = QuizAttempt.objects.create(quiz=Quiz.objects.create(title='Quiz'), score=7)
+        player.save()
+
+        self.run_in_parallel(lambda number: finish_quiz_attempt(Player.objects.get(pk=player.pk)))
+
+        player.refresh_from_db()
+        self.assertEqual((player.score, player.active_attempt), (17, None))
+        self.assertEqual(PointsPerDay.objects.get(player=player).points, 7)
+
+    def test_players_finishing_at_once(self):
+        quiz = Quiz.objects.create(title='Quiz')
+        players = []
+        for number in range(self.writers):
+            player = Player.objects.create(user=User.objects.create(username=f'player{number}'))
+            player.active_attempt = QuizAttempt.objects.create(quiz=quiz, score=number)
+            player.save()
+            players.append(player)
+
+        self.run_in_parallel(lambda number: finish_quiz_attempt(Player.objects.get(pk=players[number].pk)))
+
+        self.assertEqual(sorted(Player.objects.values_list('score', flat=True)), list(range(self.writers)))
+
+    @override_settings(SCORE_EVENTS_DEFERRED=True)
+    def test_concurrent_rollups_count_every_event_once(self):
+        player = Player.objects.create(user=User.objects.create(username='player'))
+        ScoreEvent.objects.bulk_create([ScoreEvent(player=player, points=1) for _ in range(100)])
+
+        self.run_in_parallel(lambda number: roll_up_all_score_events(batch_size=7))
+
+        self.assertEqual(Player.objects.get(pk=player.pk).score, 100)
+        self.assertEqual(PointsPerDay.objects.get(player=player).points, 100)
+        self.assertFalse(ScoreEvent.objects.filter(rolled_up=False).exists())
+
+
+
+class SQLiteChannelLayerTestCase(TestCase):
+    """Two layers on the same file behave like the channel layers of two daphne processes."""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.path = os.path.join(directory.name, 'channels.sqlite3')
+
+    async def receive(self, layer, channel):
+        return await asyncio.wait_for(layer.receive(channel), timeout=5)
+
+    async def test_group_send_reaches_every_process(self):
+        first_process, second_process = SQLiteChannelLayer(path=self.path), SQLiteChannelLayer(path=self.path)
+        first_channel, second_channel = await first_process.new_channel(), await second_process.new_channel()
+        await first_process.group_add('quiz_room', first_channel)
+        await second_process.group_add('quiz_room', second_channel)
+
+        await second_process.group_send('quiz_room', {'type': 'show_question', 'question_id': 1})
+        await second_process.group_send('quiz_room', {'type': 'show_results'})
+
+        for layer, channel in [(first_process, first_channel), (second_process, second_channel)]:
+            self.assertEqual(await self.receive(layer, channel), {'type': 'show_question', 'question_id': 1})
+            self.assertEqual(await self.receive(layer, channel), {'type': 'show_results'})
+
+    async def test_group_discard(self):
+        first_process, second_process = SQLiteChannelLayer(path=self.path), SQLiteChannelLayer(path=self.path)
+        channel, discarded_channel = await first_process.new_channel(), await first_process.new_channel()
+        await first_process.group_add('quiz_room', channel)
+        await first_process.group_add('quiz_room', discarded_channel)
+        await first_process.group_discard('quiz_room', discarded_channel)
+
+        await second_process.group_send('quiz_room', {'type': 'show_results'})
+
+        self.assertEqual(await self.receive(first_process, channel), {'type': 'show_results'})
+        with self.assertRaises(asyncio.TimeoutError):
+            await asyncio.wait_for(first_process.receive(discarded_channel), timeout=0.1)
+
+    async def test_named_channel_is_received_once(self):
+        first_process, second_process = SQLiteChannelLayer(path=self.path), SQLiteChannelLayer(path=self.path)
+        await first_process.send('results', {'type': 'first'})
+        await first_process.send('results', {'type': 'second'})
+
+        received = await asyncio.gather(self.receive(first_process, 'results'), self.receive(second_process, 'results'))
+
+        self.assertCountEqual([message['type'] for message in received], ['first', 'second'])
+
+    async def test_capacity_and_expiry(self):
+        layer = SQLiteChannelLayer(path=self.path, capacity=1, expiry=0.05)
+        channel = await layer.new_channel()
+        await layer.send(channel, {'type': 'first'})
+        with self.assertRaises(ChannelFull):
+            await layer.send(channel, {'type': 'second'})
+
+        await asyncio.sleep(0.1)
+        await layer.send(channel, {'type': 'third'})
+        self.assertEqual(await self.receive(layer, channel), {'type': 'third'})
+
+    def test_benchmark_command(self):
+        output = StringIO()
+        call_command('bench_channel_layer', processes=2, messages=20, path=self.path, stdout=output)
+        self.assertIn('Delivered: 40 messages', output.getvalue())
+
+
+
+class StaleSessionTestCase(TestCase):
+
+    def setUp(self):
+        self.quiz = create_quiz_with_questions(1)
+        self.player = Player.objects.create(user=User.objects.create(username='player'))
+        long_ago = timezone.now() - timedelta(seconds=settings.MULTIPLAYER_SESSION_STALE_AFTER + 1)
+        for room_code, last_activity in [('stale', long_ago), ('live', timezone.now())]:
+            multiplayer = MultiPlayerSession.objects.create(room_code=room_code, quiz=self.quiz, started=True, last_activity=last_activity)
+            multiplayer.players.add(self.player)
+
+    def test_reap_stale_sessions(self):
+        with self.assertNumQueries(6): # select, end of the attempts, delete of the players, update and the savepoint
+            self.assertEqual(reap_stale_sessions(), 1)
+
+        stale, live = MultiPlayerSession.objects.get(room_code='stale'), MultiPlayerSession.objects.get(room_code='live')
+        self.assertEqual((stale.active, stale.started, stale.archived, stale.players.count()), (False, False, True, 0))
+        self.assertEqual((live.active, live.started, live.archived, live.players.count()), (True, True, False, 1))
+        self.assertEqual(reap_stale_sessions(), 0)
+
+    def test_attempts_of_reaped_games_are_ended(self):
+        self.player.active_attempt = QuizAttempt.objects.create(quiz=self.quiz, score=3)
+        self.player.save()
+        other_player = Player.objects.create(user=User.objects.create(username='other'))
+        other_player.active_attempt = QuizAttempt.objects.create(quiz=create_quiz_with_questions(1, title='Other'))
+        other_player.save()
+        MultiPlayerSession.objects.get(room_code='stale').players.add(other_player)
+
+        reap_stale_sessions()
+
+        self.assertIsNone(Player.objects.get(pk=self.player.pk).active_attempt)
+        self.assertIsNotNone(Player.objects.get(pk=other_player.pk).active_attempt) # playing another quiz
+
+    def test_reused_room_code_ends_attempts_of_stale_game(self):
+        self.player.active_attempt = QuizAttempt.objects.create(quiz=self.quiz)
+        self.player.save()
+        creator = Player.objects.create(user=User.objects.create_user(username='creator', password='secret'))
+        self.client.force_login(creator.user)
+
+        self.client.post(f'/quiz/{self.quiz.id}/', {'create-room': 'Create Room', 'create-room-code': 'stale'})
+
+        multiplayer = MultiPlayerSession.objects.get(room_code='stale')
+        self.assertEqual((multiplayer.creator, multiplayer.active, multiplayer.archived, multiplayer.players.count()), (creator, True, False, 0))
+        self.assertIsNone(Player.objects.get(pk=self.player.pk).active_attempt)
+
+    def test_heartbeat_keeps_sessions_alive(self):
+        heartbeat(['stale'])
+        self.assertEqual(reap_stale_sessions(), 0)
+        self.assertEqual(set(MultiPlayerSession.get_live_sessions().values_list('room_code', flat=True)), {'stale', 'live'})
+
+    def test_stale_sessions_are_not_listed(self):
+        self.client.force_login(self.player.user)
+        response = self.client.get(f'/quiz/{self.quiz.id}/')
+        self.assertEqual([room.room_code for room in response.context['active_rooms']], ['live'])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('reap_stale_sessions', '--stale-after', '0', stdout=out)
+        self.assertIn('Reaped 2 stale sessions.', out.getvalue())
+
+
+class RoomHeartbeatTestCase(TransactionTestCase):
+
+    def setUp(self):
+        rooms.clear()
+        self.addCleanup(rooms.clear)
+        quiz = create_quiz_with_questions(1)
+        long_ago = timezone.now() - timedelta(seconds=settings.MULTIPLAYER_SESSION_STALE_AFTER + 1)
+        for room_code in ['here', 'crashed']:
+            MultiPlayerSession.objects.create(room_code=room_code, quiz=quiz, last_activity=long_ago)
+        rooms['here'] = RoomState('here', QuestionOrder([]))
+
+    async def test_heartbeat(self):
+        clock = FakeClock()
+        room_heartbeat = RoomHeartbeat(clock)
+        room_heartbeat.start()
+        await clock.advance(settings.MULTIPLAYER_HEARTBEAT_INTERVAL)
+        for _ in range(100):
+            sessions = await database_sync_to_async(lambda: dict(MultiPlayerSession.objects.values_list('room_code', 'active')))()
+            if not sessions['crashed']:
+                break
+            await asyncio.sleep(0.01)
+        self.assertEqual(sessions, {'here': True, 'crashed': False})
+
+        rooms.clear()
+        room_heartbeat.stop()
+        self.assertIsNone(room_heartbeat.task)
+
+
+class JoinRoomTestCase(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['shared'].clear()
+        rooms.clear()
+        self.addCleanup(rooms.clear)
+        self.quiz = create_quiz_with_questions(1)
+        self.player = Player.objects.create(user=User.objects.create(username='player'))
+        self.multiplayer = MultiPlayerSession.objects.create(room_code='room', quiz=self.quiz)
+
+    def test_stale_attempt_of_the_quiz_is_not_reused(self):
+        stale_attempt = QuizAttempt.objects.create(quiz=self.quiz, score=5) # e.g. a half finished single player attempt
+        self.player.active_attempt = stale_attempt
+        self.player.save()
+
+        joined = join_room_step('room', self.player.user)
+
+        self.assertNotEqual(joined.player.active_attempt_id, stale_attempt.id)
+        self.assertEqual(joined.player.active_attempt.score, 0)
+        self.assertEqual(joined.room.scores, {self.player.id: 0})
+
+    def test_reconnect_keeps_the_attempt(self):
+        attempt = join_room_step('room', self.player.user).player.active_attempt
+        QuizAttempt.objects.filter(pk=attempt.pk).update(score=2)
+        rooms.clear()
+
+        joined = join_room_step('room', self.player.user)
+
+        self.assertEqual(joined.player.active_attempt_id, attempt.id)
+        self.assertEqual(joined.room.scores, {self.player.id: 2})
+
+
+class RoomStateTestCase(TestCase):
+
+    def setUp(self):
+        self.room = RoomState('room', QuestionOrder([10, 20]), current_question_id=10, started=True)
+        self.room.join(1, 'first')
+        self.room.join(2, 'second', score=3)
+
+    def test_answers_are_counted_once(self):
+        self.assertTrue(self.room.record_answer(1, 10, 2))
+        self.assertFalse(self.room.record_answer(1, 10, 2))
+        self.assertFalse(self.room.record_answer(2, 20, 2)) # not the current question
+        self.assertFalse(self.room.all_answered())
+
+        self.assertTrue(self.room.record_answer(2, 10, 0))
+        self.assertTrue(self.room.all_answered())
+        self.assertEqual(self.room.get_results(), [{'player_username': 'second', 'score': 3}, {'player_username': 'first', 'score': 2}])
+
+    def test_player_leaving_completes_the_question(self):
+        self.room.record_answer(1, 10, 2)
+        self.room.leave(2)
+        self.assertTrue(self.room.all_answered())
+
+    def test_advance_is_claimed_once_per_question(self):
+        self.assertTrue(self.room.claim_advance())
+        self.assertFalse(self.room.claim_advance())
+        self.assertEqual(self.room.get_next_question_id(), 20)
+
+        self.assertTrue(self.room.show_question(20))
+        self.assertFalse(self.room.show_question(20))
+        self.assertEqual(self.room.answered, set())
+        self.assertTrue(self.room.claim_advance())
+        self.assertIsNone(self.room.get_next_question_id())
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class QuizConsumerTestCase(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['shared'].clear()
+        rooms.clear()
+        self.quiz = create_quiz_with_questions(2)
+        self.players = [Player.objects.create(user=User.objects.create(username=username)) for username in ['creator', 'guest']]
+        MultiPlayerSession.objects.create(room_code='room', quiz=self.quiz, creator=self.players[0])
+
+    async def connect(self, player):
+        communicator = WebsocketCommunicator(QuizConsumer.as_asgi(), '/ws/multiplayer/room/')
+        communicator.scope['url_route'] = {'kwargs': {'room_code': 'room'}}
+        communicator.scope['user'] = await database_sync_to_async(lambda: player.user)()
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        self.assertEqual((await communicator.receive_json_from())['type'], 'start_game')
+        return communicator
+
+    async def answer_all(self, communicators, correct):
+        question_id = (await communicators[0].receive_json_from())['question']['id']
+        for communicator in communicators[1:]:
+            self.assertEqual((await communicator.receive_json_from())['question']['id'], question_id)
+        for communicator, is_correct in zip(communicators, correct):
+            answer = await database_sync_to_async(Answer.objects.get)(question_id=question_id, is_correct=is_correct)
+            await communicator.send_json_to({'type': 'submit_answer', 'answer_ids': [answer.id]})
+        return question_id
+
+    async def test_game(self):
+        communicators = [await self.connect(player) for player in self.players]
+        await communicators[0].send_json_to({'type': 'start_game'})
+
+        await self.answer_all(communicators, [True, False])
+        await self.answer_all(communicators, [True, True])
+
+        for communicator in communicators:
+            message = await communicator.receive_json_from()
+            self.assertEqual(message['results'], [{'player_username': 'creator', 'score': 4}, {'player_username': 'guest', 'score': 2}])
+            await communicator.disconnect()
+
+        scores = await database_sync_to_async(lambda: dict(Player.objects.values_list('user__username', 'score')))()
+        self.assertEqual(scores, {'creator': 4, 'guest': 2})
+        self.assertEqual(await database_sync_to_async(ScoreEvent.objects.count)(), 2)
+        standings = await database_sync_to_async(lambda: MultiplayerResult.objects.get(room_code='room').standings)()
+        self.assertEqual(standings, [['creator', 4], ['guest', 2]])
+        self.assertEqual(await database_sync_to_async(QuestionResponse.objects.count)(), 4)
+        self.assertFalse(await database_sync_to_async(lambda: MultiPlayerSession.objects.get(room_code='room').active)())
+        self.assertEqual(rooms, {})
+
+    async def test_questions_are_pushed_serialized_once_per_room(self):
+        communicators = [await self.connect(player) for player in self.players]
+        with mock.patch.object(QuizConsumer, 'serialize_question', autospec=True, side_effect=QuizConsumer.serialize_question) as serialize_question:
+            await communicators[0].send_json_to({'type': 'start_game'})
+            questions = [await communicator.receive_json_from() for communicator in communicators]
+
+        self.assertEqual(serialize_question.call_count, 1)
+        self.assertEqual(questions[0], questions[1])
+        question = questions[0]['question']
+        self.assertEqual((question['text'], question['question_type'], question['is_last']), ('Question 0', 'single choice', False))
+        self.assertEqual([answer['text'] for answer in question['answers']], ['Right', 'Wrong'])
+        self.assertNotIn('is_correct', question['answers'][0])
+        for communicator in communicators:
+            await communicator.disconnect()
+
+    @override_settings(MULTIPLAYER_PUSH_QUESTIONS=False)
+    async def test_question_urls(self):
+        communicator = await self.connect(self.players[0])
+        await communicator.send_json_to({'type': 'start_game'})
+        question = (await communicator.receive_json_from())['question']
+        self.assertNotIn('answers', question)
+        self.assertEqual(question['url'], f"/quiz/{self.quiz.id}/single_choice_question/{question['id']}/")
+        await communicator.disconnect()
+
+    async def test_answers_are_saved_at_the_checkpoint(self):
+        communicators = [await self.connect(player) for player in self.players]
+        await communicators[0].send_json_to({'type': 'start_game'})
+        for communicator in communicators:
+            question_id = (await communicator.receive_json_from())['question']['id']
+
+        answer = await database_sync_to_async(Answer.objects.get)(question_id=question_id, is_correct=True)
+        await communicators[0].send_json_to({'type': 'submit_answer', 'answer_ids': [answer.id]})
+        await communicators[0].send_json_to({'type': 'submit_answer', 'answer_ids': [answer.id]}) # answered twice
+        self.assertTrue(await communicators[1].receive_nothing())
+
+        self.assertEqual(rooms['room'].scores, {self.players[0].id: 2, self.players[1].id: 0})
+        self.assertEqual(await database_sync_to_async(QuestionResponse.objects.count)(), 0)
+        for communicator in communicators:
+            await communicator.disconnect()
+        self.assertEqual(await database_sync_to_async(QuestionResponse.objects.count)(), 1)
+
+    async def test_room_moves_on_at_the_deadline(self):
+        clock = FakeClock()
+        with mock.patch.object(room_scheduler, 'clock', clock):
+            communicators = [await self.connect(player) for player in self.players]
+            await communicators[0].send_json_to({'type': 'start_game'})
+            for communicator in communicators:
+                question = (await communicator.receive_json_from())['question']
+                self.assertEqual(question['time_limit'], 60)
+
+            answer = await database_sync_to_async(Answer.objects.get)(question_id=question['id'], is_correct=True)
+            await communicators[0].send_json_to({'type': 'submit_answer', 'answer_ids': [answer.id]})
+            self.assertTrue(await communicators[1].receive_nothing()) # the guest does not answer
+            await clock.advance(59)
+            self.assertTrue(await communicators[1].receive_nothing())
+            await clock.advance(1)
+            for communicator in communicators:
+                self.assertNotEqual((await communicator.receive_json_from())['question']['id'], question['id'])
+
+            await clock.advance(60)
+            for communicator in communicators:
+                message = await communicator.receive_json_from()
+                self.assertEqual(message['results'], [{'player_username': 'creator', 'score': 2}, {'player_username': 'guest', 'score': 0}])
+            self.assertEqual(room_scheduler.timers, {})
+            for communicator in communicators:
+                await communicator.disconnect()
+
+    @override_settings(MULTIPLAYER_QUESTION_TIME_LIMIT=0)
+    async def test_without_time_limit(self):
+        communicator = await self.connect(self.players[0])
+        await communicator.send_json_to({'type': 'start_game'})
+        self.assertIsNone((await communicator.receive_json_from())['question']['time_limit'])
+        self.assertEqual(room_scheduler.timers, {})
+        await communicator.disconnect()
+
+
+class FakeClock:
+    """Clock of RoomScheduler that moves only when the test advances it."""
+
+    def __init__(self):
+        self.now = 0
+        self.sleepers = []
+
+    def time(self):
+        return self.now
+
+    async def sleep(self, seconds):
+        future = asyncio.get_running_loop().create_future()
+        self.sleepers.append((self.now + seconds, future))
+        await future
+
+    async def advance(self, seconds):
+        await asyncio.sleep(0) # let new timers start sleeping
+        self.now += seconds
+        for wake_time, future in self.sleepers:
+            if wake_time <= self.now and not future.done():
+                future.set_result(None)
+        for _ in range(5): # let the woken tasks run
+            await asyncio.sleep(0)
+
+
+class RoomSchedulerTestCase(TestCase):
+
+    def setUp(self):
+        self.clock = FakeClock()
+        self.scheduler = RoomScheduler(self.clock)
+        self.calls = []
+
+    async def callback(self, question_id):
+        self.calls.append(question_id)
+
+    async def other_callback(self, question_id):
+        self.calls.append(-question_id)
+
+    async def test_deadline(self):
+        self.assertEqual(self.scheduler.get_deadline(30), 30)
+        self.assertIsNone(self.scheduler.get_deadline(None))
+        self.scheduler.watch('room', 1, 30, self.callback)
+        self.scheduler.watch('room', 1, 30, self.other_callback)
+        await self.clock.advance(29)
+        self.assertEqual(self.calls, [])
+        await self.clock.advance(1)
+        self.assertEqual(self.calls, [1]) # only the first watcher moves the room on
+        self.assertEqual(self.scheduler.timers, {})
+
+    async def test_next_question_cancels_the_timer(self):
+        self.scheduler.watch('room', 1, 30, self.callback)
+        self.scheduler.watch('room', 2, 40, self.callback)
+        await self.clock.advance(30)
+        self.assertEqual(self.calls, [])
+        await self.clock.advance(10)
+        self.assertEqual(self.calls, [2])
+
+    async def test_unwatch(self):
+        self.scheduler.watch('room', 1, 30, self.callback)
+        self.scheduler.watch('room', 1, 30, self.other_callback)
+        self.scheduler.unwatch('room', self.callback)
+        await self.clock.advance(30)
+        self.assertEqual(self.calls, [-1])
+
+        self.scheduler.watch('room', 2, 60, self.callback)
+        self.scheduler.unwatch('room', self.callback)
+        self.assertEqual(self.scheduler.timers, {})
+        await self.clock.advance(30)
+        self.assertEqual(self.calls, [-1])
+
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class ProtocolStatsTestCase(TransactionTestCase):
+
+    def setUp(self):
+        cache.clear()
+        caches['shared'].clear()
+        rooms.clear()
+        protocol_stats.reset()
+        protocol_stats.enabled = True
+        self.addCleanup(setattr, protocol_stats, 'enabled', False)
+
+    def test_every_message_takes_at_most_one_thread_hop(self):
+        results = create_and_play_game('room', player_count=3, question_count=2)
+
+        self.assertEqual(len(results), 3)
+        rows = {name: (count, hops, queries) for name, count, hops, queries in protocol_stats.get_rows()}
+        self.assertEqual(rows['websocket.connect'][:2], (3, 1))
+        self.assertEqual(rows['room_answer'], (3 * 3 * 2, 0, 0)) # every answer reaches every consumer of the room
+        self.assertEqual(rows['websocket.receive.submit_answer'][0], 6)
+        self.assertTrue(all(hops <= 1 for _, hops, _ in rows.values()))
+
+
+    def test_load_test(self):
+        stats, seconds = run_load_test(room_count=3, player_count=2, question_count=2)
+
+        self.assertGreater(seconds, 0)
+        self.assertEqual(stats.sent, 3 * (1 + 2 * 2)) # start_game and the answers
+        self.assertEqual(len(stats.latencies), 3 * 2 * 3) # every player gets both questions and the results
+        self.assertLessEqual(stats.get_percentile(50), stats.get_percentile(99))
+        self.assertEqual(MultiPlayerSession.objects.filter(active=True).count(), 0)
+
+
+class LoadStatsTestCase(TestCase):
+
+    def test_percentiles(self):
+        stats = LoadStats()
+        stats.latencies = [number / 100 for number in range(100, 0, -1)]
+        self.assertEqual((stats.get_percentile(50), stats.get_percentile(95), stats.get_percentile(99)), (0.5, 0.95, 0.99))
+
+    def test_latency_from_triggering_message(self):
+        stats = LoadStats()
+        with mock.patch('gui.simulation.time.perf_counter', side_effect=[1.0, 1.5, 2.0, 3.0, 3.5]):
+            stats.message_sent('room', triggers=0) # start_game
+            stats.message_received('room', {'type': 'show_question'}, broadcast=0)
+            stats.message_sent('room') # the first answer does not trigger the next broadcast
+            stats.message_sent('room', triggers=1) # the last answer
+            stats.message_received('room', {'type': 'show_results'}, broadcast=1)
+            stats.message_received('room', {'type': 'show_question'}, broadcast=0)
+
+        self.assertEqual(stats.sent, 3)
+        self.assertEqual(stats.latencies, [0.5, 1.0, 2.5])
+
+
+class QueryPlanTestCase(TestCase):
+    """The hot queries are answered from their indexes(EXPLAIN QUERY PLAN on SQLite)."""
+
+    def assertUsesIndex(self, queryset, index_name):
+        plan = queryset.explain()
+        self.assertIn(f'INDEX {index_name}', plan)
+        self.assertNotRegex(plan, r'SCAN \w+$|SCAN \w+\n')
+
+    def test_query_plans(self):
+        self.assertUsesIndex(Question.objects.filter(quiz_id=1).values_list('id', flat=True), 'question_quiz_order_idx')
+        self.assertUsesIndex(MultiPlayerSession.get_live_sessions().filter(quiz_id=1), 'session_quiz_active_idx')
+        self.assertUsesIndex(Player.objects.order_by('-score', '-id')[:10], 'gui_player_score_')
+        self.assertUsesIndex(Player.objects.filter(multiplayer_score__gt=0).order_by('-multiplayer_score', '-id')[:10], 'gui_player_multiplayer_score_')
+        self.assertUsesIndex(PointsPerDay.objects.filter(player_id__in=[1, 2], date__in=[date.today()]), 'sqlite_autoindex_gui_pointsperday_')
+        self.assertUsesIndex(QuizAttempt(id=1).responses.filter(quiz_id=1, player_id=1), 'response_player_quiz_idx')
+        self.assertUsesIndex(Category.get_not_deleted_instances(), 'category_not_deleted_idx')
+        self.assertUsesIndex(Forum.objects.filter(is_deleted=False), 'forum_not_deleted_idx')
+
+    def test_points_per_day_are_unique(self):
+        player = Player.objects.create(user=User.objects.create(username='player'))
+        PointsPerDay.objects.create(player=player, points=1)
+        with self.assertRaises(IntegrityError):
+            PointsPerDay.objects.create(player=player, points=2)
@@ -0,0 +1,59 @@
+"""Time series of the points earned by a player, built with NumPy. It is imported lazily, like gui.charts."""
+
+from datetime import date
+import numpy as np
+
+
+def get_week_starts(days):
+    """Monday of the week of every day. Day 0 of datetime64 (1970-01-01) is a Thursday, so Monday is 3 days before it."""
+    return days - (days.astype(np.int64) + 3) % 7
+
+
+def rollup(days, points, periods):
+    """Sums the daily points over the periods(the start of the period of each day, ascending)."""
+    starts, first_days = np.unique(periods, return_index=True)
+    return starts, np.add.reduceat(points, first_days)
+
+
+def get_moving_average(points, window):
+    """Trailing moving average over window days. The first days average over the days available so far."""
+    cumulative = np.cumsum(points, dtype=np.float64)
+    before_window = np.zeros(len(points))
+    before_window[window:] = cumulative[:-window]
+    sizes = np.minimum(np.arange(1, len(points) + 1), window)
+    return (cumulative - before_window) / sizes
+
+
+def build_points_series(registration_date, points_per_days, today=None, moving_average_window=7):
+    """Builds the daily points of a player from his registration until today(or his last day with points, if it is later), filling
+    the days without points with zeros, together with the cumulative points, the moving average and the weekly and monthly rollups.
+    points_per_days are (date, points) pairs. Everything is computed with vectorized NumPy operations."""
+    if moving_average_window < 1:
+        raise ValueError(f'moving_average_window must be at least 1, got {moving_average_window}')
+    dates = np.array([day for day, _ in points_per_days], dtype='datetime64[D]')
+    values = np.array([points for _, points in points_per_days], dtype=np.int64)
+
+    start = np.datetime64(registration_date, 'D')
+    end = np.datetime64(today or date.today(), 'D')
+    if len(dates):
+        # points dated before the registration or after today(e.g. changed by the admin, or saved in another time zone) are not lost
+        start = min(start, dates.min())
+        end = max(end, dates.max())
+    end = max(end, start)
+
+    days = np.arange(start, end + np.timedelta64(1, 'D'))
+    daily = np.zeros(len(days), dtype=np.int64)
+    np.add.at(daily, (dates - start).astype(np.int64), values)
+
+    weeks, weekly = rollup(days, daily, get_week_starts(days))
+    months, monthly = rollup(days, daily, days.astype('datetime64[M]'))
+
+    return {
+        'days': days.astype(str).tolist(),
+        'daily': daily.tolist(),
+        'cumulative': np.cumsum(daily).tolist(),
+        'moving_average': np.round(get_moving_average(daily, moving_average_window), 2).tolist(),
+        'moving_average_window': moving_average_window,
+        'weekly': {'weeks': weeks.astype(str).tolist(), 'points': weekly.tolist()},
+        'monthly': {'months': months.astype(str).tolist(), 'points': monthly.tolist()},
+    }
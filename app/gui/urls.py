@@ -14,7 +14,9 @@ urlpatterns = [
     path('password_reset_complete/', auth_views.PasswordResetCompleteView.as_view(template_name='registration/password_reset_complete_temp.html'), name='password_reset_complete'),
     path('rules', views.rules, name='rules'),
     path('leaderboard/', views.leaderboard, name='leaderboard'),
+    path('leaderboard/api/', views.leaderboard_api, name='leaderboard_api'),
     path('multiplayer_leaderboard/', views.multiplayer_leaderboard, name='multiplayer_leaderboard'),
+    path('multiplayer_leaderboard/<str:room_code>/', views.multiplayer_room_results, name='multiplayer_room_results'),
     path('not_found', views.not_found, name='not_found'),
     path('quiz_categories/', views.view_quiz_categories, name='quiz_categories'),
     path('quiz_categories/<category>/', views.view_quizzes_by_category, name='quizzes_by_category'),
@@ -42,6 +44,8 @@ urlpatterns = [
     path('add_in_discussion/', views.add_in_discussion, name='add_in_discussion'),
     path('statistics/', views.view_statistics, name='statistics'),
     path('statistics_for_per_player/', views.view_statistics_for_per_player, name='statistics_for_per_player'),
+    path('statistics_for_per_player/series/', views.view_statistics_for_per_player_series, name='statistics_for_per_player_series'),
     path('statistics_for_each_quiz_score/', views.view_statistics_for_each_quiz_score, name='statistics_for_each_quiz_score'),
+    path('statistics/charts/<chart_name>.png', views.view_statistics_chart, name='statistics_chart'),
     path('multiplayer/<room_code>/', views.view_multiplayer, name='multiplayer'),
 ]
\ No newline at end of file
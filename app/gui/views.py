@@ -3,14 +3,20 @@ from django.http import Http404
 from django.shortcuts import render, redirect
 from django.contrib.auth.decorators import login_required
 from .services import *
-from .models import Player, Quiz, Category, Question, Answer, QuizAttempt, Forum, Discussion, PointsPerDay, MultiPlayerSession
+from .models import Player, Quiz, Category, Question, Answer, QuizAttempt, Forum, Discussion, PointsPerDay, MultiPlayerSession, MultiplayerResult
 from django.db import IntegrityError
 from django.contrib import messages
 from django.contrib.auth.models import User
 from .forms import CategoryForm, QuizForm, QuestionForm, AnswerForm, CreateInForumForm, CreateInDiscussionForm
 from datetime import date
 from django.http import JsonResponse
-import json
+from django.conf import settings
+from django.urls import reverse
+from django.utils.cache import get_conditional_response, patch_cache_control
+from django.utils.http import http_date
+from .chart_cache import chart_cache, get_chart_key, get_cached_chart
+from .chart_renderer import ChartRenderError
+from .leaderboard import update_leaderboard_index
 
 
 def index(request):
@@ -24,7 +30,6 @@ def index(request):
             messages.error(request, 'Player does not exist!')
             return redirect('login')
     
-        change_player_level_by_score(player=player)
         get_player_rank_in_leaderboard(player=player)
         
         context = {
@@ -47,7 +52,9 @@ def register(request):
             try:
                 user = User.objects.create_user(username, email, password);
                 user.save()
-                Player(user=user, registration_date=date.today()).save()
+                player = Player(user=user, registration_date=date.today())
+                player.save()
+                update_leaderboard_index([(player.id, player.score)])
                 messages.success(request, 'Account created')
                 return redirect('login')
             except IntegrityError:
@@ -68,14 +75,35 @@ def rules(request):
 def leaderboard(request):
     """Leaderboard page."""
 
-    profiles = Player.objects.all().order_by('-score')
+    cursor = parse_leaderboard_cursor(request.GET.get('after'))
+    profiles, next_cursor = get_leaderboard_page(cursor=cursor, page_size=settings.LEADERBOARD_PAGE_SIZE)
+
+    player = Player.objects.filter(user=request.user).first()
+    neighbours = []
+    if player is not None:
+        neighbours = get_leaderboard_entries(get_leaderboard_index().neighbours(player.id, settings.LEADERBOARD_NEIGHBOURS))
 
     context = {
         'profiles': profiles,
+        'neighbours': neighbours,
+        'next_cursor': next_cursor,
+        'is_first_page': cursor is None,
         'auth': request.user.is_authenticated
     }
     return render(request, 'quiz/leaderboard.html', context=context)
 
+@login_required(login_url='/login')
+def leaderboard_api(request):
+    """Leaderboard pages as JSON. Uses the same 'after' cursor as the leaderboard page."""
+
+    cursor = parse_leaderboard_cursor(request.GET.get('after'))
+    profiles, next_cursor = get_leaderboard_page(cursor=cursor, page_size=settings.LEADERBOARD_PAGE_SIZE)
+
+    return JsonResponse({
+        'results': [{'rank': rank, 'username': player.user.username, 'score': player.score} for rank, player in profiles],
+        'next': next_cursor
+    })
+
 @login_required(login_url='/login')
 def not_found(request):
     """Not found page."""
@@ -120,7 +148,7 @@ def view_quiz(request, quiz_id):
 
     quiz = Quiz.objects.filter(id=quiz_id).first()
     player = Player.objects.get(user=request.user)
-    active_rooms = MultiPlayerSession.objects.filter(quiz=quiz, active=True).all()
+    active_rooms = MultiPlayerSession.get_live_sessions().filter(quiz=quiz)
 
     if quiz is None:
         messages.error(request, 'Quiz does not exists.')
@@ -145,23 +173,31 @@ def view_quiz(request, quiz_id):
 def view_single_choice_question(request, quiz_id, question_id):
     """Single choice question has only one correct answer, if the user answers correctly the points are added to his profile."""
 
-    quiz = Quiz.objects.filter(id=quiz_id).first()
-    question = Question.objects.filter(id=question_id, quiz=quiz).first()
+    content = get_quiz_content(quiz_id)
+    question = content.get_question(question_id) if content is not None else None
 
-    if quiz is None or question is None:
+    if question is None:
         messages.error(request, 'Quiz or question does not exist!')
         return redirect('not_found')
     
-    next_question = Question.objects.filter(quiz=quiz, id__gt=question.id).first()
+    quiz = content.quiz
+    player = Player.objects.select_related('active_attempt').get(user=request.user)
+    question_order = get_question_order_for_player(quiz, player, quiz_order=content.question_order)
+    if question.id not in question_order:
+        messages.error(request, 'This question is not part of your quiz attempt!')
+        return redirect('not_found')
+
+    next_question_id = question_order.next(question.id)
     
     if request.method == 'POST':
+        next_question = content.get_question(next_question_id)
         return single_choice_answer(request, quiz=quiz, question=question, next_question=next_question)
     
-    answers = Answer.objects.filter(question=question).all()
+    answers = content.get_answers(question.id)
     context = {
         'quiz': quiz, 
         'question': question,
-        'no_next_question': next_question is None,
+        'no_next_question': next_question_id is None,
         'answers': answers
     }
     return render(request, 'quiz/single_choice_question.html', context=context)
@@ -171,22 +207,30 @@ def view_multiple_choice_question(request, quiz_id, question_id):
     """Multiple choice question may has more than one correct answer, for every correct answer 
     given from the user the points are added to his profile."""
 
-    quiz = Quiz.objects.filter(id=quiz_id).first()
-    question = Question.objects.filter(id=question_id, quiz=quiz).first()
+    content = get_quiz_content(quiz_id)
+    question = content.get_question(question_id) if content is not None else None
 
-    if quiz is None or question is None:
+    if question is None:
         return redirect('not_found')
     
-    next_question = Question.objects.filter(quiz=quiz, id__gt=question.id).first()
+    quiz = content.quiz
+    player = Player.objects.select_related('active_attempt').get(user=request.user)
+    question_order = get_question_order_for_player(quiz, player, quiz_order=content.question_order)
+    if question.id not in question_order:
+        messages.error(request, 'This question is not part of your quiz attempt!')
+        return redirect('not_found')
+
+    next_question_id = question_order.next(question.id)
     
     if request.method == 'POST':
+        next_question = content.get_question(next_question_id)
         return multiple_choice_answer(request, quiz=quiz, question=question, next_question=next_question)
         
-    answers = Answer.objects.filter(question=question).all()
+    answers = content.get_answers(question.id)
     context = {
         'quiz': quiz, 
         'question': question,
-        'no_next_question': next_question is None,
+        'no_next_question': next_question_id is None,
         'answers': answers
     }
     return render(request, 'quiz/multiple_choice_question.html', context=context)
@@ -197,21 +241,17 @@ def results(request, quiz_id):
 
     quiz = Quiz.objects.filter(id=quiz_id).first()
     try:
-        player = Player.objects.get(user=request.user)
+        player = Player.objects.select_related('active_attempt').get(user=request.user)
     except Player.DoesNotExist:
         raise Http404("Player does not exist")
 
     if quiz is None or player.active_attempt is None:
         return redirect('not_found')
     
-    questions = Question.objects.filter(quiz=quiz)
-    if not questions.exists():
+    question_results = get_questions_data_results(quiz=quiz, player=player)
+    if not question_results:
         return redirect('not_found')
     
-    question_results = []
-    for question in questions:
-        question_results.append(get_question_data_results(question, player, quiz))
-    
     context = {
         'quiz': quiz,
         'quiz_attempt': player.active_attempt,
@@ -228,6 +268,11 @@ def view_statistics(request):
 
     return render(request, 'statistics/statistics.html')
 
+def get_statistics_chart_url(chart_name, player, statistics=None):
+    """Url of the statistics chart. It contains the hash of the plotted data, so the browser may cache it until the data changes."""
+    plot_name, args = get_statistics_chart(chart_name, player, statistics)
+    return f"{reverse('statistics_chart', kwargs={'chart_name': chart_name})}?v={get_chart_key(plot_name, args)}"
+
 @login_required(login_url='/login')
 def view_statistics_for_per_player(request):
     """Statistic on points earned after the registration of the user in the server so far."""
@@ -237,30 +282,63 @@ def view_statistics_for_per_player(request):
     except Player.DoesNotExist:
         raise Http404("Player does not exist")
     
-    points_per_days = PointsPerDay.objects.filter(player=player)
-    days = [points_per_day.date for points_per_day in points_per_days]
-    points = [points_per_day.points for points_per_day in points_per_days]
-    chart = get_plot_for_per_player_since_registration(days, points, 
-                                                       'Points Earned per Day Since Registration', 'Days Since Registration', 'Points Earned')
     context = {
-        'chart': chart
+        'chart_url': get_statistics_chart_url('per_player', player)
     }
     return render(request, 'statistics/statistics_for_per_player.html', context=context)
 
+@login_required(login_url='/login')
+def view_statistics_for_per_player_series(request):
+    """Points earned per day since the registration of the user, with weekly and monthly rollups, cumulative points and moving average, as JSON."""
+
+    try:
+        player = Player.objects.get(user=request.user)
+    except Player.DoesNotExist:
+        raise Http404("Player does not exist")
+
+    return JsonResponse(get_points_series(player))
+
 @login_required(login_url='/login')
 def view_statistics_for_each_quiz_score(request):
     """Statistic on points earned from the quiz attempts of the users for each quiz."""
 
-    quiz_attemps = QuizAttempt.objects.all()
-    quizzes = [quiz_attempt.quiz.title for quiz_attempt in quiz_attemps]
-    scores = [quiz_attempt.score for quiz_attempt in quiz_attemps]
-    chart = get_plot_for_each_quiz_score(quizzes, scores, 
-                                        'Points earned from each quiz', 'Quizzes', 'Points Earned')
+    statistics = get_quiz_score_statistics()
     context = {
-        'chart': chart
+        'chart_url': get_statistics_chart_url('each_quiz_score', player=None, statistics=statistics),
+        'statistics': statistics
     }
     return render(request, 'statistics/statistics_for_each_quiz_score.html', context=context)
 
+@login_required(login_url='/login')
+def view_statistics_chart(request, chart_name):
+    """PNG image of a statistics chart. Charts are rendered once per distinct data and served from the chart cache, 
+    with ETag and Last-Modified headers so the browser can revalidate them without downloading the image again."""
+
+    player = Player.objects.filter(user=request.user).first()
+    plot_name, args = get_statistics_chart(chart_name, player)
+    key = get_chart_key(plot_name, args)
+    cached_chart = chart_cache.get(key)
+
+    # the ETag is the hash of the plotted data, so the browser copy is up to date even if the chart is no longer in the cache
+    not_modified = get_conditional_response(request, etag=f'"{key}"', last_modified=cached_chart.last_modified if cached_chart else None)
+    if not_modified is not None:
+        return not_modified
+
+    try:
+        chart = get_cached_chart(plot_name, args)
+    except ChartRenderError:
+        response = HttpResponse('The chart is not available right now, please try again later.', status=503, content_type='text/plain')
+        response['Retry-After'] = 5
+        return response
+    response = HttpResponse(chart.png, content_type='image/png')
+    response['ETag'] = chart.etag
+    response['Last-Modified'] = http_date(chart.last_modified)
+    if request.GET.get('v') == key:
+        patch_cache_control(response, private=True, max_age=60 * 60 * 24 * 365, immutable=True)
+    else:
+        patch_cache_control(response, private=True, no_cache=True)
+    return response
+
 @login_required(login_url='/login')
 def create_edit_page(request):
     """Create and edit page."""
@@ -548,11 +626,36 @@ def view_multiplayer(request, room_code):
     
 @login_required(login_url='/login')
 def multiplayer_leaderboard(request):
-    """Multiplayer leaderboard page."""
+    """Multiplayer leaderboard page - the best players of all multiplayer games. Browsers reuse it for MULTIPLAYER_LEADERBOARD_MAX_AGE seconds."""
+
+    context = {
+        'results': get_multiplayer_leaderboard(settings.LEADERBOARD_PAGE_SIZE)
+    }
+    response = render(request, 'quiz/multiplayer_leaderboard.html', context=context)
+    patch_cache_control(response, private=True, max_age=settings.MULTIPLAYER_LEADERBOARD_MAX_AGE)
+    return response
+
+@login_required(login_url='/login')
+def multiplayer_room_results(request, room_code):
+    """Results of the last game played in the room, as stored when it finished. Served with ETag and Last-Modified headers, 
+    so the browser revalidates them without downloading the page again until the room finishes another game."""
+
+    result = MultiplayerResult.objects.filter(room_code=room_code).first()
+    if result is None:
+        messages.error(request, 'Room has no finished game!')
+        return redirect('not_found')
+
+    last_modified = int(result.finished.timestamp()) # HTTP dates have whole seconds
+    etag = f'"{int(result.finished.timestamp() * 1000000)}"' # the room code is user input, so it is kept out of the header
+    not_modified = get_conditional_response(request, etag=etag, last_modified=last_modified)
+    if not_modified is not None:
+        return not_modified
 
-    results = request.GET.get('results', '[]')
-    results = json.loads(results)
     context = {
-        'results': results
+        'results': result.get_results()
     }
-    return render(request, 'quiz/multiplayer_leaderboard.html', context=context)
+    response = render(request, 'quiz/multiplayer_leaderboard.html', context=context)
+    response['ETag'] = etag
+    response['Last-Modified'] = http_date(last_modified)
+    patch_cache_control(response, private=True, no_cache=True)
+    return response